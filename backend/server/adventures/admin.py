@@ -2,7 +2,7 @@ import os
 from django.contrib import admin
 from django.utils.html import mark_safe, format_html
 from django.urls import reverse
-from .models import Location, Checklist, ChecklistItem, Collection, Transportation, Note, ContentImage, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity, CollectionItineraryItem, CollectionItineraryDay
+from .models import Location, Checklist, ChecklistItem, Collection, Transportation, Note, ContentImage, Visit, Category, ContentAttachment, Lodging, CollectionInvite, Trail, Activity, CollectionItineraryItem, CollectionItineraryDay, GeocodeCacheEntry
 from worldtravel.models import Country, Region, VisitedRegion, City, VisitedCity
 from allauth.account.decorators import secure_admin_login
 
@@ -147,6 +147,11 @@ class CollectionAdmin(admin.ModelAdmin):
 class ActivityAdmin(admin.ModelAdmin):
     list_display = ('name', 'user', 'visit__location', 'sport_type', 'distance', 'elevation_gain', 'moving_time')
 
+class GeocodeCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'kind', 'provider', 'is_negative', 'hit_count', 'last_used_at', 'expires_at')
+    list_filter = ('kind', 'provider', 'is_negative')
+    search_fields = ('key',)
+
 class CollectionItineraryItemAdmin(admin.ModelAdmin):
     list_display = ('collection', 'content_type', 'object_link', 'date', 'order')
     search_fields = ('collection__name', 'content_type__model')
@@ -195,6 +200,7 @@ admin.site.register(Trail)
 admin.site.register(Activity, ActivityAdmin)
 admin.site.register(CollectionItineraryItem, CollectionItineraryItemAdmin)
 admin.site.register(CollectionItineraryDay)
+admin.site.register(GeocodeCacheEntry, GeocodeCacheEntryAdmin)
 
 admin.site.site_header = 'AdventureLog Admin'
 admin.site.site_title = 'AdventureLog Admin Site'
@@ -1,14 +1,36 @@
 import requests
 import time
 import socket
-import re
-import unicodedata
-from worldtravel.models import Region, City, VisitedRegion, VisitedCity
+from worldtravel.models import Region, VisitedRegion, VisitedCity
+from worldtravel.locality_index import get_region_locality_index
 from django.conf import settings
+from adventures.utils.geocode_cache import (
+    cache_result,
+    get_cached_result,
+    reverse_cache_key,
+    search_cache_key,
+)
+from adventures.utils.rate_limit import acquire_provider_slot
 
 # -----------------
 # SEARCHING
+def _cached_search(provider, query, fetch):
+    cache_key = search_cache_key(provider, query)
+    cached = get_cached_result(cache_key)
+    if cached is not None:
+        return cached
+
+    if not acquire_provider_slot(provider):
+        return {"error": "Too many geocoding requests. Please try again later."}
+
+    results = fetch(query)
+    cache_result(cache_key, provider, 'search', results)
+    return results
+
 def search_google(query):
+    return _cached_search('google', query, _search_google)
+
+def _search_google(query):
     try:
         api_key = settings.GOOGLE_MAPS_API_KEY
         if not api_key:
@@ -127,6 +149,9 @@ def _infer_addresstype(type_):
 
 
 def search_osm(query):
+    return _cached_search('osm', query, _search_osm)
+
+def _search_osm(query):
     try:
         url = f"https://nominatim.openstreetmap.org/search?q={query}&format=jsonv2"
         headers = {'User-Agent': 'AdventureLog Server'}
@@ -181,11 +206,43 @@ def extractIsoCode(user, data):
     Extract the ISO code from the response data.
     Returns a dictionary containing the region name, country name, and ISO code if found.
     """
+    return _add_visited_flags(user, _resolve_address(data))
+
+def _add_visited_flags(user, resolved):
+    """
+    Add the user's visited state to a user-independent result from
+    _resolve_address (or the offline geocoder).
+    """
+    if "error" in resolved:
+        return resolved
+
+    region_visited = VisitedRegion.objects.filter(region_id=resolved["region_id"], user=user).exists()
+    city_visited = False
+    if resolved.get("city_id"):
+        city_visited = VisitedCity.objects.filter(city_id=resolved["city_id"], user=user).exists()
+
+    return {
+        "region_id": resolved["region_id"],
+        "region": resolved["region"],
+        "country": resolved["country"],
+        "country_id": resolved["country_id"],
+        "region_visited": region_visited,
+        "display_name": resolved["display_name"],
+        "city": resolved.get("city"),
+        "city_id": resolved.get("city_id"),
+        "city_visited": city_visited,
+        'location_name': resolved.get("location_name"),
+    }
+
+def _resolve_address(data):
+    """
+    Resolve a Nominatim-style response to AdventureLog's region/city/country.
+    The result does not depend on the requesting user, so it can be cached.
+    """
     iso_code = None
     display_name = None
     country_code = None
     city = None
-    visited_city = None
     location_name = None
 
     if 'name' in data.keys():
@@ -245,7 +302,7 @@ def extractIsoCode(user, data):
     for candidate in iso_candidates:
         if len(str(candidate)) <= 2:
             continue
-        match = Region.objects.filter(id=candidate).first()
+        match = Region.objects.select_related('country').filter(id=candidate).first()
         if match and match not in region_candidates:
             region_candidates.append(match)
 
@@ -253,7 +310,7 @@ def extractIsoCode(user, data):
 
     # Fallback: attempt to resolve region by name and country code when no ISO match.
     if not region and state_name:
-        region_queryset = Region.objects.filter(name__iexact=state_name)
+        region_queryset = Region.objects.select_related('country').filter(name__iexact=state_name)
         if country_code:
             region_queryset = region_queryset.filter(country__country_code=country_code)
         region = region_queryset.first()
@@ -270,9 +327,6 @@ def extractIsoCode(user, data):
     if not country_code:
         country_code = region.country.country_code
 
-    region_visited = False
-    city_visited = False
-
     # ordered preference for best-effort locality matching
     locality_keys = [
         'suburb',
@@ -288,33 +342,22 @@ def extractIsoCode(user, data):
         'county',
     ]
 
-    def _normalize_name(value):
-        normalized = unicodedata.normalize("NFKD", value)
-        ascii_only = normalized.encode("ascii", "ignore").decode("ascii")
-        return re.sub(r"[^a-z0-9]", "", ascii_only.lower())
-
     def match_locality(key_name, target_region):
         value = address.get(key_name)
         if not value:
             return None
-        qs = City.objects.filter(region=target_region)
+        index = get_region_locality_index(target_region.id)
 
         # Use exact matches first to avoid broad county/name collisions (e.g. Troms vs Tromsø).
-        exact_match = qs.filter(name__iexact=value).first()
-        if exact_match:
-            return exact_match
-
-        normalized_value = _normalize_name(value)
-        for candidate in qs.values_list('id', 'name'):
-            candidate_id, candidate_name = candidate
-            if _normalize_name(candidate_name) == normalized_value:
-                return qs.filter(id=candidate_id).first()
+        match = index.exact(value) or index.normalized(value)
+        if match:
+            return match
 
         # Allow partial matching for most locality fields but keep county strict.
         if key_name == 'county':
             return None
 
-        return qs.filter(name__icontains=value).first()
+        return index.containing(value)
 
     chosen_region = region
     for candidate_region in region_candidates or [region]:
@@ -329,13 +372,9 @@ def extractIsoCode(user, data):
 
     region = chosen_region
     iso_code = region.id
-    visited_region = VisitedRegion.objects.filter(region=region, user=user).first()
-    region_visited = bool(visited_region)
 
     if city:
         display_name = f"{city.name}, {region.name}, {country_code or region.country.country_code}"
-        visited_city = VisitedCity.objects.filter(city=city, user=user).first()
-        city_visited = bool(visited_city)
     else:
         display_name = f"{region.name}, {country_code or region.country.country_code}"
 
@@ -344,11 +383,9 @@ def extractIsoCode(user, data):
         "region": region.name,
         "country": region.country.name,
         "country_id": region.country.country_code,
-        "region_visited": region_visited,
         "display_name": display_name,
         "city": city.name if city else None,
         "city_id": city.id if city else None,
-        "city_visited": city_visited,
         'location_name': location_name,
     }
 
@@ -360,6 +397,17 @@ def is_host_resolvable(hostname: str) -> bool:
         return False
 
 def reverse_geocode(lat, lon, user):
+    """
+    Reverse geocode a coordinate according to settings.GEOCODING_MODE:
+    'remote' (Google/OSM only), 'offline' (local index only) or
+    'offline-first' (local index, falling back to the remote providers).
+    """
+    mode = getattr(settings, 'GEOCODING_MODE', 'remote')
+    if mode in ('offline', 'offline-first'):
+        offline_result = reverse_geocode_offline(lat, lon, user)
+        if mode == 'offline' or "error" not in offline_result:
+            return offline_result
+
     if getattr(settings, 'GOOGLE_MAPS_API_KEY', None):
         google_result = reverse_geocode_google(lat, lon, user)
         if "error" not in google_result:
@@ -368,20 +416,48 @@ def reverse_geocode(lat, lon, user):
         return reverse_geocode_osm(lat, lon, user)
     return reverse_geocode_osm(lat, lon, user)
 
+def reverse_geocode_offline(lat, lon, user):
+    from worldtravel.spatial_index import get_offline_geocoder
+
+    try:
+        match = get_offline_geocoder().lookup(lat, lon)
+    except Exception:
+        return {"error": "An unexpected error occurred during offline geocoding. Please try again."}
+
+    if not match:
+        return {"error": "No region found"}
+
+    if match['city_id']:
+        display_name = f"{match['city']}, {match['region']}, {match['country_id']}"
+    else:
+        display_name = f"{match['region']}, {match['country_id']}"
+
+    return _add_visited_flags(user, {**match, "display_name": display_name})
+
 def reverse_geocode_osm(lat, lon, user):
     url = f"https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat={lat}&lon={lon}"
     headers = {'User-Agent': 'AdventureLog Server'}
     connect_timeout = 1
     read_timeout = 5
 
+    cache_key = reverse_cache_key('osm', lat, lon)
+    cached = get_cached_result(cache_key)
+    if cached is not None:
+        return _add_visited_flags(user, cached)
+
     if not is_host_resolvable("nominatim.openstreetmap.org"):
         return {"error": "Unable to resolve OpenStreetMap service. Please check your internet connection."}
 
+    if not acquire_provider_slot('osm'):
+        return {"error": "Too many requests to OpenStreetMap. Please try again later."}
+
     try:
         response = requests.get(url, headers=headers, timeout=(connect_timeout, read_timeout))
         response.raise_for_status()
         data = response.json()
-        return extractIsoCode(user, data)
+        resolved = _resolve_address(data)
+        cache_result(cache_key, 'osm', 'reverse', resolved)
+        return _add_visited_flags(user, resolved)
     except requests.exceptions.Timeout:
         return {"error": "Request timed out while contacting OpenStreetMap. Please try again."}
     except requests.exceptions.ConnectionError:
@@ -406,6 +482,14 @@ def reverse_geocode_google(lat, lon, user):
     url = "https://maps.googleapis.com/maps/api/geocode/json"
     params = {"latlng": f"{lat},{lon}", "key": api_key}
 
+    cache_key = reverse_cache_key('google', lat, lon)
+    cached = get_cached_result(cache_key)
+    if cached is not None:
+        return _add_visited_flags(user, cached)
+
+    if not acquire_provider_slot('google'):
+        return {"error": "Too many requests to Google Maps. Please try again later."}
+
     try:
         response = requests.get(url, params=params, timeout=(2, 5))
         response.raise_for_status()
@@ -414,7 +498,9 @@ def reverse_geocode_google(lat, lon, user):
         status = data.get("status")
         if status != "OK":
             if status == "ZERO_RESULTS":
-                return {"error": "No location found for the given coordinates."}
+                result = {"error": "No location found for the given coordinates."}
+                cache_result(cache_key, 'google', 'reverse', result)
+                return result
             elif status == "OVER_QUERY_LIMIT":
                 return {"error": "Query limit exceeded for Google Maps. Please try again later."}
             elif status == "REQUEST_DENIED":
@@ -430,7 +516,9 @@ def reverse_geocode_google(lat, lon, user):
             "name": first_result.get("formatted_address"),
             "address": _parse_google_address_components(first_result.get("address_components", []))
         }
-        return extractIsoCode(user, result_data)
+        resolved = _resolve_address(result_data)
+        cache_result(cache_key, 'google', 'reverse', resolved)
+        return _add_visited_flags(user, resolved)
     except requests.exceptions.Timeout:
         return {"error": "Request timed out while contacting Google Maps. Please try again."}
     except requests.exceptions.ConnectionError:
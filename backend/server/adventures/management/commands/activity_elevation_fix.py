@@ -1,21 +1,70 @@
 """
 Django management command to recalculate elevation data for all activities with GPX files.
 
+Activities are walked in id order (keyset pagination). The GPX files of each
+batch are parsed in a pool of worker processes and the changed rows are
+written with one bulk_update per batch. After every batch the last processed
+id is saved to a checkpoint file, so an interrupted run continues where it
+stopped when started again.
+
 Usage:
-    python manage.py recalculate_elevation
-    python manage.py recalculate_elevation --dry-run
-    python manage.py recalculate_elevation --activity-id 123
+    python manage.py activity_elevation_fix
+    python manage.py activity_elevation_fix --dry-run
+    python manage.py activity_elevation_fix --activity-id 6f1c...
+    python manage.py activity_elevation_fix --workers 8 --batch-size 200
+    python manage.py activity_elevation_fix --restart
 """
 
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
-from adventures.models import Activity
-import gpxpy
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from adventures.models import Activity, Location
+from adventures.utils.gpx_analysis import analyze_gpx
+from adventures.utils.response_cache import collection_user_ids, schedule_generation_bump
+from adventures.utils.user_stats import refresh_user_stats
+from concurrent.futures import ProcessPoolExecutor
 from typing import Tuple
+import json
 import logging
+import multiprocessing
+import os
+import tempfile
+import time
 
 logger = logging.getLogger(__name__)
 
+ELEVATION_FIELDS = ['elevation_gain', 'elevation_loss', 'elev_high', 'elev_low']
+
+DEFAULT_CHECKPOINT = os.path.join(tempfile.gettempdir(), 'activity_elevation_fix.checkpoint.json')
+
+
+def get_elevation_data_from_gpx(file_name) -> Tuple[float, float, float, float]:
+    """
+    Extract elevation data from a stored GPX file.
+    Returns: (elevation_gain, elevation_loss, elevation_high, elevation_low)
+    """
+    with default_storage.open(file_name, 'rb') as f:
+        analysis = analyze_gpx(f)
+
+    # If no elevation data found, return zeros
+    if analysis.elevation_high is None:
+        return 0.0, 0.0, 0.0, 0.0
+
+    return (
+        analysis.elevation_gain,
+        analysis.elevation_loss,
+        analysis.elevation_high,
+        analysis.elevation_low,
+    )
+
+
+def _analyze_file(file_name):
+    """Worker entry point; errors are returned so one bad file doesn't fail its batch."""
+    try:
+        return get_elevation_data_from_gpx(file_name), None
+    except Exception as e:
+        return None, str(e)
+
 
 class Command(BaseCommand):
     help = 'Recalculate elevation data for activities with GPX files'
@@ -28,7 +77,6 @@ class Command(BaseCommand):
         )
         parser.add_argument(
             '--activity-id',
-            type=int,
             help='Recalculate elevation for a specific activity ID only',
         )
         parser.add_argument(
@@ -37,11 +85,29 @@ class Command(BaseCommand):
             default=100,
             help='Number of activities to process in each batch (default: 100)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes parsing GPX files (default: number of CPUs)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=DEFAULT_CHECKPOINT,
+            help=f'File recording the progress of the run (default: {DEFAULT_CHECKPOINT})',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore an existing checkpoint and start from the first activity',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         activity_id = options.get('activity_id')
-        batch_size = options['batch_size']
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+        checkpoint_path = options['checkpoint']
 
         if dry_run:
             self.stdout.write(
@@ -50,50 +116,98 @@ class Command(BaseCommand):
 
         # Build queryset
         queryset = Activity.objects.filter(gpx_file__isnull=False).exclude(gpx_file='')
-        
+
         if activity_id:
             queryset = queryset.filter(id=activity_id)
             if not queryset.exists():
                 raise CommandError(f'Activity with ID {activity_id} not found or has no GPX file')
 
+        # Single-activity and dry runs don't record progress
+        use_checkpoint = not (activity_id or dry_run)
+        checkpoint = {'last_id': None, 'processed': 0, 'updated': 0, 'errors': 0}
+        if use_checkpoint and not options['restart']:
+            checkpoint.update(self._load_checkpoint(checkpoint_path))
+            if checkpoint['last_id']:
+                self.stdout.write(
+                    f'Resuming after activity {checkpoint["last_id"]} '
+                    f'({checkpoint["processed"]} already processed)'
+                )
+
+        if checkpoint['last_id']:
+            queryset = queryset.filter(id__gt=checkpoint['last_id'])
+
         total_count = queryset.count()
-        
+
         if total_count == 0:
             self.stdout.write(
                 self.style.WARNING('No activities found with GPX files')
             )
+            if use_checkpoint:
+                self._clear_checkpoint(checkpoint_path)
             return
 
         self.stdout.write(f'Found {total_count} activities with GPX files to process')
 
-        updated_count = 0
-        error_count = 0
-        
-        # Process in batches to avoid memory issues with large datasets
-        for i in range(0, total_count, batch_size):
-            batch = queryset[i:i + batch_size]
-            
-            for activity in batch:
-                try:
-                    if self._process_activity(activity, dry_run):
-                        updated_count += 1
-                    
-                    # Progress indicator
-                    if (updated_count + error_count) % 50 == 0:
-                        self.stdout.write(
-                            f'Processed {updated_count + error_count}/{total_count} activities...'
-                        )
-                        
-                except Exception as e:
-                    error_count += 1
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Error processing activity {activity.id}: {str(e)}'
-                        )
-                    )
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Workers inherit the configured Django app registry through fork
+            workers = 1
+        executor = None
+        if workers > 1 and total_count > 1:
+            # Fork the workers before the batches open a database connection;
+            # with the fork start method the pool starts all of them on first use.
+            connections.close_all()
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+            executor.submit(int).result()
+
+        processed = updated_count = error_count = 0
+        started = time.monotonic()
+        queryset = queryset.order_by('id').only('id', 'user_id', 'gpx_file', *ELEVATION_FIELDS)
+        last_id = None
+
+        try:
+            while True:
+                # Keyset pagination: each batch starts after the last id of the previous one
+                page = queryset.filter(id__gt=last_id) if last_id else queryset
+                batch = list(page[:batch_size])
+                if not batch:
+                    break
+
+                batch_updated, batch_errors = self._process_batch(batch, executor, dry_run)
+                last_id = batch[-1].id
+                processed += len(batch)
+                updated_count += batch_updated
+                error_count += batch_errors
+
+                if use_checkpoint:
+                    self._save_checkpoint(checkpoint_path, {
+                        'last_id': str(last_id),
+                        'processed': checkpoint['processed'] + processed,
+                        'updated': checkpoint['updated'] + updated_count,
+                        'errors': checkpoint['errors'] + error_count,
+                    })
+
+                # Progress indicator
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Processed {processed}/{total_count} activities '
+                    f'({processed / elapsed:.1f} activities/s)...'
+                )
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        elapsed = time.monotonic() - started
+        if use_checkpoint:
+            self._clear_checkpoint(checkpoint_path)
+            updated_count += checkpoint['updated']
+            error_count += checkpoint['errors']
 
         # Summary
         self.stdout.write('\n' + '='*50)
+        self.stdout.write(
+            f'Processed {processed} activities in {elapsed:.1f}s '
+            f'({processed / elapsed if elapsed else processed:.1f} activities/s, {workers} worker(s))'
+        )
         if dry_run:
             self.stdout.write(
                 self.style.SUCCESS(
@@ -106,65 +220,69 @@ class Command(BaseCommand):
                     f'Successfully updated {updated_count} activities'
                 )
             )
-        
+
         if error_count > 0:
             self.stdout.write(
                 self.style.WARNING(f'Encountered errors with {error_count} activities')
             )
 
-    def _process_activity(self, activity, dry_run=False):
-        """Process a single activity and return True if it was updated."""
-        try:
-            # Get elevation data from GPX file
-            elevation_gain, elevation_loss, elevation_high, elevation_low = \
-                self._get_elevation_data_from_gpx(activity.gpx_file)
+    def _process_batch(self, batch, executor, dry_run=False):
+        """Recalculate a batch of activities and bulk update the changed ones. Returns (updated, errors)."""
+        file_names = [activity.gpx_file.name for activity in batch]
+        if executor:
+            results = list(executor.map(_analyze_file, file_names))
+        else:
+            results = [_analyze_file(name) for name in file_names]
+
+        changed = []
+        error_count = 0
+        for activity, (new_values, error) in zip(batch, results):
+            if error:
+                error_count += 1
+                logger.error(f'Error processing activity {activity.id}: {error}')
+                self.stdout.write(
+                    self.style.ERROR(
+                        f'Error processing activity {activity.id}: {error}'
+                    )
+                )
+                continue
 
             # Check if values would actually change
-            current_values = (
-                getattr(activity, 'elevation_gain', None) or 0,
-                getattr(activity, 'elevation_loss', None) or 0,
-                getattr(activity, 'elev_high', None) or 0,
-                getattr(activity, 'elev_low', None) or 0,
-            )
-            
-            new_values = (elevation_gain, elevation_loss, elevation_high, elevation_low)
-            
+            current_values = tuple(getattr(activity, name, None) or 0 for name in ELEVATION_FIELDS)
+
             # Only update if values are different (with small tolerance for floating point)
-            if self._values_significantly_different(current_values, new_values):
-                
-                if dry_run:
-                    self.stdout.write(
-                        f'Activity {activity.id}: '
-                        f'gain: {current_values[0]:.1f} → {new_values[0]:.1f}, '
-                        f'loss: {current_values[1]:.1f} → {new_values[1]:.1f}, '
-                        f'high: {current_values[2]:.1f} → {new_values[2]:.1f}, '
-                        f'low: {current_values[3]:.1f} → {new_values[3]:.1f}'
-                    )
-                    return True
-                else:
-                    # Update the activity
-                    with transaction.atomic():
-                        activity.elevation_gain = elevation_gain
-                        activity.elevation_loss = elevation_loss
-                        activity.elev_high = elevation_high
-                        activity.elev_low = elevation_low
-                        activity.save(update_fields=[
-                            'elevation_gain', 'elevation_loss', 'elev_high', 'elev_low'
-                        ])
-                    
-                    self.stdout.write(
-                        f'Updated activity {activity.id}: '
-                        f'gain: {elevation_gain:.1f}m, loss: {elevation_loss:.1f}m, '
-                        f'high: {elevation_high:.1f}m, low: {elevation_low:.1f}m'
-                    )
-                    return True
+            if not self._values_significantly_different(current_values, new_values):
+                continue
+
+            if dry_run:
+                self.stdout.write(
+                    f'Activity {activity.id}: '
+                    f'gain: {current_values[0]:.1f} → {new_values[0]:.1f}, '
+                    f'loss: {current_values[1]:.1f} → {new_values[1]:.1f}, '
+                    f'high: {current_values[2]:.1f} → {new_values[2]:.1f}, '
+                    f'low: {current_values[3]:.1f} → {new_values[3]:.1f}'
+                )
             else:
-                # Values are the same, skip
-                return False
-                
-        except Exception as e:
-            logger.error(f'Error processing activity {activity.id}: {str(e)}')
-            raise
+                for name, value in zip(ELEVATION_FIELDS, new_values):
+                    setattr(activity, name, value)
+            changed.append(activity)
+
+        if changed and not dry_run:
+            with transaction.atomic():
+                Activity.objects.bulk_update(changed, ELEVATION_FIELDS)
+            # bulk_update skips the signals that keep UserStats and cached responses current
+            owner_ids = {activity.user_id for activity in changed}
+            refresh_user_stats(owner_ids, sections=('activities',))
+            user_ids, collection_ids = set(owner_ids), set()
+            for location_user_id, collection_id in Location.objects.filter(
+                visits__activities__in=changed
+            ).values_list('user_id', 'collections'):
+                user_ids.add(location_user_id)
+                collection_ids.add(collection_id)
+            collection_ids.discard(None)
+            schedule_generation_bump(user_ids | collection_user_ids(collection_ids))
+
+        return len(changed), error_count
 
     def _values_significantly_different(self, current, new, tolerance=0.1):
         """Check if elevation values are significantly different."""
@@ -173,71 +291,24 @@ class Command(BaseCommand):
                 return True
         return False
 
-    def _get_elevation_data_from_gpx(self, gpx_file) -> Tuple[float, float, float, float]:
-        """
-        Extract elevation data from a GPX file.
-        Returns: (elevation_gain, elevation_loss, elevation_high, elevation_low)
-        """
+    def _load_checkpoint(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read checkpoint {path}: {e}. Use --restart to start over.')
+
+    def _save_checkpoint(self, path, data):
+        # Write to a temporary file first so a kill mid-write can't corrupt the checkpoint
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _clear_checkpoint(self, path):
         try:
-            # Parse the GPX file
-            gpx_file.seek(0)  # Reset file pointer if needed
-            gpx = gpxpy.parse(gpx_file)
-            
-            elevations = []
-            
-            # Extract all elevation points from tracks and track segments
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        if point.elevation is not None:
-                            elevations.append(point.elevation)
-            
-            # Also check waypoints for elevation data
-            for waypoint in gpx.waypoints:
-                if waypoint.elevation is not None:
-                    elevations.append(waypoint.elevation)
-            
-            # If no elevation data found, return zeros
-            if not elevations:
-                return 0.0, 0.0, 0.0, 0.0
-            
-            # Calculate basic stats
-            elevation_high = max(elevations)
-            elevation_low = min(elevations)
-            
-            # Calculate gain and loss by comparing consecutive points
-            elevation_gain = 0.0
-            elevation_loss = 0.0
-            
-            # Apply simple smoothing to reduce GPS noise (optional)
-            smoothed_elevations = self._smooth_elevations(elevations)
-            
-            for i in range(1, len(smoothed_elevations)):
-                diff = smoothed_elevations[i] - smoothed_elevations[i-1]
-                if diff > 0:
-                    elevation_gain += diff
-                else:
-                    elevation_loss += abs(diff)
-            
-            return elevation_gain, elevation_loss, elevation_high, elevation_low
-            
-        except Exception as e:
-            logger.error(f"Error parsing GPX file: {e}")
-            raise
-
-    def _smooth_elevations(self, elevations, window_size=3):
-        """
-        Apply simple moving average smoothing to reduce GPS elevation noise.
-        """
-        if len(elevations) < window_size:
-            return elevations
-        
-        smoothed = []
-        half_window = window_size // 2
-        
-        for i in range(len(elevations)):
-            start = max(0, i - half_window)
-            end = min(len(elevations), i + half_window + 1)
-            smoothed.append(sum(elevations[start:end]) / (end - start))
-        
-        return smoothed
\ No newline at end of file
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,135 @@
+"""
+Benchmark the GPX analysis engine against a plain gpxpy parse.
+
+Without --file a synthetic multi-day track is generated, so the numbers can be
+compared between machines and releases.
+
+Usage:
+    python manage.py benchmark_gpx
+    python manage.py benchmark_gpx --points 250000 --repeat 5
+    python manage.py benchmark_gpx --file /path/to/track.gpx
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from adventures.utils.gpx_analysis import analyze_gpx
+from datetime import datetime, timedelta, timezone
+import gpxpy
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+
+def write_synthetic_gpx(path, points, segments=3, seed=1):
+    """Write a GPX track of `points` points split into `segments` segments (one per day)."""
+    rng = random.Random(seed)
+    lat, lon, ele = 45.0, 7.0, 500.0
+    moment = datetime(2024, 6, 1, 6, tzinfo=timezone.utc)
+    per_segment = max(1, points // segments)
+
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<gpx version="1.1" creator="AdventureLog benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        f.write('<trk><name>Benchmark track</name>\n')
+        for segment in range(segments):
+            f.write('<trkseg>\n')
+            for i in range(per_segment):
+                heading = math.sin(i / 500) * math.pi
+                lat += math.cos(heading) * 4e-5 + rng.uniform(-5e-6, 5e-6)
+                lon += math.sin(heading) * 4e-5 + rng.uniform(-5e-6, 5e-6)
+                ele += math.sin(i / 300) * 0.5 + rng.uniform(-0.8, 0.8)
+                moment += timedelta(seconds=rng.choice((1, 1, 2, 3, 30)))
+                f.write(
+                    f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{ele:.1f}</ele>'
+                    f'<time>{moment.strftime("%Y-%m-%dT%H:%M:%SZ")}</time></trkpt>\n'
+                )
+            f.write('</trkseg>\n')
+            moment += timedelta(hours=12)
+        f.write('</trk>\n</gpx>\n')
+
+
+def _gpxpy_analysis(path):
+    """The per-request work done before the analysis engine existed."""
+    with open(path, 'r') as f:
+        gpx = gpxpy.parse(f)
+    elevations = [p.elevation for t in gpx.tracks for s in t.segments for p in s.points if p.elevation is not None]
+    return gpx.length_3d(), gpx.get_moving_data(), gpx.get_elevation_extremes(), len(elevations)
+
+
+def _measure(func, path, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(path)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+class Command(BaseCommand):
+    help = 'Benchmark GPX analysis against gpxpy'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            help='GPX file to benchmark (default: a generated track)',
+        )
+        parser.add_argument(
+            '--points',
+            type=int,
+            default=100000,
+            help='Number of points in the generated track (default: 100000)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of timed runs; the fastest is reported (default: 3)',
+        )
+        parser.add_argument(
+            '--skip-gpxpy',
+            action='store_true',
+            help='Only benchmark the analysis engine',
+        )
+
+    def handle(self, *args, **options):
+        repeat = max(1, options['repeat'])
+        path = options.get('file')
+        generated = None
+
+        if path:
+            if not os.path.isfile(path):
+                raise CommandError(f'File {path} not found')
+        else:
+            fd, generated = tempfile.mkstemp(suffix='.gpx')
+            os.close(fd)
+            write_synthetic_gpx(generated, options['points'])
+            path = generated
+
+        try:
+            size_mb = os.path.getsize(path) / 1e6
+            analysis = analyze_gpx(path)
+            self.stdout.write(
+                f'{path}: {size_mb:.1f} MB, {analysis.point_count} points, '
+                f'{analysis.length_3d / 1000:.1f} km, +{analysis.elevation_gain:.0f} m / -{analysis.elevation_loss:.0f} m'
+            )
+
+            seconds, peak = _measure(analyze_gpx, path, repeat)
+            self.stdout.write(f'  analyze_gpx: {seconds * 1000:8.0f} ms, peak memory {peak / 1e6:7.1f} MB')
+
+            if not options['skip_gpxpy']:
+                baseline_seconds, baseline_peak = _measure(_gpxpy_analysis, path, repeat)
+                self.stdout.write(f'  gpxpy:       {baseline_seconds * 1000:8.0f} ms, peak memory {baseline_peak / 1e6:7.1f} MB')
+                self.stdout.write(self.style.SUCCESS(
+                    f'Speedup {baseline_seconds / seconds:.1f}x, '
+                    f'{baseline_peak / max(peak, 1):.1f}x less memory'
+                ))
+        finally:
+            if generated:
+                os.remove(generated)
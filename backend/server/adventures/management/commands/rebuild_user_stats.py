@@ -0,0 +1,48 @@
+"""
+Rebuild the materialized UserStats rows from the source tables.
+
+Signals keep the rows current during normal use; run this after bulk SQL
+changes, restores, or to repair drift.
+
+Usage:
+    python manage.py rebuild_user_stats
+    python manage.py rebuild_user_stats --user-id 123
+    python manage.py rebuild_user_stats --section activities
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from adventures.utils.user_stats import SECTIONS, rebuild_user_stats, refresh_user_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized per-user stats'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-id',
+            type=int,
+            help='Rebuild stats for a specific user ID only',
+        )
+        parser.add_argument(
+            '--section',
+            action='append',
+            choices=SECTIONS,
+            help='Only rebuild this section (can be repeated, default: all)',
+        )
+
+    def handle(self, *args, **options):
+        sections = tuple(options['section'] or SECTIONS)
+        user_id = options.get('user_id')
+
+        if user_id:
+            if not User.objects.filter(id=user_id).exists():
+                raise CommandError(f'User with ID {user_id} not found')
+            refresh_user_stats([user_id], sections)
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for user {user_id}'))
+            return
+
+        count = rebuild_user_stats(sections)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {count} user(s)'))
@@ -1,28 +1,150 @@
 """
 Django management command to synchronize visited regions and cities based on user locations.
 
-This command processes all users' visited locations and marks their regions and cities as visited.
+This command marks the regions and cities of users' visited locations as visited.
 It's designed to be run periodically (e.g., nightly cron job) to keep visited regions/cities up to date.
 
+By default only locations and visits changed since the last successful run are
+considered (tracked with a SyncWatermark), so the cost follows the day's changes
+rather than the size of the history. The first run, --full and --user-id scan
+everything. Visited regions/cities are computed in SQL with one
+INSERT ... SELECT DISTINCT ... ON CONFLICT DO NOTHING per batch of users, and
+batches are spread over worker processes.
+
 Usage:
     python manage.py sync_visited_regions
+    python manage.py sync_visited_regions --full
     python manage.py sync_visited_regions --dry-run
     python manage.py sync_visited_regions --user-id 123
-    python manage.py sync_visited_regions --batch-size 50
+    python manage.py sync_visited_regions --batch-size 50 --workers 4
 """
 
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.db.models import Prefetch, Q
-from adventures.models import Location
-from worldtravel.models import Region, City, VisitedRegion, VisitedCity
+from django.db import connection, connections, transaction
+from django.utils import timezone
+from adventures.utils.get_is_visited import visited_cutoff
+from adventures.utils.response_cache import schedule_generation_bump
+from adventures.utils.user_stats import refresh_user_stats
+from worldtravel.models import SyncWatermark
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+import multiprocessing
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
 
+WATERMARK_NAME = 'sync_visited_regions'
+
+# Rows committed by transactions that were still open when the previous run
+# started can carry an updated_at just before its watermark; re-scan this window.
+WATERMARK_OVERLAP = timedelta(minutes=10)
+
+# A location counts as visited once one of its visits has started (see
+# adventures.utils.get_is_visited.is_location_visited).
+VISITED_FILTER = """
+    EXISTS (
+        SELECT 1 FROM adventures_visit v
+        WHERE v.location_id = l.id AND v.start_date < %(cutoff)s
+    )
+"""
+
+# Locations edited since the watermark, or whose visits were edited or have
+# started since then (a planned visit becomes a visit without any row changing).
+CHANGED_FILTER = """
+    (
+        l.updated_at > %(since)s
+        OR EXISTS (
+            SELECT 1 FROM adventures_visit cv
+            WHERE cv.location_id = l.id
+              AND (cv.updated_at > %(since)s
+                   OR (cv.start_date > %(since)s AND cv.start_date < %(cutoff)s))
+        )
+    )
+"""
+
+# Same condition as CHANGED_FILTER, written so each branch can use the updated_at/start_date indexes
+CHANGED_USERS_SQL = """
+    SELECT l.user_id
+    FROM adventures_location l
+    WHERE l.updated_at > %(since)s
+    UNION
+    SELECT l.user_id
+    FROM adventures_visit v
+    JOIN adventures_location l ON l.id = v.location_id
+    WHERE v.updated_at > %(since)s
+       OR (v.start_date > %(since)s AND v.start_date < %(cutoff)s)
+"""
+
+# (user, region/city) pairs from visited locations that are not marked yet
+NEW_PAIRS_SQL = """
+    SELECT DISTINCT l.user_id, l.{column}
+    FROM adventures_location l
+    WHERE l.user_id = ANY(%(user_ids)s)
+      AND l.{column} IS NOT NULL
+      AND {visited}
+      {changed}
+      AND NOT EXISTS (
+          SELECT 1 FROM {table} t
+          WHERE t.user_id = l.user_id AND t.{column} = l.{column}
+      )
+"""
+
+TARGETS = {
+    'regions': ('worldtravel_visitedregion', 'region_id'),
+    'cities': ('worldtravel_visitedcity', 'city_id'),
+}
+
+
+def _new_pairs_sql(table, column, incremental):
+    return NEW_PAIRS_SQL.format(
+        table=table,
+        column=column,
+        visited=VISITED_FILTER,
+        changed=f'AND {CHANGED_FILTER}' if incremental else '',
+    )
+
+
+def sync_user_batch(user_ids, since, cutoff, dry_run=False):
+    """
+    Mark the visited regions and cities of a batch of users.
+    Only locations changed after `since` are considered unless it is None.
+    Returns {user_id: {'regions': n, 'cities': n}} for users that gained any.
+    """
+    params = {'user_ids': list(user_ids), 'since': since, 'cutoff': cutoff}
+    counts = defaultdict(lambda: {'regions': 0, 'cities': 0})
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for key, (table, column) in TARGETS.items():
+            pairs_sql = _new_pairs_sql(table, column, incremental=since is not None)
+            if dry_run:
+                cursor.execute(f'SELECT user_id FROM ({pairs_sql}) pairs', params)
+            else:
+                cursor.execute(
+                    f'INSERT INTO {table} (user_id, {column}) {pairs_sql} '
+                    f'ON CONFLICT (user_id, {column}) DO NOTHING RETURNING user_id',
+                    params,
+                )
+            for (user_id,) in cursor.fetchall():
+                counts[user_id][key] += 1
+
+    # Raw inserts bypass the signals that keep UserStats and cached responses current
+    if counts and not dry_run:
+        refresh_user_stats(list(counts), sections=('visited',))
+        schedule_generation_bump(counts)
+
+    return dict(counts)
+
+
+def _sync_user_batch_in_worker(user_ids, since, cutoff, dry_run):
+    try:
+        return sync_user_batch(user_ids, since, cutoff, dry_run)
+    finally:
+        connections.close_all()
+
 
 class Command(BaseCommand):
     help = 'Synchronize visited regions and cities based on user locations'
@@ -38,12 +160,23 @@ class Command(BaseCommand):
             type=int,
             help='Sync visited regions for a specific user ID only',
         )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Re-check all locations instead of only those changed since the last run',
+        )
         parser.add_argument(
             '--batch-size',
             type=int,
             default=100,
             help='Number of users to process in each batch (default: 100)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=min(4, os.cpu_count() or 1),
+            help='Number of worker processes (default: number of CPUs, at most 4)',
+        )
         parser.add_argument(
             '--verbose',
             action='store_true',
@@ -53,7 +186,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         user_id = options.get('user_id')
-        batch_size = options['batch_size']
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
         verbose = options['verbose']
 
         if dry_run:
@@ -61,60 +195,59 @@ class Command(BaseCommand):
                 self.style.WARNING('DRY RUN MODE - No changes will be made')
             )
 
-        # Build user queryset
-        users_queryset = User.objects.all()
-        
+        run_started = timezone.now()
+        cutoff = visited_cutoff(run_started)
+
+        watermark = None
         if user_id:
-            users_queryset = users_queryset.filter(id=user_id)
-            if not users_queryset.exists():
+            if not User.objects.filter(id=user_id).exists():
                 raise CommandError(f'User with ID {user_id} not found')
+            user_ids = [user_id]
+            since = None
+        else:
+            if not options['full']:
+                watermark = SyncWatermark.objects.filter(name=WATERMARK_NAME).first()
+            if watermark:
+                since = watermark.value - WATERMARK_OVERLAP
+                self.stdout.write(f'Checking changes since {since.isoformat()}')
+                with connection.cursor() as cursor:
+                    cursor.execute(CHANGED_USERS_SQL, {'since': since, 'cutoff': cutoff})
+                    user_ids = sorted(row[0] for row in cursor.fetchall())
+            else:
+                since = None
+                user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+
+        total_users = len(user_ids)
 
-        total_users = users_queryset.count()
-        
         if total_users == 0:
-            self.stdout.write(self.style.WARNING('No users found'))
+            self.stdout.write(self.style.WARNING('No users with changes found'))
+            self._save_watermark(run_started, dry_run, user_id)
             return
 
         self.stdout.write(f'Processing {total_users} user(s)...\n')
 
-        # Track overall statistics
+        batches = [user_ids[i:i + batch_size] for i in range(0, total_users, batch_size)]
+        results, failed_batches = self._run_batches(batches, since, cutoff, dry_run, workers)
+
         total_new_regions = 0
         total_new_cities = 0
-        users_processed = 0
-        users_with_changes = 0
-
-        # Process users in batches to manage memory
-        user_ids = list(users_queryset.values_list('id', flat=True))
-        
-        for i in range(0, len(user_ids), batch_size):
-            batch_user_ids = user_ids[i:i + batch_size]
-            
-            for user_id in batch_user_ids:
-                try:
-                    new_regions, new_cities = self._process_user(
-                        user_id, dry_run, verbose
-                    )
-                    
-                    total_new_regions += new_regions
-                    total_new_cities += new_cities
-                    users_processed += 1
-                    
-                    if new_regions > 0 or new_cities > 0:
-                        users_with_changes += 1
-                    
-                    # Progress indicator for large batches
-                    if users_processed % 50 == 0:
-                        self.stdout.write(
-                            f'Processed {users_processed}/{total_users} users...'
-                        )
-                        
-                except Exception as e:
-                    self.stdout.write(
-                        self.style.ERROR(
-                            f'Error processing user {user_id}: {str(e)}'
-                        )
-                    )
-                    logger.exception(f'Error processing user {user_id}')
+        for changed_user_id, counts in sorted(results.items()):
+            total_new_regions += counts['regions']
+            total_new_cities += counts['cities']
+            if verbose:
+                self.stdout.write(
+                    f'User {changed_user_id}: '
+                    f'{counts["regions"]} new regions, '
+                    f'{counts["cities"]} new cities'
+                )
+
+        users_processed = total_users - sum(len(batch) for batch in failed_batches)
+        users_with_changes = len(results)
+
+        # Only move the watermark once every batch succeeded, otherwise the
+        # failed users' changes would be skipped by the next incremental run.
+        if not failed_batches:
+            self._save_watermark(run_started, dry_run, user_id)
 
         # Summary
         self.stdout.write('\n' + '='*60)
@@ -139,121 +272,56 @@ class Command(BaseCommand):
                 )
             )
 
-    def _process_user(self, user_id, dry_run=False, verbose=False):
-        """
-        Process a single user and return counts of new regions and cities.
-        Returns: (new_regions_count, new_cities_count)
-        """
-        # Get all visited locations with their region and city data in a single query
-        visited_locations = Location.objects.filter(
-            user_id=user_id
-        ).select_related('region', 'city')
-        
-        # Collect unique regions and cities from visited locations
-        regions_to_mark = set()
-        cities_to_mark = set()
-        
-        for location in visited_locations:
-            # Only process locations that are marked as visited
-            if not location.is_visited_status():
-                continue
-            
-            if location.region_id:
-                regions_to_mark.add(location.region_id)
-            
-            if location.city_id:
-                cities_to_mark.add(location.city_id)
-        
-        # Early exit if no regions or cities to mark
-        if not regions_to_mark and not cities_to_mark:
-            return 0, 0
-        
-        new_regions_count = 0
-        new_cities_count = 0
-        
-        # Process regions
-        if regions_to_mark:
-            new_regions_count = self._sync_visited_regions(
-                user_id, regions_to_mark, dry_run
-            )
-        
-        # Process cities
-        if cities_to_mark:
-            new_cities_count = self._sync_visited_cities(
-                user_id, cities_to_mark, dry_run
-            )
-        
-        if verbose and (new_regions_count > 0 or new_cities_count > 0):
-            self.stdout.write(
-                f'User {user_id}: '
-                f'{new_regions_count} new regions, '
-                f'{new_cities_count} new cities'
+    def _run_batches(self, batches, since, cutoff, dry_run, workers):
+        """Run every batch, in worker processes when there is more than one. Returns (results, failed_batches)."""
+        results = {}
+        failed_batches = []
+
+        workers = min(workers, len(batches))
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            # Workers inherit the configured Django app registry through fork
+            workers = 1
+
+        if workers == 1:
+            for batch in batches:
+                try:
+                    results.update(sync_user_batch(batch, since, cutoff, dry_run))
+                except Exception as e:
+                    failed_batches.append(batch)
+                    self._report_batch_error(batch, e)
+            return results, failed_batches
+
+        # Forked workers must not share the parent's database connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = {
+                executor.submit(_sync_user_batch_in_worker, batch, since, cutoff, dry_run): batch
+                for batch in batches
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                batch = futures[future]
+                try:
+                    results.update(future.result())
+                except Exception as e:
+                    failed_batches.append(batch)
+                    self._report_batch_error(batch, e)
+                if done % 10 == 0:
+                    self.stdout.write(f'Processed {done}/{len(batches)} batches...')
+
+        return results, failed_batches
+
+    def _report_batch_error(self, batch, error):
+        self.stdout.write(
+            self.style.ERROR(
+                f'Error processing users {batch[0]}-{batch[-1]}: {str(error)}'
             )
-        
-        return new_regions_count, new_cities_count
-
-    def _sync_visited_regions(self, user_id, region_ids, dry_run=False):
-        """Sync visited regions for a user. Returns count of new regions created."""
-        # Get existing visited regions for this user in one query
-        existing_visited_regions = set(
-            VisitedRegion.objects.filter(
-                user_id=user_id,
-                region_id__in=region_ids
-            ).values_list('region_id', flat=True)
         )
-        
-        # Determine which regions need to be created
-        regions_to_create = region_ids - existing_visited_regions
-        
-        if not regions_to_create:
-            return 0
-        
-        if dry_run:
-            return len(regions_to_create)
-        
-        # Bulk create new VisitedRegion entries
-        new_visited_regions = [
-            VisitedRegion(region_id=region_id, user_id=user_id)
-            for region_id in regions_to_create
-        ]
-        
-        with transaction.atomic():
-            VisitedRegion.objects.bulk_create(
-                new_visited_regions,
-                ignore_conflicts=True  # Handle race conditions gracefully
-            )
-        
-        return len(regions_to_create)
-
-    def _sync_visited_cities(self, user_id, city_ids, dry_run=False):
-        """Sync visited cities for a user. Returns count of new cities created."""
-        # Get existing visited cities for this user in one query
-        existing_visited_cities = set(
-            VisitedCity.objects.filter(
-                user_id=user_id,
-                city_id__in=city_ids
-            ).values_list('city_id', flat=True)
+        logger.error(f'Error processing users {batch[0]}-{batch[-1]}', exc_info=error)
+
+    def _save_watermark(self, run_started, dry_run, user_id):
+        # Single-user and dry runs don't cover every change, so they leave the watermark alone
+        if dry_run or user_id:
+            return
+        SyncWatermark.objects.update_or_create(
+            name=WATERMARK_NAME, defaults={'value': run_started}
         )
-        
-        # Determine which cities need to be created
-        cities_to_create = city_ids - existing_visited_cities
-        
-        if not cities_to_create:
-            return 0
-        
-        if dry_run:
-            return len(cities_to_create)
-        
-        # Bulk create new VisitedCity entries
-        new_visited_cities = [
-            VisitedCity(city_id=city_id, user_id=user_id)
-            for city_id in cities_to_create
-        ]
-        
-        with transaction.atomic():
-            VisitedCity.objects.bulk_create(
-                new_visited_cities,
-                ignore_conflicts=True  # Handle race conditions gracefully
-            )
-        
-        return len(cities_to_create)
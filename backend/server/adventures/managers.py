@@ -1,7 +1,82 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models import Count, F, Func, OuterRef, Prefetch, Q, Subquery, Value
 
-class LocationManager(models.Manager):
+from adventures.utils.get_is_visited import location_visited_exists
+
+
+def _count_subquery(queryset):
+    """Correlated `SELECT COUNT(*)` over `queryset`, usable as an annotation."""
+    return Subquery(
+        queryset.order_by().annotate(_count=Func(F('pk'), function='COUNT')).values('_count'),
+        output_field=models.IntegerField(),
+    )
+
+
+class LocationQuerySet(models.QuerySet):
+    def with_is_visited(self):
+        """Annotate each location with `is_visited`, computed in SQL."""
+        return self.annotate(is_visited=location_visited_exists())
+
+    def prefetch_for_serializer(self, user=None, fields=None):
+        """
+        Load everything LocationSerializer reads in a fixed number of queries:
+        related rows through select_related/Prefetch (including the generic
+        images and attachments) and the per-object counts the nested
+        serializers report as annotations. `user` is the requesting user,
+        used for the country visit counts. `fields` limits the prefetches to
+        the serializer fields that will be rendered (all when None).
+        """
+        from adventures.models import Activity, Category, Collection, ContentAttachment, ContentImage, Trail, Visit
+        from worldtravel.models import City, Country, Region, VisitedRegion
+
+        if user is not None and user.is_authenticated:
+            num_visits = _count_subquery(VisitedRegion.objects.filter(region__country=OuterRef('pk'), user=user))
+        else:
+            num_visits = Value(0)
+
+        prefetches = {
+            'category': Prefetch('category', queryset=Category.objects.annotate(
+                num_locations=Count('location', filter=Q(location__user=F('user')))
+            )),
+            'country': Prefetch('country', queryset=Country.objects.annotate(
+                num_regions=_count_subquery(Region.objects.filter(country=OuterRef('pk'))),
+                num_visits=num_visits,
+            )),
+            'region': Prefetch('region', queryset=Region.objects.select_related('country').annotate(
+                num_cities=_count_subquery(City.objects.filter(region=OuterRef('pk'))),
+            )),
+            'city': Prefetch('city', queryset=City.objects.select_related('region__country')),
+            'collections': Prefetch('collections', queryset=Collection.objects.only('id')),
+            'visits': Prefetch('visits', queryset=Visit.objects.prefetch_related(
+                Prefetch('activities', queryset=Activity.objects.select_related('user', 'gpx_artifact').defer('gpx_artifact__simplified', 'gpx_artifact__track')),
+            )),
+            'images': Prefetch('images', queryset=ContentImage.objects.select_related('user')),
+            'attachments': Prefetch('attachments', queryset=ContentAttachment.objects.select_related('user', 'gpx_artifact').defer('gpx_artifact__simplified', 'gpx_artifact__track')),
+            'trails': Prefetch('trails', queryset=Trail.objects.select_related('user')),
+        }
+        if fields is not None:
+            prefetches = {name: prefetch for name, prefetch in prefetches.items() if name in fields}
+
+        return self.with_is_visited().select_related('user').prefetch_related(*prefetches.values())
+
+
+def prefetch_media(queryset, fields=None):
+    """
+    Prefetch the images and attachments of transportations and lodging (and
+    the GPX artifacts the transportation distance reads) when the serializer
+    `fields` render them (all when None).
+    """
+    from adventures.models import ContentAttachment, ContentImage
+
+    prefetches = []
+    if fields is None or 'images' in fields:
+        prefetches.append(Prefetch('images', queryset=ContentImage.objects.select_related('user')))
+    if fields is None or 'attachments' in fields or 'distance' in fields:
+        prefetches.append(Prefetch('attachments', queryset=ContentAttachment.objects.select_related('user', 'gpx_artifact').defer('gpx_artifact__simplified', 'gpx_artifact__track')))
+    return queryset.select_related('user').prefetch_related(*prefetches)
+
+
+class LocationManager(models.Manager.from_queryset(LocationQuerySet)):
     def retrieve_locations(self, user, include_owned=False, include_shared=False, include_public=False):
         query = Q()
 
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0072_geocodecacheentry'),
+        ('worldtravel', '0020_syncwatermark_visited_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['updated_at'], name='adventures__updated_9dfbf2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['updated_at'], name='adventures__updated_394870_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['start_date'], name='adventures__start_d_1ed8d2_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0073_location_visit_sync_indexes'),
+        ('users', '0006_customuser_default_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('location_count', models.PositiveIntegerField(default=0)),
+                ('visited_location_count', models.PositiveIntegerField(default=0)),
+                ('visited_recheck_at', models.DateTimeField(blank=True, null=True)),
+                ('trips_count', models.PositiveIntegerField(default=0)),
+                ('visited_city_count', models.PositiveIntegerField(default=0)),
+                ('visited_region_count', models.PositiveIntegerField(default=0)),
+                ('visited_country_count', models.PositiveIntegerField(default=0)),
+                ('activity_totals', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Stats',
+                'verbose_name_plural': 'User Stats',
+            },
+        ),
+    ]
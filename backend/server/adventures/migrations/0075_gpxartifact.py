@@ -0,0 +1,45 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:37
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0074_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GpxArtifact',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('file_name', models.CharField(max_length=255, unique=True)),
+                ('file_size', models.BigIntegerField(default=0)),
+                ('geojson', models.JSONField(default=dict)),
+                ('simplified', models.JSONField(default=dict)),
+                ('bbox', models.JSONField(blank=True, null=True)),
+                ('length_2d', models.FloatField(default=0)),
+                ('length_3d', models.FloatField(default=0)),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'GPX Artifact',
+                'verbose_name_plural': 'GPX Artifacts',
+            },
+        ),
+        migrations.AddField(
+            model_name='activity',
+            name='gpx_artifact',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activities', to='adventures.gpxartifact'),
+        ),
+        migrations.AddField(
+            model_name='contentattachment',
+            name='gpx_artifact',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='attachments', to='adventures.gpxartifact'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0075_gpxartifact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gpxartifact',
+            name='track',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0076_gpxartifact_track'),
+        ('worldtravel', '0020_syncwatermark_visited_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='location',
+            index=models.Index(fields=['user', 'latitude', 'longitude'], name='location_user_lat_lng_idx'),
+        ),
+    ]
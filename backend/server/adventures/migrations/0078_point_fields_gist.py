@@ -0,0 +1,59 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:47
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adventures', '0077_location_user_lat_lng_idx'),
+        ('worldtravel', '0020_syncwatermark_visited_unique'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='location',
+            name='location_user_lat_lng_idx',
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='point',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.Func(django.db.models.functions.comparison.Cast('longitude', models.FloatField()), django.db.models.functions.comparison.Cast('latitude', models.FloatField()), function='ST_MakePoint'), models.Value(4326), function='ST_SetSRID', output_field=django.contrib.gis.db.models.fields.PointField(srid=4326)), output_field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+        ),
+        migrations.AddField(
+            model_name='lodging',
+            name='point',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.Func(django.db.models.functions.comparison.Cast('longitude', models.FloatField()), django.db.models.functions.comparison.Cast('latitude', models.FloatField()), function='ST_MakePoint'), models.Value(4326), function='ST_SetSRID', output_field=django.contrib.gis.db.models.fields.PointField(srid=4326)), output_field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+        ),
+        migrations.AddField(
+            model_name='transportation',
+            name='destination_point',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.Func(django.db.models.functions.comparison.Cast('destination_longitude', models.FloatField()), django.db.models.functions.comparison.Cast('destination_latitude', models.FloatField()), function='ST_MakePoint'), models.Value(4326), function='ST_SetSRID', output_field=django.contrib.gis.db.models.fields.PointField(srid=4326)), output_field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+        ),
+        migrations.AddField(
+            model_name='transportation',
+            name='origin_point',
+            field=models.GeneratedField(db_persist=True, expression=models.Func(models.Func(django.db.models.functions.comparison.Cast('origin_longitude', models.FloatField()), django.db.models.functions.comparison.Cast('origin_latitude', models.FloatField()), function='ST_MakePoint'), models.Value(4326), function='ST_SetSRID', output_field=django.contrib.gis.db.models.fields.PointField(srid=4326)), output_field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+        ),
+        migrations.AddIndex(
+            model_name='location',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['point'], name='location_point_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='lodging',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['point'], name='lodging_point_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='transportation',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['origin_point'], name='transportation_origin_gist'),
+        ),
+        migrations.AddIndex(
+            model_name='transportation',
+            index=django.contrib.postgres.indexes.GistIndex(fields=['destination_point'], name='transportation_dest_gist'),
+        ),
+    ]
@@ -1,9 +1,15 @@
 import os
 import uuid
-from django.db import models
+from django.contrib.gis.db import models as gis_models
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models.functions import Cast
 from django.utils.deconstruct import deconstructible
 from adventures.managers import LocationManager
-import threading
+from adventures.utils.deletion import delete_attached_media
+from adventures.utils.geocode_queue import enqueue_geocode
+from adventures.utils.media_cleanup import remove_files_on_commit
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from django_resized import ResizedImageField
@@ -14,22 +20,71 @@ from django.utils import timezone
 from adventures.utils.timezones import TIMEZONES
 from adventures.utils.sports_types import SPORT_TYPE_CHOICES
 from adventures.utils.get_is_visited import is_location_visited
+from adventures.utils.gpx_artifacts import sync_gpx_artifact
+from adventures.utils.search import weighted_search_vector
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db.models import Q
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericRelation
 
+def point_from_coordinates(longitude, latitude):
+    """
+    Expression for a SRID 4326 point built from decimal longitude/latitude
+    columns. Used by the GeneratedField point columns, which the database
+    keeps in sync with the coordinates on every write.
+    """
+    return models.Func(
+        models.Func(
+            Cast(longitude, models.FloatField()),
+            Cast(latitude, models.FloatField()),
+            function='ST_MakePoint',
+        ),
+        models.Value(4326),
+        function='ST_SetSRID',
+        output_field=gis_models.PointField(srid=4326),
+    )
+
+
+def generated_point(longitude, latitude):
+    return models.GeneratedField(
+        expression=point_from_coordinates(longitude, latitude),
+        output_field=gis_models.PointField(srid=4326, null=True, blank=True),
+        db_persist=True,
+    )
+
+
+def generated_search_vector(*fields):
+    """
+    Stored tsvector over (field name, weight) pairs, kept in sync by the
+    database and matched by GlobalSearchView through a GIN index.
+    """
+    return models.GeneratedField(
+        expression=weighted_search_vector(*fields),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+
 def background_geocode_and_assign(location_id: str):
+    """
+    Reverse geocode a location and assign its region, city and country.
+    Returns False when the provider failed transiently and the job should be retried.
+    """
     print(f"[Location Geocode Thread] Starting geocode for location {location_id}")
     try:
-        location = Location.objects.get(id=location_id)
+        location = Location.objects.with_is_visited().get(id=location_id)
         if not (location.latitude and location.longitude):
-            return
+            return True
         
         from adventures.geocoding import reverse_geocode  # or wherever you defined it
+        from adventures.utils.geocode_cache import NEGATIVE_ERRORS
         is_visited = location.is_visited_status()
         result = reverse_geocode(location.latitude, location.longitude, location.user)
 
+        if 'error' in result and result['error'] not in NEGATIVE_ERRORS:
+            print(f"[Location Geocode Thread] Geocoding {location_id} failed: {result['error']}")
+            return False
+
         if 'region_id' in result:
             region = Region.objects.filter(id=result['region_id']).first()
             if region:
@@ -51,12 +106,14 @@ def background_geocode_and_assign(location_id: str):
 
         # Save updated location info
         # Save updated location info, skip geocode threading
-        location.save(update_fields=["region", "city", "country"], _skip_geocode=True)
+        location.save(update_fields=["region", "city", "country", "updated_at"], _skip_geocode=True)
 
     except Exception as e:
         # Optional: log or print the error
         print(f"[Location Geocode Thread] Error processing {location_id}: {e}")
 
+    return True
+
 def validate_file_extension(value):
     import os
     from django.core.exceptions import ValidationError
@@ -141,15 +198,18 @@ class Visit(models.Model):
 
     def delete(self, *args, **kwargs):
         # Delete all associated images and attachments
-        for image in self.images.all():
-            image.delete()
-        for attachment in self.attachments.all():
-            attachment.delete()
+        delete_attached_media(self)
         super().delete(*args, **kwargs)
 
     def __str__(self):
         return f"{self.location.name} - {self.start_date} to {self.end_date}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['start_date']),
+        ]
+
 class Location(models.Model):
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, default=default_user)
@@ -164,6 +224,8 @@ class Location(models.Model):
     is_public = models.BooleanField(default=False)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    point = generated_point('longitude', 'latitude')
+    search_vector = generated_search_vector(('name', 'A'), ('location', 'B'), ('description', 'C'))
     city = models.ForeignKey(City, on_delete=models.SET_NULL, blank=True, null=True)
     region = models.ForeignKey(Region, on_delete=models.SET_NULL, blank=True, null=True)
     country = models.ForeignKey(Country, on_delete=models.SET_NULL, blank=True, null=True)
@@ -177,6 +239,13 @@ class Location(models.Model):
 
     objects = LocationManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+            GistIndex(fields=['point'], name='location_point_gist'),
+            GinIndex(fields=['search_vector'], name='location_search_gin'),
+        ]
+
     def is_visited_status(self):
         return is_location_visited(self)
 
@@ -229,23 +298,20 @@ class Location(models.Model):
                 # For now, we'll re-raise the error
                 raise e
 
-        # ⛔ Skip threading if called from geocode background thread
+        # ⛔ Skip geocoding if called from the geocode worker
         if _skip_geocode:
             return result
 
         if self.latitude and self.longitude:
-            thread = threading.Thread(target=background_geocode_and_assign, args=(str(self.id),))
-            thread.daemon = True  # Allows the thread to exit when the main program ends
-            thread.start()
+            # Hand off to the bounded geocode worker pool once the row is committed
+            location_id = str(self.id)
+            transaction.on_commit(lambda: enqueue_geocode(location_id), using=using)
 
         return result
 
     def delete(self, *args, **kwargs):
-        # Delete all associated images and attachments (handled by GenericRelation)
-        for image in self.images.all():
-            image.delete()
-        for attachment in self.attachments.all():
-            attachment.delete()
+        # Delete all associated images and attachments, the visits' included
+        delete_attached_media(self, *self.visits.all())
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -294,6 +360,12 @@ class Collection(models.Model):
         null=True,
         blank=True,
     )
+    search_vector = generated_search_vector(('name', 'A'), ('description', 'C'))
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='collection_search_gin'),
+        ]
 
     # if connected locations are private and collection is public, raise an error
     def clean(self):
@@ -325,6 +397,8 @@ class Transportation(models.Model):
     origin_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     destination_latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     destination_longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    origin_point = generated_point('origin_longitude', 'origin_latitude')
+    destination_point = generated_point('destination_longitude', 'destination_latitude')
     start_code = models.CharField(max_length=100, blank=True, null=True) # Could be airport code, station code, etc.
     end_code = models.CharField(max_length=100, blank=True, null=True)   # Could be airport code, station code, etc.
     to_location = models.CharField(max_length=200, blank=True, null=True)
@@ -337,6 +411,12 @@ class Transportation(models.Model):
     images = GenericRelation('ContentImage', related_query_name='transportation')
     attachments = GenericRelation('ContentAttachment', related_query_name='transportation')
 
+    class Meta:
+        indexes = [
+            GistIndex(fields=['origin_point'], name='transportation_origin_gist'),
+            GistIndex(fields=['destination_point'], name='transportation_dest_gist'),
+        ]
+
     def clean(self):
         if self.date and self.end_date and self.date > self.end_date:
             raise ValidationError('The start date must be before the end date. Start date: ' + str(self.date) + ' End date: ' + str(self.end_date))
@@ -349,10 +429,7 @@ class Transportation(models.Model):
 
     def delete(self, *args, **kwargs):
         # Delete all associated images and attachments
-        for image in self.images.all():
-            image.delete()
-        for attachment in self.attachments.all():
-            attachment.delete()
+        delete_attached_media(self)
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -369,11 +446,17 @@ class Note(models.Model):
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = generated_search_vector(('name', 'A'), ('content', 'C'))
 
     # Generic relations for images and attachments
     images = GenericRelation('ContentImage', related_query_name='note')
     attachments = GenericRelation('ContentAttachment', related_query_name='note')
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='note_search_gin'),
+        ]
+
     def clean(self):
         if self.collection:
             if self.collection.is_public and not self.is_public:
@@ -383,10 +466,7 @@ class Note(models.Model):
 
     def delete(self, *args, **kwargs):
         # Delete all associated images and attachments
-        for image in self.images.all():
-            image.delete()
-        for attachment in self.attachments.all():
-            attachment.delete()
+        delete_attached_media(self)
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -445,6 +525,34 @@ class PathAndRename:
         filename = f"{uuid.uuid4()}.{ext}"
         return os.path.join(self.path, filename)
 
+class GpxArtifact(models.Model):
+    """
+    Values derived from an uploaded GPX file, computed once when the file is
+    saved (see adventures.utils.gpx_artifacts) instead of on every serialization.
+    """
+    id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
+    file_name = models.CharField(max_length=255, unique=True)
+    file_size = models.BigIntegerField(default=0)
+    # FeatureCollection of the full tracks, or an error dict if the file could not be parsed
+    geojson = models.JSONField(default=dict)
+    # Douglas-Peucker simplified FeatureCollections keyed by map zoom level
+    simplified = models.JSONField(default=dict)
+    bbox = models.JSONField(blank=True, null=True)  # [min_lon, min_lat, max_lon, max_lat]
+    length_2d = models.FloatField(default=0)  # in meters
+    length_3d = models.FloatField(default=0)  # in meters
+    point_count = models.PositiveIntegerField(default=0)
+    # Columnar binary encoding of the track points (see adventures.utils.track_storage)
+    track = models.BinaryField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "GPX Artifact"
+        verbose_name_plural = "GPX Artifacts"
+
+    def __str__(self):
+        return self.file_name
+
 class ContentImage(models.Model):
     """Generic image model that can be attached to any content type"""
     id = models.UUIDField(default=uuid.uuid4, editable=False, unique=True, primary_key=True)
@@ -492,10 +600,10 @@ class ContentImage(models.Model):
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        # Remove file from disk when deleting image
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
         super().delete(*args, **kwargs)
+        # Remove the file once the deletion has committed
+        if self.image:
+            remove_files_on_commit([(self.image.storage, self.image.name)])
 
     def __str__(self):
         content_name = getattr(self.content_object, 'name', 'Unknown')
@@ -512,6 +620,7 @@ class ContentAttachment(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, related_name='content_attachments')
     object_id = models.UUIDField()
     content_object = GenericForeignKey('content_type', 'object_id')
+    gpx_artifact = models.ForeignKey(GpxArtifact, on_delete=models.SET_NULL, blank=True, null=True, related_name='attachments', editable=False)
 
     class Meta:
         verbose_name = "Content Attachment"
@@ -520,10 +629,15 @@ class ContentAttachment(models.Model):
             models.Index(fields=["content_type", "object_id"]),
         ]
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The file is in storage now; derive the GPX artifacts if it changed
+        sync_gpx_artifact(self, 'file')
+
     def delete(self, *args, **kwargs):
-        if self.file and os.path.isfile(self.file.path):
-            os.remove(self.file.path)
         super().delete(*args, **kwargs)
+        if self.file:
+            remove_files_on_commit([(self.file.storage, self.file.name)])
 
     def __str__(self):
         content_name = getattr(self.content_object, 'name', 'Unknown')
@@ -565,6 +679,7 @@ class Lodging(models.Model):
     price = MoneyField(max_digits=12, decimal_places=2, default_currency='USD', null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    point = generated_point('longitude', 'latitude')
     location = models.CharField(max_length=200, blank=True, null=True)
     is_public = models.BooleanField(default=False)
     collection = models.ForeignKey('Collection', on_delete=models.CASCADE, blank=True, null=True)
@@ -575,6 +690,11 @@ class Lodging(models.Model):
     images = GenericRelation('ContentImage', related_query_name='lodging')
     attachments = GenericRelation('ContentAttachment', related_query_name='lodging')
 
+    class Meta:
+        indexes = [
+            GistIndex(fields=['point'], name='lodging_point_gist'),
+        ]
+
     def clean(self):
         if self.check_in and self.check_out and self.check_in > self.check_out:
             raise ValidationError('The start date must be before the end date. Start date: ' + str(self.check_in) + ' End date: ' + str(self.check_out))
@@ -587,10 +707,7 @@ class Lodging(models.Model):
 
     def delete(self, *args, **kwargs):
         # Delete all associated images and attachments
-        for image in self.images.all():
-            image.delete()
-        for attachment in self.attachments.all():
-            attachment.delete()
+        delete_attached_media(self)
         super().delete(*args, **kwargs)
 
     def __str__(self):
@@ -640,6 +757,7 @@ class Activity(models.Model):
 
     # GPX File
     gpx_file = models.FileField(upload_to=PathAndRename('activities/'), validators=[validate_file_extension], blank=True, null=True)
+    gpx_artifact = models.ForeignKey(GpxArtifact, on_delete=models.SET_NULL, blank=True, null=True, related_name='activities', editable=False)
 
     # Descriptive
     name = models.CharField(max_length=200)
@@ -679,6 +797,10 @@ class Activity(models.Model):
     # Optional links
     external_service_id = models.CharField(max_length=100, blank=True, null=True)  # E.g., Strava ID
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        sync_gpx_artifact(self, 'gpx_file')
+
     def __str__(self):
         return f"{self.name} ({self.sport_type})"
 
@@ -785,3 +907,49 @@ class CollectionItineraryItem(models.Model):
                     return value
 
         return None
+
+class GeocodeCacheEntry(models.Model):
+    """Persisted geocoding provider result, keyed by normalized query or quantized coordinate"""
+    KIND_CHOICES = [
+        ('search', 'Search'),
+        ('reverse', 'Reverse'),
+    ]
+
+    key = models.CharField(max_length=255, unique=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    provider = models.CharField(max_length=50)
+    result = models.JSONField()
+    is_negative = models.BooleanField(default=False)
+    hit_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Geocode Cache Entry"
+        verbose_name_plural = "Geocode Cache Entries"
+
+    def __str__(self):
+        return self.key
+
+class UserStats(models.Model):
+    """Per-user counters behind the stats endpoint, kept current by signals (see adventures.utils.user_stats)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    location_count = models.PositiveIntegerField(default=0)
+    visited_location_count = models.PositiveIntegerField(default=0)
+    # Start of the earliest planned visit; the visited count is refreshed once it has begun
+    visited_recheck_at = models.DateTimeField(blank=True, null=True)
+    trips_count = models.PositiveIntegerField(default=0)
+    visited_city_count = models.PositiveIntegerField(default=0)
+    visited_region_count = models.PositiveIntegerField(default=0)
+    visited_country_count = models.PositiveIntegerField(default=0)
+    # Activity aggregates keyed by sport type
+    activity_totals = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "User Stats"
+        verbose_name_plural = "User Stats"
+
+    def __str__(self):
+        return f"Stats for {self.user}"
@@ -6,8 +6,7 @@ from users.serializers import CustomUserDetailsSerializer
 from worldtravel.serializers import CountrySerializer, RegionSerializer, CitySerializer
 from geopy.distance import geodesic
 from integrations.models import ImmichIntegration
-from adventures.utils.geojson import gpx_to_geojson
-import gpxpy
+from adventures.utils.gpx_artifacts import get_gpx_artifact
 import logging
 
 logger = logging.getLogger(__name__)
@@ -46,10 +45,13 @@ class ContentImageSerializer(CustomModelSerializer):
         read_only_fields = ['id', 'user']
 
     def to_representation(self, instance):
-        # If immich_id is set, check for user integration once
+        # If immich_id is set, check for user integration once per user and request
         integration = None
         if instance.immich_id:
-            integration = ImmichIntegration.objects.filter(user=instance.user).first()
+            integrations = self.context.setdefault('_immich_integrations', {})
+            if instance.user_id not in integrations:
+                integrations[instance.user_id] = ImmichIntegration.objects.filter(user_id=instance.user_id).first()
+            integration = integrations[instance.user_id]
             if not integration:
                 return None  # Skip if Immich image but no integration
 
@@ -90,8 +92,9 @@ class AttachmentSerializer(CustomModelSerializer):
         return representation
 
     def get_geojson(self, obj):
-        if obj.file and obj.file.name.endswith('.gpx'):
-            return gpx_to_geojson(obj.file)
+        artifact = get_gpx_artifact(obj, 'file')
+        if artifact is not None:
+            return artifact.geojson
         return None
     
 class CategorySerializer(serializers.ModelSerializer):
@@ -118,6 +121,9 @@ class CategorySerializer(serializers.ModelSerializer):
         return instance
     
     def get_num_locations(self, obj):
+        # Use the count annotated by the queryset when available
+        if hasattr(obj, 'num_locations'):
+            return obj.num_locations
         return Location.objects.filter(category=obj, user=obj.user).count()
     
 class TrailSerializer(CustomModelSerializer):
@@ -217,7 +223,8 @@ class ActivitySerializer(CustomModelSerializer):
         return representation
     
     def get_geojson(self, obj):
-        return gpx_to_geojson(obj.gpx_file)
+        artifact = get_gpx_artifact(obj, 'gpx_file')
+        return artifact.geojson if artifact is not None else None
 
 class VisitSerializer(serializers.ModelSerializer):
 
@@ -284,31 +291,26 @@ class LocationSerializer(CustomModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'is_visited']
 
+    # Fields left out of the slim representation used in nested contexts
+    NESTED_OMIT_FIELDS = {'visits', 'attachments', 'trails', 'collections', 'user', 'city', 'country', 'region'}
+
+    def get_default_omit(self):
+        if not self.context.get('nested', False):
+            return set()
+        # Keep fields explicitly allowed for nested mode
+        return self.NESTED_OMIT_FIELDS - set(self.context.get('allowed_nested_fields', []))
+
     # Makes it so the whole user object is returned in the serializer instead of just the user uuid
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        is_nested = self.context.get('nested', False)
-        allowed_nested_fields = set(self.context.get('allowed_nested_fields', []))
-
-        if not is_nested:
+        if not self.context.get('nested', False) and 'user' in representation:
             # Full representation for standalone locations
             representation['user'] = CustomUserDetailsSerializer(instance.user, context=self.context).data
-        else:
-            # Slim representation for nested contexts, but keep allowed fields
-            fields_to_remove = [
-                'visits', 'attachments', 'trails', 'collections',
-                'user', 'city', 'country', 'region'
-            ]
-            for field in fields_to_remove:
-                # Keep field if explicitly allowed for nested mode
-                if field not in allowed_nested_fields:
-                    representation.pop(field, None)
-
         return representation
 
 
     def get_images(self, obj):
-        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context)
+        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context, **self.child_selection('images'))
         # Filter out None values from the serialized data
         return [image for image in serializer.data if image is not None]
 
@@ -467,9 +469,39 @@ class LocationSerializer(CustomModelSerializer):
             instance.visits.all().delete()
             for visit_data in visits_data:
                 Visit.objects.create(location=instance, **visit_data)
+            # The is_visited annotation loaded with the instance is now stale
+            instance.__dict__.pop('is_visited', None)
 
         return instance
     
+class BulkVisitSerializer(VisitSerializer):
+    class Meta(VisitSerializer.Meta):
+        fields = [field for field in VisitSerializer.Meta.fields if field != 'location']
+
+    def validate(self, attrs):
+        if not attrs.get('end_date') and attrs.get('start_date'):
+            attrs['end_date'] = attrs['start_date']
+        if attrs.get('start_date') and attrs.get('end_date') and attrs['start_date'] > attrs['end_date']:
+            raise serializers.ValidationError('The start date must be before or equal to the end date.')
+        return attrs
+
+class BulkLocationSerializer(LocationSerializer):
+    """
+    Validates one location of a POST /locations/bulk/ batch without querying
+    the database: categories and collections are resolved for the whole
+    batch at once by adventures.utils.bulk_locations.
+    """
+    visits = BulkVisitSerializer(many=True, required=False)
+    collections = serializers.ListField(child=serializers.UUIDField(), required=False)
+
+    def validate_collections(self, collections):
+        return list(dict.fromkeys(collections))
+
+    def validate_category(self, category_data):
+        if category_data:
+            category_data['name'] = category_data.get('name', '').lower().strip()
+        return category_data
+
 class MapPinSerializer(serializers.ModelSerializer):
     is_visited = serializers.SerializerMethodField()
     category = CategorySerializer(read_only=True, required=False)
@@ -501,12 +533,12 @@ class TransportationSerializer(CustomModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at', 'user', 'distance', 'travel_duration_minutes']
 
     def get_images(self, obj):
-        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context)
+        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context, **self.child_selection('images'))
         # Filter out None values from the serialized data
         return [image for image in serializer.data if image is not None]
 
     def get_attachments(self, obj):
-        serializer = AttachmentSerializer(obj.attachments.all(), many=True, context=self.context)
+        serializer = AttachmentSerializer(obj.attachments.all(), many=True, context=self.context, **self.child_selection('attachments'))
         # Filter out None values from the serialized data
         return [attachment for attachment in serializer.data if attachment is not None]
 
@@ -528,39 +560,11 @@ class TransportationSerializer(CustomModelSerializer):
         return None
 
     def _get_gpx_distance_km(self, obj):
-        gpx_attachments = obj.attachments.filter(file__iendswith='.gpx')
-        for attachment in gpx_attachments:
-            distance_km = self._parse_gpx_distance_km(attachment.file)
-            if distance_km is not None:
-                return distance_km
-        return None
-
-    def _parse_gpx_distance_km(self, gpx_file_field):
-        try:
-            with gpx_file_field.open('r') as gpx_file:
-                gpx = gpxpy.parse(gpx_file)
-
-            total_meters = 0.0
-
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    segment_length = segment.length_3d() or segment.length_2d()
-                    if segment_length:
-                        total_meters += segment_length
-
-            for route in gpx.routes:
-                route_length = route.length_3d() or route.length_2d()
-                if route_length:
-                    total_meters += route_length
-
-            if total_meters > 0:
-                return round(total_meters / 1000, 2)
-        except Exception as exc:
-            logger.warning(
-                "Failed to calculate GPX distance for file %s: %s",
-                getattr(gpx_file_field, 'name', 'unknown'),
-                exc,
-            )
+        # Iterate the (usually prefetched) attachments instead of filtering in SQL
+        for attachment in obj.attachments.all():
+            artifact = get_gpx_artifact(attachment, 'file')
+            if artifact is not None and artifact.length_3d > 0:
+                return round(artifact.length_3d / 1000, 2)
         return None
 
     def get_travel_duration_minutes(self, obj):
@@ -603,12 +607,12 @@ class LodgingSerializer(CustomModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at', 'user']
 
     def get_images(self, obj):
-        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context)
+        serializer = ContentImageSerializer(obj.images.all(), many=True, context=self.context, **self.child_selection('images'))
         # Filter out None values from the serialized data
         return [image for image in serializer.data if image is not None]
 
     def get_attachments(self, obj):
-        serializer = AttachmentSerializer(obj.attachments.all(), many=True, context=self.context)
+        serializer = AttachmentSerializer(obj.attachments.all(), many=True, context=self.context, **self.child_selection('attachments'))
         # Filter out None values from the serialized data
         return [attachment for attachment in serializer.data if attachment is not None]
 
@@ -798,40 +802,30 @@ class CollectionSerializer(CustomModelSerializer):
 
         return collaborators
 
-    def get_locations(self, obj):
+    # Fields left out when the collection is rendered nested, and the
+    # exclude_* context flags that drop them one by one
+    NESTED_OMIT_FIELDS = {'transportations', 'notes', 'checklists', 'lodging'}
+
+    def get_default_omit(self):
         if self.context.get('nested', False):
-            allowed_nested_fields = set(self.context.get('allowed_nested_fields', []))
-            return LocationSerializer(
-            obj.locations.all(), 
-            many=True, 
-            context={**self.context, 'nested': True, 'allowed_nested_fields': allowed_nested_fields}
-        ).data
-        
-        return LocationSerializer(obj.locations.all(), many=True, context=self.context).data
+            return set(self.NESTED_OMIT_FIELDS)
+        return {name for name in self.NESTED_OMIT_FIELDS if self.context.get(f'exclude_{name}', False)}
+
+    def get_locations(self, obj):
+        # Nested collections render their locations nested as well
+        return LocationSerializer(obj.locations.all(), many=True, context=self.context, **self.child_selection('locations')).data
 
     def get_transportations(self, obj):
-        # Only include transportations if not in nested context
-        if self.context.get('nested', False):
-            return []
-        return TransportationSerializer(obj.transportation_set.all(), many=True, context=self.context).data
+        return TransportationSerializer(obj.transportation_set.all(), many=True, context=self.context, **self.child_selection('transportations')).data
 
     def get_notes(self, obj):
-        # Only include notes if not in nested context
-        if self.context.get('nested', False):
-            return []
-        return NoteSerializer(obj.note_set.all(), many=True, context=self.context).data
+        return NoteSerializer(obj.note_set.all(), many=True, context=self.context, **self.child_selection('notes')).data
 
     def get_checklists(self, obj):
-        # Only include checklists if not in nested context
-        if self.context.get('nested', False):
-            return []
-        return ChecklistSerializer(obj.checklist_set.all(), many=True, context=self.context).data
+        return ChecklistSerializer(obj.checklist_set.all(), many=True, context=self.context, **self.child_selection('checklists')).data
 
     def get_lodging(self, obj):
-        # Only include lodging if not in nested context
-        if self.context.get('nested', False):
-            return []
-        return LodgingSerializer(obj.lodging_set.all(), many=True, context=self.context).data
+        return LodgingSerializer(obj.lodging_set.all(), many=True, context=self.context, **self.child_selection('lodging')).data
 
     def get_status(self, obj):
         """Calculate the status of the collection based on dates"""
@@ -903,16 +897,11 @@ class CollectionSerializer(CustomModelSerializer):
         representation = super().to_representation(instance)
         
         # Make it display the user uuid for the shared users instead of the PK
-        shared_uuids = []
-        for user in instance.shared_with.all():
-            shared_uuids.append(str(user.uuid))
-        representation['shared_with'] = shared_uuids
-        
-        # If nested, remove the heavy fields entirely from the response
-        if self.context.get('nested', False):
-            fields_to_remove = ['transportations', 'notes', 'checklists', 'lodging']
-            for field in fields_to_remove:
-                representation.pop(field, None)
+        if 'shared_with' in representation:
+            shared_uuids = []
+            for user in instance.shared_with.all():
+                shared_uuids.append(str(user.uuid))
+            representation['shared_with'] = shared_uuids
         
         return representation
     
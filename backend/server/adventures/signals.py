@@ -1,8 +1,17 @@
-from django.db.models.signals import m2m_changed, post_delete
+from django.db.models import UUIDField
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.contenttypes.models import ContentType
 
-from adventures.models import Location
+from adventures.models import (
+    Activity, Category, Checklist, ChecklistItem, Collection, CollectionItineraryDay, CollectionItineraryItem,
+    ContentAttachment, ContentImage, Location, Lodging, Note, Trail, Transportation, Visit,
+)
+from adventures.utils.gpx_artifacts import delete_unused_gpx_artifact
+from adventures.utils.response_cache import affected_user_ids, collection_user_ids, schedule_generation_bump
+from adventures.utils.user_stats import schedule_user_stats_refresh
+from users.models import CustomUser
+from worldtravel.models import VisitedCity, VisitedRegion
 
 
 @receiver(m2m_changed, sender=Location.collections.through)
@@ -29,6 +38,15 @@ def update_adventure_publicity(sender, instance, action, **kwargs):
                 instance.save(update_fields=['is_public'])
 
 
+# Senders whose rows an itinerary item can point at, decided once per model
+_ITINERARY_SENDERS = {}
+
+
+def _can_be_itinerary_item(model):
+    # CollectionItineraryItem.object_id is a UUID, so only models keyed by one can be referenced
+    return model is not CollectionItineraryItem and isinstance(model._meta.pk, UUIDField)
+
+
 @receiver(post_delete)
 def _remove_collection_itinerary_items_on_object_delete(sender, instance, **kwargs):
     """
@@ -37,38 +55,106 @@ def _remove_collection_itinerary_items_on_object_delete(sender, instance, **kwar
 
     This ensures that if a referenced item (e.g. a `Location`, `Visit`, `Transportation`,
     `Note`, etc.) is deleted, the itinerary entry that pointed to it is also removed.
+    Deletions of whole accounts and collections go through adventures.utils.deletion,
+    which removes the entries with one query per content type instead.
     """
-    # Avoid acting when a CollectionItineraryItem itself is deleted
-    # to prevent needless extra queries.
-    if sender.__name__ == 'CollectionItineraryItem':
+    eligible = _ITINERARY_SENDERS.get(sender)
+    if eligible is None:
+        eligible = _ITINERARY_SENDERS[sender] = _can_be_itinerary_item(sender)
+    if not eligible:
         return
 
-    # Resolve the content type for the model that was deleted
     try:
         ct = ContentType.objects.get_for_model(sender)
+        CollectionItineraryItem.objects.filter(content_type=ct, object_id=instance.pk).delete()
     except Exception:
-        return
+        # If deletion fails for any reason, do nothing; we don't want to
+        # raise errors during another model's delete.
+        pass
 
-    # Import here to avoid circular import problems at module import time
-    from adventures.models import CollectionItineraryItem
 
-    # Try matching the primary key in its native form first, then as a string.
-    # CollectionItineraryItem.object_id is a UUIDField in the model, but some
-    # senders might have different PK representations; handle both safely.
-    pk = instance.pk
-    deleted = False
-    try:
-        qs = CollectionItineraryItem.objects.filter(content_type=ct, object_id=pk)
-        if qs.exists():
-            qs.delete()
-            deleted = True
-    except Exception:
-        pass
+# UserStats maintenance: each change refreshes only the affected section of its owner's row.
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def _refresh_stats_on_location_change(sender, instance, created=True, **kwargs):
+    # Edits to an existing location don't change its owner's counts
+    if created:
+        schedule_user_stats_refresh(instance.user_id, 'locations')
+
+
+@receiver(post_save, sender=Visit)
+@receiver(post_delete, sender=Visit)
+def _refresh_stats_on_visit_change(sender, instance, **kwargs):
+    user_id = Location.objects.filter(pk=instance.location_id).values_list('user_id', flat=True).first()
+    schedule_user_stats_refresh(user_id, 'locations')
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def _refresh_stats_on_collection_change(sender, instance, created=True, **kwargs):
+    if created:
+        schedule_user_stats_refresh(instance.user_id, 'trips')
+
+
+@receiver(post_save, sender=VisitedRegion)
+@receiver(post_delete, sender=VisitedRegion)
+@receiver(post_save, sender=VisitedCity)
+@receiver(post_delete, sender=VisitedCity)
+def _refresh_stats_on_visited_change(sender, instance, **kwargs):
+    schedule_user_stats_refresh(instance.user_id, 'visited')
+
 
-    if not deleted:
-        try:
-            CollectionItineraryItem.objects.filter(content_type=ct, object_id=str(pk)).delete()
-        except Exception:
-            # If deletion fails for any reason, do nothing; we don't want to
-            # raise errors during another model's delete.
-            pass
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def _refresh_stats_on_activity_change(sender, instance, **kwargs):
+    schedule_user_stats_refresh(instance.user_id, 'activities')
+
+
+@receiver(post_delete, sender=ContentAttachment)
+@receiver(post_delete, sender=Activity)
+def _delete_unused_gpx_artifact(sender, instance, **kwargs):
+    delete_unused_gpx_artifact(instance.gpx_artifact_id)
+
+
+# Response cache invalidation: any change to content moves the generation of
+# every user who can see it (see adventures.utils.response_cache). These
+# receivers are connected after the UserStats ones so the stats refresh
+# queued by the same change runs before the bump.
+
+CACHED_CONTENT_MODELS = (
+    Location, Visit, Activity, Collection, Transportation, Lodging, Note, Checklist, ChecklistItem,
+    ContentImage, ContentAttachment, Category, Trail, CollectionItineraryDay, CollectionItineraryItem,
+    VisitedRegion, VisitedCity, CustomUser,
+)
+
+
+def _invalidate_cached_responses(sender, instance, **kwargs):
+    schedule_generation_bump(affected_user_ids(instance))
+
+
+for _model in CACHED_CONTENT_MODELS:
+    post_save.connect(_invalidate_cached_responses, sender=_model, dispatch_uid=f'response_cache_save_{_model.__name__}')
+    # pre_delete: the relations leading to collaborators are gone after the delete
+    pre_delete.connect(_invalidate_cached_responses, sender=_model, dispatch_uid=f'response_cache_delete_{_model.__name__}')
+
+
+@receiver(m2m_changed, sender=Location.collections.through)
+def _invalidate_cached_responses_on_location_collections(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    user_ids = affected_user_ids(instance)
+    if pk_set:
+        if reverse:
+            user_ids |= set(Location.objects.filter(pk__in=pk_set).values_list('user_id', flat=True))
+        else:
+            user_ids |= collection_user_ids(pk_set)
+    schedule_generation_bump(user_ids)
+
+
+@receiver(m2m_changed, sender=Collection.shared_with.through)
+def _invalidate_cached_responses_on_collection_sharing(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove'):
+        return
+    user_ids = set(pk_set or ()) if not reverse else collection_user_ids(pk_set)
+    schedule_generation_bump(user_ids | affected_user_ids(instance))
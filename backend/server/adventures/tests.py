@@ -1,3 +1,316 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from users.models import CustomUser
+from worldtravel.models import City, Country, Region
+from .models import Activity, Category, Collection, CollectionItineraryItem, Location, Note, Trail, Visit
+from .utils.deletion import delete_collection, delete_user_data
+from .utils.get_is_visited import visited_cutoff
+from .utils.gpx_analysis import analyze_gpx, elevation_gain_loss
+from .utils.track_storage import Track, encode_track, track_profile
+
+# Most queries /api/locations/all/ may run, however many locations are returned.
+LOCATION_LIST_QUERY_BUDGET = 20
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=False)
+class LocationListQueryBudgetTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(user=self.user, name='general', display_name='General')
+        country = Country.objects.create(name='Testland', country_code='TL')
+        self.region = Region.objects.create(id='TL-01', name='Test Region', country=country)
+        self.city = City.objects.create(id='TL-01-1', name='Test City', region=self.region)
+
+    def _create_locations(self, count):
+        for i in range(count):
+            location = Location.objects.create(
+                user=self.user, name=f'Location {i}', category=self.category,
+                country=self.region.country, region=self.region, city=self.city,
+            )
+            visit = Visit.objects.create(location=location, start_date=timezone.now())
+            Activity.objects.create(user=self.user, visit=visit, name=f'Activity {i}')
+            Trail.objects.create(user=self.user, location=location, name=f'Trail {i}', link='https://example.com')
+
+    def _count_list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/locations/all/?include_collections=true')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_001_all_locations_query_count_is_constant(self):
+        self._create_locations(2)
+        few_queries, data = self._count_list_queries()
+        self.assertEqual(len(data), 2)
+
+        self._create_locations(10)
+        many_queries, data = self._count_list_queries()
+        self.assertEqual(len(data), 12)
+
+        self.assertEqual(few_queries, many_queries)
+        self.assertLessEqual(many_queries, LOCATION_LIST_QUERY_BUDGET)
+        self.assertTrue(all(location['is_visited'] for location in data))
+
+    def test_002_sparse_fields_skip_unused_prefetches(self):
+        self._create_locations(3)
+        full_queries, _ = self._count_list_queries()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/locations/all/?include_collections=true&fields=id,name,images.id')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([set(location) for location in response.json()], [{'id', 'name', 'images'}] * 3)
+        self.assertLess(len(queries), full_queries)
+
+    def test_003_cursor_pages_rows_of_the_same_millisecond(self):
+        self._create_locations(2)
+        base = timezone.now().replace(microsecond=123000)
+        for i, offset in enumerate((200, 700)):
+            Location.objects.filter(name=f'Location {i}').update(updated_at=base + timedelta(microseconds=offset))
+
+        names, url = [], '/api/locations/?pagination=cursor&page_size=1&order_by=updated_at'
+        while url:
+            page = self.client.get(url).json()
+            names += [location['name'] for location in page['results']]
+            url = page['next']
+        self.assertEqual(names, ['Location 1', 'Location 0'])
+
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ResponseCacheTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(user=self.user, name='general', display_name='General')
+
+    def _create_location(self, name):
+        # Generations are bumped on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            Location.objects.create(user=self.user, name=name, category=self.category)
+
+    def test_001_changes_invalidate_cached_responses(self):
+        self._create_location('First')
+        self.assertEqual(len(self.client.get('/api/locations/all/?include_collections=true').json()), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.client.get('/api/locations/all/?include_collections=true').json()), 1)
+        self.assertFalse(any('adventures_location' in query['sql'] for query in queries.captured_queries))
+
+        self._create_location('Second')
+        self.assertEqual(len(self.client.get('/api/locations/all/?include_collections=true').json()), 2)
+
+
+    def test_002_unchanged_data_is_not_modified(self):
+        self._create_location('First')
+        response = self.client.get('/api/locations/')
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get('/api/locations/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/locations/?page_size=10', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        self._create_location('Second')
+        self.assertEqual(self.client.get('/api/locations/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_003_nearest_list_is_validated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                Location.objects.create(
+                    user=self.user, name=f'Near {i}', category=self.category, latitude=45 + i, longitude=7,
+                )
+        url = '/api/locations/?near=45,7&nearest=2'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([location['name'] for location in response.json()['results']], ['Near 0', 'Near 1'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_004_validators_expire_at_midnight(self):
+        self._create_location('First')
+        response = self.client.get('/api/locations/')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get('/api/locations/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('adventures.utils.conditional_get.visited_cutoff', lambda: visited_cutoff(tomorrow)):
+            self.assertEqual(self.client.get('/api/locations/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+            self.assertEqual(self.client.get('/api/locations/', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_005_cached_responses_expire_at_midnight(self):
+        self._create_location('First')
+        self.client.get('/api/locations/all/')
+
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch('adventures.utils.response_cache.visited_cutoff', lambda: visited_cutoff(tomorrow)):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(len(self.client.get('/api/locations/all/').json()), 1)
+        self.assertTrue(any('adventures_location' in query['sql'] for query in queries.captured_queries))
+
+
+class BulkLocationCreateTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+    def _payload(self, count):
+        return [
+            {
+                'name': f'Place {i}', 'category': {'name': 'Food', 'display_name': 'Food', 'icon': '🍜'},
+                'visits': [{'start_date': '2024-06-01T10:00:00Z'}],
+            }
+            for i in range(count)
+        ]
+
+    def test_001_batch_is_created_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as few:
+            response = self.client.post('/api/locations/bulk/', self._payload(2), format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.post('/api/locations/bulk/', {'locations': self._payload(20)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([location['name'] for location in response.json()][:2], ['Place 0', 'Place 1'])
+        self.assertLessEqual(len(many), len(few))
+
+        self.assertEqual(Location.objects.filter(user=self.user).count(), 22)
+        self.assertEqual(Category.objects.filter(user=self.user, name='food').count(), 1)
+        self.assertEqual(Visit.objects.filter(location__user=self.user, end_date__isnull=False).count(), 22)
+
+    def test_002_invalid_item_rejects_the_batch(self):
+        payload = self._payload(2) + [{'name': 'Bad', 'visits': [{'start_date': '2024-06-02T00:00:00Z', 'end_date': '2024-06-01T00:00:00Z'}]}]
+        response = self.client.post('/api/locations/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Location.objects.filter(user=self.user).exists())
+
+
+class DeletionTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.other = CustomUser.objects.create_user(username='other', email='other@example.com', password='testpassword')
+        self.location = Location.objects.create(user=self.user, name='Home')
+        visit = Visit.objects.create(location=self.location, start_date=timezone.now())
+        Activity.objects.create(user=self.user, visit=visit, name='Walk')
+        self.collection = Collection.objects.create(user=self.user, name='Trip')
+        Note.objects.create(user=self.user, name='Packing', collection=self.collection)
+        # The location is also planned in another user's shared trip
+        self.other_collection = Collection.objects.create(user=self.other, name='Shared trip')
+        self.other_collection.shared_with.add(self.user)
+        self.location.collections.add(self.other_collection)
+        CollectionItineraryItem.objects.create(
+            collection=self.other_collection, content_type=ContentType.objects.get_for_model(Location),
+            object_id=self.location.id, is_global=True, order=0,
+        )
+
+    def test_001_delete_user_data_removes_the_whole_graph(self):
+        counts = delete_user_data(self.user)
+        self.assertEqual((counts['locations'], counts['visits'], counts['activities'], counts['notes']), (1, 1, 1, 1))
+        self.assertFalse(Location.objects.filter(user=self.user).exists())
+        self.assertFalse(Collection.objects.filter(user=self.user).exists())
+        self.assertFalse(CollectionItineraryItem.objects.exists())
+        # Other users' content only loses the references
+        self.assertTrue(Collection.objects.filter(pk=self.other_collection.pk).exists())
+        self.assertTrue(CustomUser.objects.filter(pk=self.user.pk).exists())
+
+    def test_002_delete_collection_keeps_its_locations(self):
+        delete_collection(self.other_collection)
+        self.assertFalse(Collection.objects.filter(pk=self.other_collection.pk).exists())
+        self.assertEqual(list(self.location.collections.all()), [])
+        self.assertTrue(Location.objects.filter(pk=self.location.pk).exists())
+
+
+class GlobalSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(user=self.user, name='general', display_name='General')
+        for i in range(3):
+            Location.objects.create(user=self.user, name=f'Lake Como {i}', description='Boats', category=category)
+        Location.objects.create(user=self.user, name='Alps', description='Lake view', category=category)
+
+    def test_001_prefix_search_is_ranked_and_capped(self):
+        response = self.client.get('/api/search/?query=lake co&limit=2')
+        self.assertEqual(response.status_code, 200)
+        names = [location['name'] for location in response.json()['locations']]
+        self.assertEqual(names, ['Lake Como 0', 'Lake Como 1'])
+
+        # A name match outranks a description match
+        names = [location['name'] for location in self.client.get('/api/search/?query=lake').json()['locations']]
+        self.assertEqual(names[-1], 'Alps')
+
+
+SAMPLE_GPX = b"""<?xml version="1.0"?>
+<gpx version="1.1" creator="test" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk><name>Morning</name><trkseg>
+    <trkpt lat="45.0000" lon="7.0000"><ele>100</ele><time>2024-06-01T08:00:00Z</time></trkpt>
+    <trkpt lat="45.0010" lon="7.0000"><ele>110</ele><time>2024-06-01T08:01:00Z</time></trkpt>
+    <trkpt lat="45.0010" lon="7.0000"><ele>110</ele><time>2024-06-01T08:11:00Z</time></trkpt>
+    <trkpt lat="45.0020" lon="7.0000"><ele>105</ele><time>2024-06-01T08:12:00Z</time></trkpt>
+  </trkseg></trk>
+</gpx>"""
+
+
+class GpxAnalysisTestCase(SimpleTestCase):
+
+    def test_001_analyze_sample_track(self):
+        analysis = analyze_gpx(io.BytesIO(SAMPLE_GPX))
+        self.assertEqual(analysis.point_count, 4)
+        self.assertAlmostEqual(analysis.length_2d, 222.4, delta=0.5)
+        self.assertEqual((analysis.elevation_high, analysis.elevation_low), (110.0, 100.0))
+        self.assertEqual(analysis.elapsed_time, 12 * 60)
+        # The ten minutes spent standing still are not moving time
+        self.assertEqual(analysis.moving_time, 2 * 60)
+        self.assertEqual(analysis.bbox, [7.0, 45.0, 7.0, 45.002])
+        self.assertEqual(analysis.to_geojson()['features'][0]['properties']['name'], 'Morning')
+
+    def test_002_hysteresis_ignores_small_reversals(self):
+        profile = np.array([0, 10, 8, 12, 0], dtype=float)
+        self.assertEqual(elevation_gain_loss(profile, window=1), (14.0, 14.0))
+        self.assertEqual(elevation_gain_loss(profile, window=1, hysteresis=3), (12.0, 12.0))
+
+    def test_003_track_storage_round_trip(self):
+        analysis = analyze_gpx(io.BytesIO(SAMPLE_GPX))
+        track = Track(encode_track(analysis))
+        segment = analysis.segments[0]
+        np.testing.assert_allclose(track.lat, segment.lat)
+        np.testing.assert_allclose(track.elevation, segment.ele)
+        np.testing.assert_array_equal(track.time, segment.time)
+
+        profile = track_profile(track, points=3)
+        self.assertEqual(profile['points'], 3)
+        self.assertEqual(profile['distance'][0], 0)
+        self.assertEqual(profile['elevation'][-1], 105.0)
+
+    def test_004_track_storage_crosses_antimeridian(self):
+        gpx = b"""<?xml version="1.0"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+  <trk>
+    <trkseg>
+      <trkpt lat="-16.5" lon="179.99"></trkpt>
+      <trkpt lat="-16.5" lon="-179.99"></trkpt>
+      <trkpt lat="-16.6" lon="-120"></trkpt>
+    </trkseg>
+    <trkseg>
+      <trkpt lat="35.1" lon="139"></trkpt>
+      <trkpt lat="35.2" lon="-179.5"></trkpt>
+    </trkseg>
+  </trk>
+</gpx>"""
+        track = Track(encode_track(analyze_gpx(io.BytesIO(gpx))))
+        np.testing.assert_allclose(track.lon, [179.99, -179.99, -120, 139, -179.5])
+        np.testing.assert_allclose(track.lat, [-16.5, -16.5, -16.6, 35.1, 35.2])
+        self.assertLess(track.distances()[1], 2500)
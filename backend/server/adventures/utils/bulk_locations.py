@@ -0,0 +1,104 @@
+"""
+Creating many locations in one request (POST /locations/bulk/).
+
+Saving locations one by one costs a category lookup, collection checks and
+a geocode hand-off per row, plus the signal handlers of every save. Here the
+batch's categories and collections are each resolved with one query, rows
+are written with bulk_create and the side effects of the skipped signals
+(publicity from collections, UserStats, response cache generations,
+geocoding) run once for the whole batch.
+"""
+from django.db import transaction
+from django.db.models import Q
+from rest_framework.exceptions import PermissionDenied
+
+from adventures.models import Category, Collection, Location, Visit
+from adventures.utils.geocode_queue import enqueue_geocode_batch
+from adventures.utils.response_cache import collection_user_ids, schedule_generation_bump
+from adventures.utils.user_stats import schedule_user_stats_refresh
+
+# Rows per INSERT statement
+BULK_CREATE_BATCH_SIZE = 1000
+
+DEFAULT_CATEGORY = {'name': 'general', 'display_name': 'General', 'icon': '🌍'}
+
+
+def _resolve_categories(user, items):
+    """Map category name -> Category for every item, creating the missing ones."""
+    wanted = {}
+    for item in items:
+        category_data = item.get('category') or DEFAULT_CATEGORY
+        name = category_data.get('name') or DEFAULT_CATEGORY['name']
+        wanted.setdefault(name, category_data)
+
+    categories = {category.name: category for category in Category.objects.filter(user=user, name__in=wanted)}
+    missing = [
+        Category(
+            user=user, name=name,
+            display_name=data.get('display_name') or name,
+            icon=data.get('icon') or DEFAULT_CATEGORY['icon'],
+        )
+        for name, data in wanted.items() if name not in categories
+    ]
+    if missing:
+        Category.objects.bulk_create(missing, ignore_conflicts=True)
+        # Another request may have created some of them meanwhile
+        categories.update(
+            (category.name, category)
+            for category in Category.objects.filter(user=user, name__in=[category.name for category in missing])
+        )
+    return categories
+
+
+def _resolve_collections(user, items):
+    """Map collection id -> Collection for every collection the items reference."""
+    ids = {collection_id for item in items for collection_id in item.get('collections', ())}
+    if not ids:
+        return {}
+    collections = {
+        collection.id: collection
+        for collection in Collection.objects.filter(Q(user=user) | Q(shared_with=user), id__in=ids).distinct()
+    }
+    if len(collections) != len(ids):
+        raise PermissionDenied("You don't have permission to add locations to one or more of the collections.")
+    return collections
+
+
+@transaction.atomic
+def create_locations_in_bulk(user, items):
+    """
+    Create locations for `user` from the validated data of
+    BulkLocationSerializer. Returns the new locations in input order.
+    """
+    categories = _resolve_categories(user, items)
+    collections = _resolve_collections(user, items)
+
+    locations, visits, memberships = [], [], []
+    Membership = Location.collections.through
+    for item in items:
+        item = dict(item)
+        category_data = item.pop('category', None) or DEFAULT_CATEGORY
+        visits_data = item.pop('visits', [])
+        collection_ids = item.pop('collections', [])
+
+        location = Location(user=user, category=categories[category_data.get('name') or DEFAULT_CATEGORY['name']], **item)
+        if collection_ids:
+            # Same rule as the collection publicity signal
+            location.is_public = any(collections[collection_id].is_public for collection_id in collection_ids)
+        locations.append(location)
+        visits.extend(Visit(location=location, **visit_data) for visit_data in visits_data)
+        memberships.extend(
+            Membership(location_id=location.id, collection_id=collection_id) for collection_id in collection_ids
+        )
+
+    Location.objects.bulk_create(locations, batch_size=BULK_CREATE_BATCH_SIZE)
+    Visit.objects.bulk_create(visits, batch_size=BULK_CREATE_BATCH_SIZE)
+    Membership.objects.bulk_create(memberships, batch_size=BULK_CREATE_BATCH_SIZE)
+
+    # bulk_create sends no signals; do once what their receivers do per row
+    schedule_user_stats_refresh(user.id, 'locations')
+    schedule_generation_bump({user.id} | collection_user_ids(collections))
+    to_geocode = [str(location.id) for location in locations if location.latitude and location.longitude]
+    if to_geocode:
+        transaction.on_commit(lambda: enqueue_geocode_batch(to_geocode))
+    return locations
@@ -0,0 +1,136 @@
+"""
+Conditional GET (ETag / Last-Modified) for read-only viewset actions.
+
+Validators are computed before the view runs, without serializing anything:
+the newest `updated_at` and the row count of the action's queryset, the data
+generation of the users involved (see adventures.utils.response_cache; it
+moves on changes that don't touch `updated_at`, like a new image or visit),
+the query params, API_SCHEMA_VERSION and the current date (which visits
+count as past and trip statuses depend on it). A request whose If-None-Match
+(or, without one, If-Modified-Since) still matches is answered with an empty
+304 Not Modified.
+"""
+import hashlib
+from calendar import timegm
+from datetime import timedelta
+
+from django.db.models import Count, Max
+from django.utils.cache import patch_cache_control
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework.response import Response
+
+from adventures.utils.get_is_visited import visited_cutoff
+from adventures.utils.response_cache import get_generation
+
+# Bump when serializers change so clients don't keep payloads in the old shape
+API_SCHEMA_VERSION = 1
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin answering repeated GETs of unchanged data with 304.
+
+    `conditional_actions` lists the actions validated (detail actions look up
+    the object by the URL kwarg). Views whose data has no `updated_at` set
+    `etag_timestamp_field = None`; get_etag_parts adds anything else the
+    response depends on.
+    """
+    conditional_actions = ('list', 'retrieve')
+    etag_timestamp_field = 'updated_at'
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = self.last_modified = None
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return
+        validators = self.get_validators()
+        if validators is None:
+            return
+        self.etag, self.last_modified = validators
+        if self._not_modified(request):
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=304)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            if self.last_modified:
+                response['Last-Modified'] = http_date(self.last_modified)
+            # Browsers keep the payload but revalidate it on every use
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_etag_parts(self):
+        """Extra values the response depends on."""
+        return []
+
+    def get_validators(self):
+        """(ETag, Last-Modified epoch seconds) for the current request, or None to skip validation."""
+        field = self.etag_timestamp_field
+        queryset = self.filter_queryset(self.get_queryset())
+        if queryset.query.is_sliced:
+            # A sliced list (near=...&nearest=k) can't be reordered or aggregated; validate the same rows by pk
+            queryset = queryset.model._base_manager.filter(pk__in=queryset.values('pk'))
+        queryset = queryset.order_by()
+        user_ids = set()
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+
+        if lookup_url_kwarg in self.kwargs:
+            values = [field] if field else []
+            if hasattr(queryset.model, 'user_id'):
+                values.append('user_id')
+            row = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).values('pk', *values).first()
+            if row is None:
+                # Let the view answer 404
+                return None
+            timestamp, count = row.get(field), 1
+            user_ids.add(row.get('user_id'))
+        else:
+            values = ['pk', field] if field else ['pk']
+            aggregates = {'count': Count('pk')}
+            if field:
+                aggregates['timestamp'] = Max(field)
+            result = queryset.values(*values).aggregate(**aggregates)
+            timestamp, count = result.get('timestamp'), result['count']
+
+        if self.request.user.is_authenticated:
+            user_ids.add(self.request.user.id)
+        user_ids.discard(None)
+        try:
+            generations = sorted((user_id, get_generation(user_id)) for user_id in user_ids)
+        except Exception:
+            # Without the cache changes to related rows can't be tracked
+            return None
+
+        # Visited flags and trip statuses change at midnight without any write
+        cutoff = visited_cutoff()
+        last_modified = timegm(timestamp.utctimetuple()) if timestamp else 0
+        last_modified = max(last_modified, timegm((cutoff - timedelta(days=1)).utctimetuple()))
+        for _, generation in generations:
+            last_modified = max(last_modified, generation // 10 ** 9)
+
+        params = sorted((key, sorted(values)) for key, values in self.request.query_params.lists())
+        parts = (
+            API_SCHEMA_VERSION, self.request.user.id, self.action, sorted(self.kwargs.items()), params,
+            timestamp.isoformat() if timestamp else None, count, generations, cutoff.date().isoformat(),
+            self.get_etag_parts(),
+        )
+        etag = quote_etag(hashlib.sha1(repr(parts).encode('utf-8')).hexdigest())
+        return etag, last_modified
+
+    def _not_modified(self, request):
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return '*' in etags or self.etag in etags or self.etag.strip('"') in etags
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        return bool(if_modified_since and self.last_modified and self.last_modified <= if_modified_since)
@@ -0,0 +1,223 @@
+"""
+Set-based deletion of a user's or a collection's content.
+
+Deleting through the ORM collector loads every row, sends pre/post_delete
+for each one and runs the per-object delete() methods, which remove media
+files one by one. For a whole account (or a backup restore over one) that
+doesn't finish within a request. Here the object graph is described with
+querysets, rows are deleted children first in bounded chunks without
+signals, itinerary references are removed with one statement per content
+type, and files are handed to the background remover
+(adventures.utils.media_cleanup) once the deletion commits. The receivers
+that are skipped have their effects applied once for the whole deletion.
+
+Outside a transaction every chunk commits on its own, so no lock is held
+for the whole deletion; inside one (an import) the deletion stays atomic.
+"""
+import logging
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from adventures.utils.media_cleanup import field_files, remove_files_on_commit
+
+logger = logging.getLogger(__name__)
+
+# Rows removed per DELETE statement
+DELETE_CHUNK_SIZE = 1000
+
+
+def delete_in_chunks(queryset, chunk_size=DELETE_CHUNK_SIZE, before_delete=None):
+    """
+    Delete the rows of `queryset` `chunk_size` at a time without loading
+    them or sending signals. `before_delete(pks)` runs before each chunk.
+    Callers delete dependent rows first. Returns the number of rows deleted.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by().values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return deleted
+        if before_delete is not None:
+            before_delete(pks)
+        chunk = model._base_manager.using(queryset.db).filter(pk__in=pks)
+        deleted += chunk._raw_delete(chunk.db)
+
+
+def _content_q(model, queryset):
+    return Q(content_type=ContentType.objects.get_for_model(model), object_id__in=queryset.values('pk'))
+
+
+def _delete_media(image_q, attachment_q, gpx_artifact_ids):
+    from adventures.models import Collection, ContentAttachment, ContentImage
+
+    def before_images(pks):
+        images = ContentImage.objects.filter(pk__in=pks)
+        remove_files_on_commit(field_files(images, 'image'))
+        # Collections kept elsewhere may use one of these as their cover
+        Collection.objects.filter(primary_image__in=pks).update(primary_image=None)
+
+    def before_attachments(pks):
+        attachments = ContentAttachment.objects.filter(pk__in=pks)
+        remove_files_on_commit(field_files(attachments, 'file'))
+        gpx_artifact_ids.update(attachments.exclude(gpx_artifact=None).values_list('gpx_artifact_id', flat=True))
+
+    counts = {}
+    counts['images'] = delete_in_chunks(ContentImage.objects.filter(image_q), before_delete=before_images)
+    counts['attachments'] = delete_in_chunks(ContentAttachment.objects.filter(attachment_q), before_delete=before_attachments)
+    return counts
+
+
+def delete_attached_media(*instances):
+    """Delete the images and attachments of objects with media (Locations, Visits, Notes, ...)."""
+    from adventures.utils.gpx_artifacts import delete_unused_gpx_artifact
+
+    ids_by_type = {}
+    for instance in instances:
+        ids_by_type.setdefault(ContentType.objects.get_for_model(instance), []).append(instance.pk)
+    if not ids_by_type:
+        return
+    media_q = Q()
+    for content_type, ids in ids_by_type.items():
+        media_q |= Q(content_type=content_type, object_id__in=ids)
+    gpx_artifact_ids = set()
+    _delete_media(media_q, media_q, gpx_artifact_ids)
+    for artifact_id in gpx_artifact_ids:
+        delete_unused_gpx_artifact(artifact_id)
+
+
+def _delete_graph(scope, collection_ids, owner_ids, sections):
+    """
+    Delete everything in `scope` (kind -> queryset of the rows to remove;
+    'images' and 'attachments' are extra Q filters), children first, then apply the effects of the skipped signal
+    receivers for `owner_ids` and the users of `collection_ids`.
+    """
+    from adventures.models import (
+        Activity, Checklist, Collection, CollectionInvite, CollectionItineraryDay, CollectionItineraryItem, GpxArtifact,
+        Location, Lodging, Note, Trail, Transportation, Visit,
+    )
+    from adventures.utils.response_cache import collection_user_ids, schedule_generation_bump
+    from adventures.utils.user_stats import schedule_user_stats_refresh
+
+    collections = scope['collections']
+    affected_user_ids = set(owner_ids) | collection_user_ids(collection_ids)
+    counts = {}
+
+    # Itinerary entries: those of the collections, then those pointing at deleted content
+    counts['itinerary_items'] = delete_in_chunks(CollectionItineraryItem.objects.filter(collection__in=collections))
+    referenced = (
+        (Location, 'locations'), (Visit, 'visits'), (Transportation, 'transportations'), (Lodging, 'lodgings'),
+        (Note, 'notes'), (Checklist, 'checklists'), (Trail, 'trails'), (Activity, 'activities'),
+    )
+    for model, name in referenced:
+        counts['itinerary_items'] += delete_in_chunks(
+            CollectionItineraryItem.objects.filter(_content_q(model, scope[name]))
+        )
+    delete_in_chunks(CollectionItineraryDay.objects.filter(collection__in=collections))
+    delete_in_chunks(CollectionInvite.objects.filter(collection__in=collections))
+    delete_in_chunks(Location.collections.through.objects.filter(
+        Q(location__in=scope['locations']) | Q(collection__in=collections)
+    ))
+    delete_in_chunks(Collection.shared_with.through.objects.filter(collection__in=collections))
+
+    # Media of every object with images/attachments
+    media_q = Q()
+    for model, name in ((Location, 'locations'), (Visit, 'visits'), (Transportation, 'transportations'),
+                        (Lodging, 'lodgings'), (Note, 'notes')):
+        media_q |= _content_q(model, scope[name])
+    gpx_artifact_ids = set()
+    counts.update(_delete_media(
+        media_q | scope.get('images', Q(pk__in=[])),
+        media_q | scope.get('attachments', Q(pk__in=[])),
+        gpx_artifact_ids,
+    ))
+
+    def before_activities(pks):
+        activities = Activity.objects.filter(pk__in=pks)
+        remove_files_on_commit(field_files(activities, 'gpx_file'))
+        gpx_artifact_ids.update(activities.exclude(gpx_artifact=None).values_list('gpx_artifact_id', flat=True))
+
+    counts['activities'] = delete_in_chunks(scope['activities'], before_delete=before_activities)
+    for name in ('trails', 'visits', 'checklist_items', 'checklists', 'notes', 'transportations', 'lodgings',
+                 'locations', 'collections', 'categories', 'visited_cities', 'visited_regions'):
+        if name in scope:
+            counts[name] = delete_in_chunks(scope[name])
+
+    if gpx_artifact_ids:
+        delete_in_chunks(GpxArtifact.objects.filter(
+            pk__in=gpx_artifact_ids, attachments__isnull=True, activities__isnull=True
+        ))
+
+    for user_id in owner_ids:
+        for section in sections:
+            schedule_user_stats_refresh(user_id, section)
+    schedule_generation_bump(affected_user_ids)
+    logger.info(f"Deleted {sum(counts.values())} rows: {counts}")
+    return counts
+
+
+def delete_user_data(user):
+    """
+    Delete everything `user` owns: locations, collections (with the
+    collaborators' content in them), categories, visited places and all
+    their media. The user row itself is kept. Returns row counts per kind.
+    """
+    from adventures.models import (
+        Activity, Category, Checklist, ChecklistItem, Collection, Location, Lodging, Note, Trail,
+        Transportation, Visit,
+    )
+    from worldtravel.models import VisitedCity, VisitedRegion
+    from adventures.utils.user_stats import SECTIONS
+
+    collections = Collection.objects.filter(user=user)
+    locations = Location.objects.filter(user=user)
+    owned_or_in_collections = Q(user=user) | Q(collection__user=user)
+    checklists = Checklist.objects.filter(owned_or_in_collections)
+    visits = Visit.objects.filter(location__user=user)
+    trails = Trail.objects.filter(Q(user=user) | Q(location__user=user))
+    scope = {
+        'collections': collections,
+        'locations': locations,
+        'visits': visits,
+        'trails': trails,
+        'activities': Activity.objects.filter(Q(user=user) | Q(visit__in=visits) | Q(trail__in=trails)),
+        'transportations': Transportation.objects.filter(owned_or_in_collections),
+        'lodgings': Lodging.objects.filter(owned_or_in_collections),
+        'notes': Note.objects.filter(owned_or_in_collections),
+        'checklists': checklists,
+        'checklist_items': ChecklistItem.objects.filter(Q(user=user) | Q(checklist__in=checklists)),
+        'images': Q(user=user),
+        'attachments': Q(user=user),
+        'categories': Category.objects.filter(user=user),
+        'visited_cities': VisitedCity.objects.filter(user=user),
+        'visited_regions': VisitedRegion.objects.filter(user=user),
+    }
+    # Collections of other users holding this user's locations change too
+    collection_ids = set(collections.values_list('pk', flat=True)) | set(
+        Location.collections.through.objects.filter(location__user=user).values_list('collection_id', flat=True)
+    )
+    return _delete_graph(scope, collection_ids, {user.id}, SECTIONS)
+
+
+def delete_collection(collection):
+    """
+    Delete a collection with its transportations, lodgings, notes,
+    checklists, itinerary and their media. Its locations are only unlinked.
+    """
+    from adventures.models import Activity, Checklist, ChecklistItem, Collection, Location, Lodging, Note, Trail, Transportation, Visit
+
+    checklists = Checklist.objects.filter(collection=collection)
+    scope = {
+        'collections': Collection.objects.filter(pk=collection.pk),
+        'locations': Location.objects.none(),
+        'visits': Visit.objects.none(),
+        'trails': Trail.objects.none(),
+        'activities': Activity.objects.none(),
+        'transportations': Transportation.objects.filter(collection=collection),
+        'lodgings': Lodging.objects.filter(collection=collection),
+        'notes': Note.objects.filter(collection=collection),
+        'checklists': checklists,
+        'checklist_items': ChecklistItem.objects.filter(checklist__in=checklists),
+    }
+    return _delete_graph(scope, {collection.pk}, {collection.user_id}, ('trips',))
@@ -0,0 +1,158 @@
+import hashlib
+import logging
+import random
+import re
+import unicodedata
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from worldtravel.utils import get_world_data_version
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'geocode:'
+
+# Provider answers that are worth remembering even though they carry no result.
+NEGATIVE_ERRORS = {
+    "No region found",
+    "No locations found for the given query.",
+    "No location found for the given coordinates.",
+}
+
+# Fraction of writes that also trigger expiry/LRU pruning of the table.
+PRUNE_PROBABILITY = 0.01
+
+
+def normalize_query(query):
+    """Casefold, NFKC-normalize and collapse whitespace so equivalent searches share a key."""
+    normalized = unicodedata.normalize("NFKC", str(query)).casefold()
+    return re.sub(r"\s+", " ", normalized).strip()
+
+
+def search_cache_key(provider, query):
+    digest = hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()
+    return f"search:{provider}:{digest}"
+
+
+def reverse_cache_key(provider, lat, lon):
+    """
+    Key reverse lookups by a lat/lon grid of GEOCODE_CACHE_PRECISION decimal
+    places and the world data version, since results carry region and city
+    ids that a re-import may rename or remove.
+    """
+    precision = settings.GEOCODE_CACHE_PRECISION
+    version = get_world_data_version()
+    return f"reverse:{provider}:{version}:{float(lat):.{precision}f}:{float(lon):.{precision}f}"
+
+
+def is_cacheable(result):
+    if isinstance(result, list):
+        return True
+    if isinstance(result, dict):
+        return "error" not in result or result["error"] in NEGATIVE_ERRORS
+    return False
+
+
+def _is_negative(result):
+    return not result or (isinstance(result, dict) and "error" in result)
+
+
+def get_cached_result(key):
+    """
+    Return the cached provider result for `key`, or None on a miss.
+    Memcached is consulted first, then the persistent table.
+    """
+    if not settings.GEOCODE_CACHE_ENABLED:
+        return None
+
+    try:
+        result = cache.get(CACHE_PREFIX + key)
+    except Exception:
+        result = None
+    if result is not None:
+        return result
+
+    from adventures.models import GeocodeCacheEntry
+
+    now = timezone.now()
+    try:
+        entry = GeocodeCacheEntry.objects.filter(key=key, expires_at__gt=now).only('result', 'expires_at').first()
+        if entry is None:
+            return None
+        GeocodeCacheEntry.objects.filter(pk=entry.pk).update(last_used_at=now, hit_count=F('hit_count') + 1)
+    except DatabaseError as e:
+        logger.warning(f"Geocode cache lookup failed for {key}: {e}")
+        return None
+
+    try:
+        cache.set(CACHE_PREFIX + key, entry.result, max(1, int((entry.expires_at - now).total_seconds())))
+    except Exception:
+        pass
+    return entry.result
+
+
+def cache_result(key, provider, kind, result):
+    """Store a provider result if it is a success or a known negative answer."""
+    if not settings.GEOCODE_CACHE_ENABLED or not is_cacheable(result):
+        return
+
+    from adventures.models import GeocodeCacheEntry
+
+    is_negative = _is_negative(result)
+    ttl = settings.GEOCODE_CACHE_NEGATIVE_TTL if is_negative else settings.GEOCODE_CACHE_TTL
+    now = timezone.now()
+
+    try:
+        cache.set(CACHE_PREFIX + key, result, ttl)
+    except Exception:
+        pass
+
+    try:
+        GeocodeCacheEntry.objects.update_or_create(
+            key=key,
+            defaults={
+                'kind': kind,
+                'provider': provider,
+                'result': result,
+                'is_negative': is_negative,
+                'last_used_at': now,
+                'expires_at': now + timedelta(seconds=ttl),
+            },
+        )
+    except IntegrityError:
+        # Another worker stored the same key concurrently; its result is just as good.
+        pass
+    except DatabaseError as e:
+        logger.warning(f"Geocode cache write failed for {key}: {e}")
+        return
+
+    if random.random() < PRUNE_PROBABILITY:
+        prune_geocode_cache()
+
+
+def prune_geocode_cache():
+    """
+    Drop expired entries, then evict the least recently used entries beyond
+    GEOCODE_CACHE_MAX_ENTRIES. Returns the number of rows deleted.
+    """
+    from adventures.models import GeocodeCacheEntry
+
+    deleted, _ = GeocodeCacheEntry.objects.filter(expires_at__lte=timezone.now()).delete()
+
+    max_entries = settings.GEOCODE_CACHE_MAX_ENTRIES
+    overflow = GeocodeCacheEntry.objects.count() - max_entries
+    if overflow > 0:
+        stale_ids = list(
+            GeocodeCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:overflow]
+        )
+        evicted, _ = GeocodeCacheEntry.objects.filter(id__in=stale_ids).delete()
+        deleted += evicted
+
+    if deleted:
+        logger.info(f"Pruned {deleted} geocode cache entries")
+    return deleted
@@ -0,0 +1,176 @@
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeDispatcher:
+    """
+    Fixed-size pool of background threads that reverse geocode locations.
+
+    Saves only enqueue the location id. Ids already waiting in the queue are
+    coalesced, so a burst of saves on one location costs a single lookup.
+    Jobs that fail transiently (timeouts, 429s) are retried with exponential
+    backoff up to `max_retries` times.
+    """
+
+    def __init__(self, workers, max_retries, retry_backoff):
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._scheduled_retries = 0
+        self._in_flight = 0
+        self._processed = 0
+        self._failed = 0
+        self._retried = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        # Called with self._lock held. Threads start lazily so that management
+        # commands and migrations that never save a location don't spawn them.
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"geocode-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def enqueue(self, location_id, attempt=0):
+        """Queue a location for geocoding. Returns False if it was already queued."""
+        location_id = str(location_id)
+        with self._lock:
+            if location_id in self._pending:
+                return False
+            self._pending.add(location_id)
+            self._ensure_started()
+            depth = len(self._pending)
+
+        self._queue.put((location_id, attempt))
+        if depth % 100 == 0:
+            logger.info(f"Geocode queue depth: {depth}")
+        return True
+
+    def enqueue_many(self, location_ids):
+        """Queue a batch of locations under one lock. Returns how many were newly queued."""
+        location_ids = [str(location_id) for location_id in location_ids]
+        with self._lock:
+            new_ids = [location_id for location_id in dict.fromkeys(location_ids) if location_id not in self._pending]
+            if not new_ids:
+                return 0
+            self._pending.update(new_ids)
+            self._ensure_started()
+            depth = len(self._pending)
+
+        for location_id in new_ids:
+            self._queue.put((location_id, 0))
+        logger.info(f"Queued {len(new_ids)} locations for geocoding, queue depth: {depth}")
+        return len(new_ids)
+
+    def queue_depth(self):
+        """Number of jobs waiting to run, including scheduled retries."""
+        with self._lock:
+            return len(self._pending) + self._scheduled_retries
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': len(self._pending) + self._scheduled_retries,
+                'in_flight': self._in_flight,
+                'processed': self._processed,
+                'failed': self._failed,
+                'retried': self._retried,
+                'workers': self.workers,
+            }
+
+    def wait_until_idle(self, poll_interval=0.5):
+        """Block until every queued, retrying and running job has finished."""
+        while True:
+            with self._lock:
+                if not self._pending and not self._scheduled_retries and not self._in_flight:
+                    return
+            time.sleep(poll_interval)
+
+    def _schedule_retry(self, location_id, attempt):
+        delay = self.retry_backoff * (2 ** (attempt - 1))
+
+        def _requeue():
+            with self._lock:
+                self._scheduled_retries -= 1
+                if location_id in self._pending:
+                    return  # A newer save already queued it.
+                self._pending.add(location_id)
+            self._queue.put((location_id, attempt))
+
+        with self._lock:
+            self._scheduled_retries += 1
+            self._retried += 1
+        timer = threading.Timer(delay, _requeue)
+        timer.daemon = True
+        timer.start()
+
+    def _run(self):
+        from adventures.models import background_geocode_and_assign
+
+        while True:
+            location_id, attempt = self._queue.get()
+            with self._lock:
+                self._pending.discard(location_id)
+                self._in_flight += 1
+
+            completed = True
+            try:
+                close_old_connections()
+                completed = background_geocode_and_assign(location_id)
+            except Exception:
+                # Not a provider failure; retrying won't help.
+                logger.exception(f"Geocode job for location {location_id} crashed")
+            finally:
+                close_old_connections()
+
+            # Schedule any retry before leaving the in-flight state so
+            # wait_until_idle() never sees a gap between the two.
+            if not completed and attempt < self.max_retries:
+                self._schedule_retry(location_id, attempt + 1)
+            elif not completed:
+                with self._lock:
+                    self._failed += 1
+                logger.warning(f"Giving up geocoding location {location_id} after {attempt + 1} attempts")
+
+            with self._lock:
+                self._in_flight -= 1
+                self._processed += 1
+            self._queue.task_done()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_geocode_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = GeocodeDispatcher(
+                    workers=settings.GEOCODE_WORKERS,
+                    max_retries=settings.GEOCODE_MAX_RETRIES,
+                    retry_backoff=settings.GEOCODE_RETRY_BACKOFF,
+                )
+    return _dispatcher
+
+
+def enqueue_geocode(location_id):
+    return get_geocode_dispatcher().enqueue(location_id)
+
+
+def enqueue_geocode_batch(location_ids):
+    return get_geocode_dispatcher().enqueue_many(location_ids)
@@ -1,5 +1,5 @@
-import gpxpy
-import geojson
+from adventures.utils.gpx_analysis import analyze_gpx_file
+
 
 def gpx_to_geojson(gpx_file):
     """
@@ -15,25 +15,10 @@ def gpx_to_geojson(gpx_file):
         return None
 
     try:
-        with gpx_file.open('r') as f:
-            gpx = gpxpy.parse(f)
-
-        features = []
-        for track in gpx.tracks:
-            track_name = track.name or "GPX Track"
-            for segment in track.segments:
-                coords = [(point.longitude, point.latitude) for point in segment.points]
-                if coords:
-                    feature = geojson.Feature(
-                        geometry=geojson.LineString(coords),
-                        properties={"name": track_name}
-                    )
-                    features.append(feature)
-
-        return geojson.FeatureCollection(features)
+        return analyze_gpx_file(gpx_file).to_geojson()
 
     except Exception as e:
         return {
             "error": str(e),
             "message": "Failed to convert GPX to GeoJSON"
-        }
\ No newline at end of file
+        }
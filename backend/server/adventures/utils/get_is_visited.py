@@ -1,16 +1,51 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
 
 
+def visited_cutoff(now=None):
+    """
+    End of the current day (UTC). A visit that starts before this moment, i.e.
+    today or earlier, makes its location visited.
+    """
+    now = now or timezone.now()
+    return datetime.combine(now.date() + timedelta(days=1), time.min, tzinfo=now.tzinfo)
+
+
+def location_visited_exists(location_ref='pk'):
+    """
+    Exists() subquery equivalent to is_location_visited, for annotating or
+    filtering location querysets in SQL. `location_ref` is the outer field
+    holding the location id.
+    """
+    from adventures.models import Visit
+
+    return Exists(
+        Visit.objects.filter(location=OuterRef(location_ref), start_date__lt=visited_cutoff())
+    )
+
+
 def is_location_visited(location):
     """
     Check if a location has been visited based on its visits.
     
+    Uses the `is_visited` annotation (LocationQuerySet.with_is_visited) or
+    prefetched visits when available, otherwise runs a single EXISTS query.
+
     Args:
         location: Location instance with visits relationship
         
     Returns:
         bool: True if location has been visited, False otherwise
     """
+    annotated = getattr(location, 'is_visited', None)
+    if annotated is not None:
+        return annotated
+
+    if 'visits' not in getattr(location, '_prefetched_objects_cache', {}):
+        return location.visits.filter(start_date__lt=visited_cutoff()).exists()
+
     current_date = timezone.now().date()
     
     for visit in location.visits.all():
@@ -22,4 +57,4 @@ def is_location_visited(location):
         elif start_date and not end_date and (start_date <= current_date):
             return True
             
-    return False
\ No newline at end of file
+    return False
@@ -0,0 +1,342 @@
+"""
+Single-pass GPX analysis.
+
+The GPX XML is streamed with iterparse and each track/route segment is loaded
+into NumPy arrays; every statistic the app needs (distance, elevation
+gain/loss, high/low, moving and elapsed time, speeds, bounding box and the
+track geometry) is then computed with vectorized operations. This avoids
+building gpxpy's per-point object graph, which dominated parse time and
+memory for long multi-day tracks.
+"""
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+import xml.etree.ElementTree as ET
+
+import geojson
+import numpy as np
+
+# Mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+
+# Centered moving average window applied to elevations before gain/loss (points)
+ELEVATION_SMOOTHING_WINDOW = 3
+
+# Minimum climb or descent counted towards gain/loss, in meters. 0 sums every
+# change of the smoothed profile.
+ELEVATION_HYSTERESIS = 0.0
+
+# Below this speed (m/s) the time between two points counts as stopped (1 km/h, as in gpxpy)
+MOVING_SPEED_THRESHOLD = 1 / 3.6
+
+# Share of the fastest point-to-point speeds ignored as GPS spikes when taking the max speed
+MAX_SPEED_PERCENTILE = 95
+
+_POINT_TAGS = {'trkpt': 'track', 'rtept': 'route'}
+_SEGMENT_TAGS = {'trkseg', 'rte'}
+
+
+_local_names = {}
+
+
+def _local_name(tag):
+    """Tag without its XML namespace ('{http://www.topografix.com/GPX/1/1}trkpt' -> 'trkpt')."""
+    name = _local_names.get(tag)
+    if name is None:
+        name = _local_names[tag] = tag.rsplit('}', 1)[-1]
+    return name
+
+
+def _parse_time(text):
+    try:
+        value = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return np.nan
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+@dataclass
+class GpxSegment:
+    """One track segment or route, as parallel arrays. Missing elevations/times are NaN."""
+    kind: str
+    name: str
+    lat: np.ndarray
+    lon: np.ndarray
+    ele: np.ndarray
+    time: np.ndarray
+
+    def __len__(self):
+        return len(self.lat)
+
+
+def read_gpx(source):
+    """
+    Stream a GPX document from a path or binary file object.
+    Returns (segments, waypoint_elevations).
+    """
+    segments = []
+    waypoint_elevations = array('d')
+    names = {}
+    current = None
+    point = None
+    # Open elements; finished points are dropped from their parent so memory
+    # stays flat however long the track is.
+    stack = []
+
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        tag = _local_name(elem.tag)
+
+        if event == 'start':
+            stack.append(elem)
+            if tag in ('trk', 'rte'):
+                names[tag] = None
+            if tag in _SEGMENT_TAGS:
+                current = {'lat': array('d'), 'lon': array('d'), 'ele': array('d'), 'time': array('d')}
+            elif tag in _POINT_TAGS or tag == 'wpt':
+                point = {'ele': np.nan, 'time': np.nan}
+            continue
+
+        stack.pop()
+
+        if tag == 'ele' and point is not None:
+            try:
+                point['ele'] = float(elem.text)
+            except (TypeError, ValueError):
+                pass
+        elif tag == 'time' and point is not None and elem.text:
+            point['time'] = _parse_time(elem.text)
+        elif tag == 'name' and stack and elem.text:
+            parent = _local_name(stack[-1].tag)
+            if parent in names:
+                names[parent] = elem.text.strip()
+        elif tag in _POINT_TAGS and current is not None:
+            current['lat'].append(float(elem.get('lat')))
+            current['lon'].append(float(elem.get('lon')))
+            current['ele'].append(point['ele'])
+            current['time'].append(point['time'])
+            point = None
+            del stack[-1][:]
+        elif tag == 'wpt':
+            if not np.isnan(point['ele']):
+                waypoint_elevations.append(point['ele'])
+            point = None
+            del stack[-1][:]
+        elif tag in _SEGMENT_TAGS:
+            kind = 'route' if tag == 'rte' else 'track'
+            segments.append(GpxSegment(
+                kind=kind,
+                name=names.get('rte' if kind == 'route' else 'trk'),
+                **{key: np.frombuffer(values, dtype=np.float64) for key, values in current.items()},
+            ))
+            current = None
+            del stack[-1][:]
+
+    return segments, np.frombuffer(waypoint_elevations, dtype=np.float64)
+
+
+def haversine(lat, lon):
+    """Distances in meters between consecutive points."""
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    dlat = np.diff(lat)
+    dlon = np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def smooth(values, window=ELEVATION_SMOOTHING_WINDOW):
+    """Centered moving average that shrinks the window at both ends."""
+    if window <= 1 or len(values) < window:
+        return values
+    half = window // 2
+    cumsum = np.concatenate(([0.0], np.cumsum(values)))
+    index = np.arange(len(values))
+    start = np.maximum(index - half, 0)
+    end = np.minimum(index + half + 1, len(values))
+    return (cumsum[end] - cumsum[start]) / (end - start)
+
+
+def _turning_points(values):
+    """Drop the points inside monotonic runs; gain/loss only depends on the local extrema."""
+    diffs = np.diff(values)
+    moving = np.flatnonzero(diffs)
+    if len(moving) < 2:
+        return values[[0, -1]]
+    signs = np.sign(diffs[moving])
+    turns = moving[1:][signs[1:] != signs[:-1]]
+    return values[np.concatenate(([0], turns, [len(values) - 1]))]
+
+
+def elevation_gain_loss(elevations, window=ELEVATION_SMOOTHING_WINDOW, hysteresis=ELEVATION_HYSTERESIS):
+    """
+    Total climb and descent of an elevation profile. The profile is smoothed
+    first; with a hysteresis, climbs and descents smaller than it are ignored.
+    """
+    elevations = elevations[~np.isnan(elevations)]
+    if len(elevations) < 2:
+        return 0.0, 0.0
+
+    elevations = smooth(elevations, window)
+    if hysteresis <= 0:
+        diffs = np.diff(elevations)
+        return float(diffs[diffs > 0].sum()), float(-diffs[diffs < 0].sum())
+
+    # Confirm a climb (descent) only once the profile has dropped (risen)
+    # `hysteresis` below (above) its highest (lowest) point.
+    gain = loss = 0.0
+    extrema = _turning_points(elevations).tolist()
+    reference = extreme = extrema[0]
+    trend = 0
+    for value in extrema[1:]:
+        if trend >= 0 and value > extreme or trend <= 0 and value < extreme:
+            extreme = value
+        if trend == 0:
+            if abs(extreme - reference) >= hysteresis:
+                trend = 1 if extreme > reference else -1
+        elif trend > 0 and value <= extreme - hysteresis:
+            gain += extreme - reference
+            reference, extreme, trend = extreme, value, -1
+        elif trend < 0 and value >= extreme + hysteresis:
+            loss += reference - extreme
+            reference, extreme, trend = extreme, value, 1
+
+    if trend > 0:
+        gain += extreme - reference
+    elif trend < 0:
+        loss += reference - extreme
+    return gain, loss
+
+
+@dataclass
+class GpxAnalysis:
+    """Statistics of a GPX document. Distances are in meters, times in seconds, speeds in m/s."""
+    segments: list = field(repr=False)
+    length_2d: float = 0.0
+    length_3d: float = 0.0
+    point_count: int = 0
+    elevation_gain: float = 0.0
+    elevation_loss: float = 0.0
+    elevation_high: float = None
+    elevation_low: float = None
+    start_time: datetime = None
+    end_time: datetime = None
+    elapsed_time: float = 0.0
+    moving_time: float = 0.0
+    moving_distance: float = 0.0
+    average_speed: float = 0.0
+    max_speed: float = 0.0
+    bbox: list = None  # [min_lon, min_lat, max_lon, max_lat]
+
+    @property
+    def start_point(self):
+        """(lat, lon) of the first point, or None."""
+        for segment in self.segments:
+            if len(segment):
+                return float(segment.lat[0]), float(segment.lon[0])
+        return None
+
+    @property
+    def end_point(self):
+        """(lat, lon) of the last point, or None."""
+        for segment in reversed(self.segments):
+            if len(segment):
+                return float(segment.lat[-1]), float(segment.lon[-1])
+        return None
+
+    def to_geojson(self, simplify=None):
+        """
+        FeatureCollection with one LineString per track segment. `simplify`, if
+        given, is applied to each segment's list of (lon, lat) coordinates.
+        """
+        features = []
+        for segment in self.segments:
+            if segment.kind != 'track' or not len(segment):
+                continue
+            coords = np.column_stack((segment.lon, segment.lat)).tolist()
+            if simplify:
+                coords = simplify(coords)
+            features.append(geojson.Feature(
+                geometry=geojson.LineString(coords),
+                properties={"name": segment.name or "GPX Track"},
+            ))
+        return geojson.FeatureCollection(features)
+
+
+def analyze_gpx(source, smoothing_window=ELEVATION_SMOOTHING_WINDOW, hysteresis=ELEVATION_HYSTERESIS):
+    """Read a GPX document (path or binary file object) and compute its statistics in one pass."""
+    segments, waypoint_elevations = read_gpx(source)
+    result = GpxAnalysis(segments=segments)
+
+    all_elevations = [waypoint_elevations]
+    speeds = []
+    first_time = last_time = np.nan
+
+    for segment in segments:
+        n = len(segment)
+        result.point_count += n
+        if n == 0:
+            continue
+
+        elevations = segment.ele
+        all_elevations.append(elevations)
+        gain, loss = elevation_gain_loss(elevations, smoothing_window, hysteresis)
+        result.elevation_gain += gain
+        result.elevation_loss += loss
+
+        bbox = [segment.lon.min(), segment.lat.min(), segment.lon.max(), segment.lat.max()]
+        if result.bbox is None:
+            result.bbox = bbox
+        else:
+            result.bbox = [min(result.bbox[0], bbox[0]), min(result.bbox[1], bbox[1]),
+                           max(result.bbox[2], bbox[2]), max(result.bbox[3], bbox[3])]
+
+        valid_times = segment.time[~np.isnan(segment.time)]
+        if len(valid_times):
+            first_time = np.fmin(first_time, valid_times[0])
+            last_time = np.fmax(last_time, valid_times[-1])
+
+        if n < 2:
+            continue
+
+        distances = haversine(segment.lat, segment.lon)
+        climbs = np.nan_to_num(np.diff(elevations))
+        result.length_2d += float(distances.sum())
+        result.length_3d += float(np.sqrt(distances ** 2 + climbs ** 2).sum())
+
+        durations = np.diff(segment.time)
+        timed = durations > 0  # False for NaN as well
+        segment_speeds = np.zeros_like(distances)
+        segment_speeds[timed] = distances[timed] / durations[timed]
+        moving = timed & (segment_speeds > MOVING_SPEED_THRESHOLD)
+        result.moving_time += float(durations[moving].sum())
+        result.moving_distance += float(distances[moving].sum())
+        speeds.append(segment_speeds[moving])
+
+    elevations = np.concatenate(all_elevations)
+    elevations = elevations[~np.isnan(elevations)]
+    if len(elevations):
+        result.elevation_high = float(elevations.max())
+        result.elevation_low = float(elevations.min())
+
+    if not np.isnan(first_time):
+        result.start_time = datetime.fromtimestamp(first_time, tz=timezone.utc)
+        result.end_time = datetime.fromtimestamp(last_time, tz=timezone.utc)
+        result.elapsed_time = float(last_time - first_time)
+
+    speeds = np.concatenate(speeds) if speeds else np.empty(0)
+    if len(speeds):
+        result.max_speed = float(np.percentile(speeds, MAX_SPEED_PERCENTILE))
+    if result.moving_time > 0:
+        result.average_speed = result.moving_distance / result.moving_time
+
+    if result.bbox is not None:
+        result.bbox = [float(value) for value in result.bbox]
+    return result
+
+
+def analyze_gpx_file(file_field, **kwargs):
+    """analyze_gpx for a stored FileField/FieldFile."""
+    with file_field.open('rb') as f:
+        return analyze_gpx(f, **kwargs)
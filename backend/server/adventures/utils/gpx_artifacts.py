@@ -0,0 +1,189 @@
+"""
+GPX-derived artifacts (GpxArtifact).
+
+A GPX file is parsed once, when it is saved, into its GeoJSON, simplified
+GeoJSON per map zoom level, bounding box, length and point count. Serializers
+read the stored row instead of re-parsing the file on every request. Rows are
+keyed by the stored file name, so they are recomputed only when the file
+itself changes.
+"""
+import logging
+import math
+
+from adventures.utils.gpx_analysis import analyze_gpx_file
+from adventures.utils.track_storage import encode_track
+
+logger = logging.getLogger(__name__)
+
+# Zoom levels a simplified copy of the tracks is kept for
+SIMPLIFY_ZOOM_LEVELS = (6, 10, 14)
+
+# Largest deviation from the original track allowed at a zoom level, in screen pixels
+SIMPLIFY_PIXEL_TOLERANCE = 1.0
+
+
+def simplify_tolerance(zoom):
+    """Size in degrees of SIMPLIFY_PIXEL_TOLERANCE pixels on a 256px web map tile at `zoom`."""
+    return 360 / (256 * 2 ** zoom) * SIMPLIFY_PIXEL_TOLERANCE
+
+
+def _perpendicular_distance(point, start, end):
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return math.hypot(x - x1, y - y1)
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / math.hypot(dx, dy)
+
+
+def douglas_peucker(coords, tolerance):
+    """
+    Simplify a list of (lon, lat) coordinates with the Douglas-Peucker algorithm.
+    Iterative so long tracks don't hit the recursion limit.
+    """
+    if len(coords) < 3:
+        return list(coords)
+
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance = 0.0
+        index = None
+        for i in range(first + 1, last):
+            distance = _perpendicular_distance(coords[i], coords[first], coords[last])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [coord for coord, kept in zip(coords, keep) if kept]
+
+
+def artifact_values(gpx_file):
+    """
+    Parse a GPX file once and return the values stored on GpxArtifact.
+    Raises if the file cannot be read or parsed.
+    """
+    analysis = analyze_gpx_file(gpx_file)
+    return {
+        'geojson': analysis.to_geojson(),
+        'simplified': {
+            str(zoom): analysis.to_geojson(
+                simplify=lambda coords, zoom=zoom: douglas_peucker(coords, simplify_tolerance(zoom))
+            )
+            for zoom in SIMPLIFY_ZOOM_LEVELS
+        },
+        'bbox': analysis.bbox,
+        'length_2d': analysis.length_2d,
+        'length_3d': analysis.length_3d,
+        'point_count': analysis.point_count,
+        'track': encode_track(analysis),
+    }
+
+
+def _file_size(file_field):
+    try:
+        return file_field.size
+    except Exception:
+        return 0
+
+
+def build_gpx_artifact(file_field, force=False):
+    """
+    Return the GpxArtifact for a stored GPX file, computing it if the file is
+    new or changed, or always with `force`.
+    """
+    from adventures.models import GpxArtifact
+
+    size = _file_size(file_field)
+    artifact = GpxArtifact.objects.filter(file_name=file_field.name).first()
+    if artifact is not None and artifact.file_size == size and not force:
+        return artifact
+
+    try:
+        values = artifact_values(file_field)
+    except Exception as e:
+        logger.warning(f"Failed to analyze GPX file {file_field.name}: {e}")
+        values = {
+            'geojson': {"error": str(e), "message": "Failed to convert GPX to GeoJSON"},
+            'simplified': {},
+            'bbox': None,
+            'length_2d': 0,
+            'length_3d': 0,
+            'point_count': 0,
+            'track': None,
+        }
+
+    artifact, _ = GpxArtifact.objects.update_or_create(
+        file_name=file_field.name,
+        defaults={'file_size': size, **values},
+    )
+    return artifact
+
+
+def _is_gpx(file_field):
+    return bool(file_field) and file_field.name.lower().endswith('.gpx')
+
+
+def sync_gpx_artifact(instance, field_name):
+    """
+    Point `instance.gpx_artifact` at the artifact for its current file.
+    Called after save; the foreign key is written with an update so no save signals fire again.
+    """
+    file_field = getattr(instance, field_name)
+    artifact = None
+    if _is_gpx(file_field):
+        current = instance.gpx_artifact if instance.gpx_artifact_id else None
+        if current is not None and current.file_name == file_field.name:
+            return
+        artifact = build_gpx_artifact(file_field)
+    elif instance.gpx_artifact_id is None:
+        return
+
+    previous_id = instance.gpx_artifact_id
+    instance.gpx_artifact = artifact
+    type(instance).objects.filter(pk=instance.pk).update(gpx_artifact=artifact)
+    if previous_id is not None and previous_id != instance.gpx_artifact_id:
+        delete_unused_gpx_artifact(previous_id)
+
+
+def get_gpx_artifact(instance, field_name):
+    """The artifact of a GPX file, built on first use for files uploaded before artifacts existed."""
+    file_field = getattr(instance, field_name)
+    if not _is_gpx(file_field):
+        return None
+    if instance.gpx_artifact_id is None or instance.gpx_artifact.file_name != file_field.name:
+        sync_gpx_artifact(instance, field_name)
+    return instance.gpx_artifact
+
+
+def delete_unused_gpx_artifact(artifact_id):
+    """Remove an artifact once no attachment or activity refers to it anymore."""
+    from adventures.models import GpxArtifact
+
+    if artifact_id is None:
+        return
+    GpxArtifact.objects.filter(
+        pk=artifact_id, attachments__isnull=True, activities__isnull=True
+    ).delete()
+
+
+def get_gpx_track(instance, field_name):
+    """
+    The decoded Track of a GPX file, or None if it has no points. Artifacts
+    built before tracks were stored are recomputed once.
+    """
+    from adventures.models import GpxArtifact
+    from adventures.utils.track_storage import Track
+
+    artifact = get_gpx_artifact(instance, field_name)
+    if artifact is None:
+        return None
+
+    data = GpxArtifact.objects.filter(pk=artifact.pk).values_list('track', flat=True).first()
+    if data is None and artifact.point_count and 'error' not in artifact.geojson:
+        data = build_gpx_artifact(getattr(instance, field_name), force=True).track
+    return Track(data) if data is not None else None
@@ -0,0 +1,94 @@
+"""
+Viewport queries and server-side clustering for the map pins endpoint.
+
+Locations inside the requested bounding box (see adventures.utils.spatial) are grouped on a grid whose cell
+size follows the web map zoom level. The grouping runs in SQL (one GROUP BY
+on the grid cell and category), so the response size depends on the viewport
+and not on how many locations a user has.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Floor
+
+from adventures.utils.spatial import InvalidSpatialQuery
+
+# Above this zoom level individual pins are returned instead of clusters
+CLUSTER_MAX_ZOOM = 12
+
+# Viewports with at most this many locations are returned as pins at any zoom
+MAX_UNCLUSTERED_PINS = 300
+
+# Grid cell size in screen pixels (a web map tile is 256px wide)
+CLUSTER_CELL_PIXELS = 64
+
+
+def parse_zoom(value):
+    try:
+        zoom = int(value)
+    except (TypeError, ValueError):
+        raise InvalidSpatialQuery('zoom must be an integer')
+    if not 0 <= zoom <= 24:
+        raise InvalidSpatialQuery('zoom must be between 0 and 24')
+    return zoom
+
+
+def cell_size(zoom):
+    """Width in degrees of a CLUSTER_CELL_PIXELS wide cell at `zoom`."""
+    return 360 / (2 ** zoom) * CLUSTER_CELL_PIXELS / 256
+
+
+def cluster_locations(queryset, zoom):
+    """
+    Group the locations of `queryset` into grid cells. Returns a list of
+    clusters with their count, centroid, visited count and category mix.
+    """
+    from adventures.models import Category
+    from adventures.utils.get_is_visited import location_visited_exists
+
+    size = Value(Decimal(str(cell_size(zoom))), output_field=DecimalField())
+    rows = (
+        queryset.order_by()
+        .annotate(cell_x=Floor(F('longitude') / size), cell_y=Floor(F('latitude') / size))
+        .values('cell_x', 'cell_y', 'category_id')
+        .annotate(
+            count=Count('id'),
+            visited=Count('id', filter=location_visited_exists()),
+            sum_lon=Sum('longitude'),
+            sum_lat=Sum('latitude'),
+        )
+    )
+
+    cells = defaultdict(lambda: {'count': 0, 'visited': 0, 'sum_lon': 0.0, 'sum_lat': 0.0, 'categories': {}})
+    for row in rows:
+        cell = cells[(row['cell_x'], row['cell_y'])]
+        cell['count'] += row['count']
+        cell['visited'] += row['visited']
+        cell['sum_lon'] += float(row['sum_lon'])
+        cell['sum_lat'] += float(row['sum_lat'])
+        cell['categories'][row['category_id']] = row['count']
+
+    category_ids = {category_id for cell in cells.values() for category_id in cell['categories'] if category_id}
+    categories = {
+        category['id']: category
+        for category in Category.objects.filter(id__in=category_ids).values('id', 'name', 'display_name', 'icon')
+    }
+
+    clusters = []
+    for (cell_x, cell_y), cell in cells.items():
+        clusters.append({
+            'id': f'{zoom}:{int(cell_x)}:{int(cell_y)}',
+            'count': cell['count'],
+            'visited_count': cell['visited'],
+            'latitude': round(cell['sum_lat'] / cell['count'], 6),
+            'longitude': round(cell['sum_lon'] / cell['count'], 6),
+            'categories': sorted(
+                (
+                    {**categories.get(category_id, {'id': None, 'name': None, 'display_name': None, 'icon': None}), 'count': count}
+                    for category_id, count in cell['categories'].items()
+                ),
+                key=lambda category: -category['count'],
+            ),
+        })
+    return clusters
@@ -0,0 +1,92 @@
+"""
+Background removal of media files whose rows were deleted.
+
+Deleting rows only queues their files; a single worker thread removes them
+from storage once the transaction has committed, so a rolled back delete
+never loses files and requests don't wait on the disk.
+"""
+import logging
+import queue
+import threading
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+class FileRemovalWorker:
+    """One lazily started daemon thread deleting (storage, name) pairs."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._removed = 0
+        self._failed = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='media-cleanup', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, files):
+        files = list(files)
+        if not files:
+            return
+        self._ensure_started()
+        for storage, name in files:
+            self._queue.put((storage, name))
+        if len(files) > 1:
+            logger.info(f"Queued {len(files)} media files for removal")
+
+    def stats(self):
+        with self._lock:
+            return {'queued': self._queue.qsize(), 'removed': self._removed, 'failed': self._failed}
+
+    def wait_until_idle(self):
+        """Block until every queued file has been handled."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            storage, name = self._queue.get()
+            try:
+                storage.delete(name)
+                with self._lock:
+                    self._removed += 1
+            except Exception:
+                with self._lock:
+                    self._failed += 1
+                logger.exception(f"Could not remove media file {name}")
+            finally:
+                self._queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_file_removal_worker():
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                _worker = FileRemovalWorker()
+    return _worker
+
+
+def remove_files_on_commit(files, using=None):
+    """Queue `files` ((storage, name) pairs) for removal after the current transaction commits."""
+    files = [(storage, name) for storage, name in files if name]
+    if files:
+        transaction.on_commit(lambda: get_file_removal_worker().enqueue(files), using=using)
+
+
+def field_files(queryset, field_name):
+    """(storage, name) of the files `field_name` holds across `queryset`."""
+    storage = queryset.model._meta.get_field(field_name).storage
+    return [
+        (storage, name)
+        for name in queryset.exclude(**{f'{field_name}__isnull': True}).exclude(**{field_name: ''}).values_list(field_name, flat=True)
+    ]
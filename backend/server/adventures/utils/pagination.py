@@ -1,6 +1,206 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = 'page_size'
-    max_page_size = 1000
\ No newline at end of file
+    max_page_size = 1000
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder keeping microseconds, which it truncates to milliseconds."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            # Full precision, or a cursor would fall between rows of the same millisecond
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the queryset's ordering plus the primary key.
+
+    Each page filters on the (sort key, id) of the last row of the previous
+    page instead of using an OFFSET, so deep pages cost the same as the first
+    one. The ordering is taken from the queryset as the view already sorted
+    it; the id is appended as a tie-breaker so rows with equal sort keys are
+    neither skipped nor repeated. NULL sort keys follow PostgreSQL's default
+    (last ascending, first descending).
+
+    Query params:
+        cursor      opaque cursor from the `next` link of the previous page
+        page_size   rows per page (max 1000)
+        count       'exact' for a COUNT(*), 'estimate' for the planner's row
+                    estimate; no count is returned otherwise
+    """
+    cursor_query_param = 'cursor'
+    page_size = StandardResultsSetPagination.page_size
+    page_size_query_param = StandardResultsSetPagination.page_size_query_param
+    max_page_size = StandardResultsSetPagination.max_page_size
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request.query_params.get(self.count_query_param))
+
+        keys = self.get_keys(queryset)
+        ordering = [f'-{name}' if descending else name for name, descending, _ in keys]
+        queryset = queryset.order_by(*ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            values = self.decode_cursor(cursor, keys)
+            queryset = queryset.filter(self.after(keys, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.next_cursor = self.encode_cursor(keys, page[-1]) if self.has_next else None
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_keys(self, queryset):
+        """The (name, descending, field) sort keys of `queryset`, ending with the primary key."""
+        if queryset.query.is_sliced:
+            raise ValidationError({"error": "Cursor pagination can't be combined with nearest queries"})
+
+        model = queryset.model
+        pk_name = model._meta.pk.name
+        keys = []
+        for item in queryset.query.order_by or ():
+            if not isinstance(item, str) or '__' in item or item == '?':
+                raise ValidationError({"error": "Cursor pagination is not supported for this ordering"})
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            if name in ('pk', pk_name):
+                name = pk_name
+            if name in queryset.query.annotations:
+                field = queryset.query.annotations[name].output_field
+            else:
+                try:
+                    field = model._meta.get_field(name)
+                except FieldDoesNotExist:
+                    raise ValidationError({"error": "Cursor pagination is not supported for this ordering"})
+            keys.append((name, descending, field))
+
+        if not any(name == pk_name for name, _, _ in keys):
+            # Break ties in the direction of the primary sort key
+            keys.append((pk_name, keys[0][1] if keys else False, model._meta.pk))
+        return keys
+
+    def after(self, keys, values):
+        """Rows that sort after `values`: (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ..."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, descending, field), value in zip(keys, values):
+            condition |= equal & self._beyond(name, descending, field, value)
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        return condition
+
+    def _beyond(self, name, descending, field, value):
+        nullable = getattr(field, 'null', True)
+        if value is None:
+            # NULLs sort last ascending and first descending
+            return Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+        if descending:
+            return Q(**{f'{name}__lt': value})
+        condition = Q(**{f'{name}__gt': value})
+        if nullable:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def encode_cursor(self, keys, row):
+        values = [getattr(row, name) for name, _, _ in keys]
+        data = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor, keys):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(keys):
+                raise ValueError
+            return [
+                None if value is None else field.to_python(value)
+                for (_, _, field), value in zip(keys, values)
+            ]
+        except (binascii.Error, ValueError, TypeError, DjangoValidationError):
+            raise ValidationError({"error": "Invalid cursor"})
+
+    def get_count(self, queryset, mode):
+        if mode == 'exact':
+            return queryset.count()
+        if mode == 'estimate':
+            return self.estimate_count(queryset)
+        return None
+
+    def estimate_count(self, queryset):
+        """The planner's row estimate for `queryset`, without running it."""
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return queryset.count()
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = {
+            'next': self.get_next_link(),
+            'results': data,
+        }
+        if self.count is not None:
+            response['count'] = self.count
+        return Response(response)
+
+
+class LibraryPagination(StandardResultsSetPagination):
+    """
+    Page number pagination, or keyset pagination when the request asks for
+    it with `?pagination=cursor` or carries a `cursor` from a previous page.
+    """
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.keyset_class.cursor_query_param in request.query_params):
+            self.keyset = self.keyset_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
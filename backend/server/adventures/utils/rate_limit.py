@@ -0,0 +1,64 @@
+import threading
+import time
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most
+    `capacity` tokens so short bursts are allowed but the long-run rate is not.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Take one token, sleeping until one is available. Returns False if that
+        would take longer than `timeout` seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_provider_buckets = {}
+_provider_buckets_lock = threading.Lock()
+
+
+def acquire_provider_slot(provider):
+    """
+    Wait for permission to send one request to a geocoding provider, as
+    limited by settings.GEOCODE_PROVIDER_RATE_LIMITS (requests per second,
+    shared by every thread in the process). Returns False if no slot became
+    free within GEOCODE_RATE_LIMIT_WAIT seconds.
+    """
+    rate = settings.GEOCODE_PROVIDER_RATE_LIMITS.get(provider)
+    if not rate or rate <= 0:
+        return True
+
+    with _provider_buckets_lock:
+        bucket = _provider_buckets.get(provider)
+        if bucket is None:
+            bucket = _provider_buckets[provider] = TokenBucket(rate)
+
+    return bucket.acquire(timeout=settings.GEOCODE_RATE_LIMIT_WAIT)
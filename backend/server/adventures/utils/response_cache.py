@@ -0,0 +1,204 @@
+"""
+Per-user cache of read-heavy API responses.
+
+Responses are stored in the default cache (memcached) under a key built from
+the user, the endpoint, the normalized query params, the user's data
+generation and the current date (visited flags, trip statuses and stats
+depend on it). Any change to content a user can see moves their generation
+forward (see adventures.signals), so stale entries are never read again and
+simply expire; nothing has to be deleted.
+
+Generations are bumped after the transaction commits, so a response built
+while the change was still uncommitted can only be stored under the old
+generation.
+"""
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.http import HttpResponse
+from rest_framework.response import Response
+
+from adventures.utils.get_is_visited import visited_cutoff
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'response:'
+GENERATION_PREFIX = 'response:generation:'
+
+# Relations followed from a changed object to the objects it belongs to
+PARENT_FIELDS = ('location', 'visit', 'checklist', 'content_object')
+
+# Response headers kept with cached non-DRF responses
+CACHED_HEADERS = ('Content-Disposition',)
+
+
+def get_generation(user_id):
+    """The current data generation of `user_id`, starting one if there is none."""
+    key = f'{GENERATION_PREFIX}{user_id}'
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generations(user_ids):
+    """Invalidate every cached response of `user_ids`."""
+    generation = time.time_ns()
+    try:
+        cache.set_many({f'{GENERATION_PREFIX}{user_id}': generation for user_id in user_ids}, None)
+    except Exception:
+        logger.exception(f"Failed to invalidate cached responses of users {user_ids}")
+
+
+_pending = threading.local()
+
+
+def schedule_generation_bump(user_ids):
+    """Bump the generations of `user_ids` once the current transaction commits."""
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    pending = getattr(_pending, 'user_ids', None)
+    if pending is None:
+        pending = _pending.user_ids = set()
+    pending.update(user_ids)
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    pending = getattr(_pending, 'user_ids', None)
+    if not pending:
+        return
+    _pending.user_ids = None
+    bump_generations(pending)
+
+
+def collection_user_ids(collection_ids):
+    """Owners and collaborators of `collection_ids`."""
+    from adventures.models import Collection
+
+    user_ids = set()
+    if not collection_ids:
+        return user_ids
+    for owner_id, shared_id in Collection.objects.filter(id__in=collection_ids).values_list('user_id', 'shared_with'):
+        user_ids.update((owner_id, shared_id))
+    user_ids.discard(None)
+    return user_ids
+
+
+def affected_user_ids(instance):
+    """
+    Users whose responses may include `instance`: its owner, the owners of
+    what it belongs to, and everyone with access to the collections involved.
+    """
+    from adventures.models import Collection, Location
+    from users.models import CustomUser
+
+    user_ids = set()
+    collection_ids = set()
+    seen = set()
+    stack = [instance]
+    while stack:
+        obj = stack.pop()
+        if obj is None or (type(obj), obj.pk) in seen:
+            continue
+        seen.add((type(obj), obj.pk))
+
+        if isinstance(obj, CustomUser):
+            user_ids.add(obj.pk)
+            continue
+        if isinstance(obj, Collection):
+            collection_ids.add(obj.pk)
+        user_ids.add(getattr(obj, 'user_id', None))
+        collection_ids.add(getattr(obj, 'collection_id', None))
+        if isinstance(obj, Location) and obj.pk is not None:
+            collection_ids.update(obj.collections.values_list('id', flat=True))
+
+        for name in PARENT_FIELDS:
+            try:
+                parent = getattr(obj, name, None)
+            except Exception:
+                # The parent is already gone
+                continue
+            if isinstance(parent, models.Model):
+                stack.append(parent)
+
+    collection_ids.discard(None)
+    user_ids |= collection_user_ids(collection_ids)
+    user_ids.discard(None)
+    return user_ids
+
+
+def _normalized_params(request):
+    params = sorted((key, sorted(values)) for key, values in request.query_params.lists())
+    return hashlib.sha1(repr((request.get_host(), params)).encode('utf-8')).hexdigest()
+
+
+def response_cache_key(request, endpoint, generation, kwargs):
+    view_kwargs = sorted((key, str(value)) for key, value in kwargs.items())
+    digest = hashlib.sha1(repr((_normalized_params(request), view_kwargs)).encode('utf-8')).hexdigest()
+    # Entries from a previous day would keep visits that have started since as upcoming
+    day = visited_cutoff().date().isoformat()
+    return f'{CACHE_PREFIX}{request.user.id}:{endpoint}:{generation}:{day}:{digest}'
+
+
+def _freeze(response):
+    if isinstance(response, Response):
+        return ('drf', response.data)
+    headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+    return ('http', response.content, response['Content-Type'], headers)
+
+
+def _thaw(entry):
+    if entry[0] == 'drf':
+        return Response(entry[1])
+    _, content, content_type, headers = entry
+    response = HttpResponse(content, content_type=content_type)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def cache_response(endpoint, owner=None):
+    """
+    Cache the successful responses of a view method per user.
+
+    `owner(request, **kwargs)` returns the id of the user whose data the
+    response shows when that isn't the requesting user (a profile's stats);
+    the cache entry then follows that user's generation.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED or not request.user.is_authenticated:
+                return view_method(self, request, *args, **kwargs)
+
+            try:
+                owner_id = owner(request, **kwargs) if owner else request.user.id
+                if owner_id is None:
+                    return view_method(self, request, *args, **kwargs)
+                key = response_cache_key(request, endpoint, get_generation(owner_id), kwargs)
+                entry = cache.get(key)
+            except Exception:
+                logger.exception(f"Response cache unavailable for {endpoint}")
+                return view_method(self, request, *args, **kwargs)
+            if entry is not None:
+                return _thaw(entry)
+
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                try:
+                    cache.set(key, _freeze(response), settings.RESPONSE_CACHE_TTL)
+                except Exception:
+                    # Too large for memcached or the cache is down; serve uncached
+                    logger.debug(f"Could not cache response of {endpoint}", exc_info=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,63 @@
+"""
+Search helpers backing GlobalSearchView.
+
+Locations, collections and notes carry a stored, GIN-indexed `search_vector`
+(a GeneratedField the database keeps current on every write). Names of
+users, regions and cities are matched with icontains, which PostgreSQL serves
+from the pg_trgm GIN indexes on UPPER(name) (Django's icontains compares
+UPPER(column) LIKE UPPER(pattern)).
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+# Text search configuration of the stored vectors. 'simple' doesn't stem, so
+# names in any language match the way they are typed.
+SEARCH_CONFIG = 'simple'
+
+# Results returned per section by default, and the most a request may ask for
+DEFAULT_RESULTS_PER_SECTION = 10
+MAX_RESULTS_PER_SECTION = 50
+
+WORD_RE = re.compile(r'\w+')
+
+
+def weighted_search_vector(*fields):
+    """tsvector expression over `fields`, given as (field name, weight 'A'-'D') pairs."""
+    vector = None
+    for name, weight in fields:
+        part = SearchVector(name, config=SEARCH_CONFIG, weight=weight)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def prefix_query(term):
+    """
+    A tsquery matching documents containing every word of `term`, the last
+    ones as prefixes (search-as-you-type). None when `term` has no words.
+    """
+    words = WORD_RE.findall(term.lower())
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+def ranked_text_search(queryset, query, limit):
+    """Rows of `queryset` whose search_vector matches `query`, best ranked first, then by name."""
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(rank=SearchRank(F('search_vector'), query))
+        .order_by('-rank', 'name', 'pk')[:limit]
+    )
+
+
+def ranked_name_search(queryset, term, limit, fields=('name',)):
+    """Rows of `queryset` with `term` in one of `fields`, most similar first, then by the first field."""
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__icontains': term})
+    similarities = [TrigramSimilarity(field, term) for field in fields]
+    similarity = similarities[0] if len(similarities) == 1 else Greatest(*similarities)
+    return queryset.filter(condition).annotate(similarity=similarity).order_by('-similarity', fields[0], 'pk')[:limit]
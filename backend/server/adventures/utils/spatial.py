@@ -0,0 +1,142 @@
+"""
+Spatial filters over the generated PostGIS point columns (Location.point,
+Lodging.point, Transportation.origin_point/destination_point).
+
+Every filter is written so the GiST index on the column can be used: bbox
+queries use ST_Intersects, radius queries pre-filter with an index-backed
+ST_DWithin in degrees before the exact spherical distance check, and nearest
+queries order by the <-> kNN operator.
+"""
+import math
+
+from django.contrib.gis.db.models.functions import GeometryDistance
+from django.contrib.gis.geos import Point, Polygon
+from django.contrib.gis.measure import D
+from django.db.models import Q
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 111320
+
+# Largest radius accepted by radius queries, in km
+MAX_RADIUS_KM = 20000
+
+# Most results returned by nearest queries
+MAX_NEAREST = 500
+
+
+class InvalidSpatialQuery(ValueError):
+    pass
+
+
+def parse_point(value):
+    """Parse 'lat,lon' into a SRID 4326 Point."""
+    try:
+        lat, lon = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise InvalidSpatialQuery("near must be 'lat,lon'")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise InvalidSpatialQuery('near is out of range')
+    return Point(lon, lat, srid=4326)
+
+
+def parse_bbox(value):
+    """
+    Parse 'min_lon,min_lat,max_lon,max_lat'. min_lon may be greater than
+    max_lon for a viewport crossing the antimeridian.
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise InvalidSpatialQuery("bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise InvalidSpatialQuery('bbox is out of range')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _parse_number(value, name, minimum, maximum, cast=float):
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        raise InvalidSpatialQuery(f'{name} must be a number')
+    if not minimum <= number <= maximum:
+        raise InvalidSpatialQuery(f'{name} must be between {minimum} and {maximum}')
+    return number
+
+
+def bbox_polygons(bbox):
+    """Polygons covering `bbox`, split in two when it crosses the antimeridian."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        boxes = [(min_lon, min_lat, max_lon, max_lat)]
+    else:
+        boxes = [(min_lon, min_lat, 180, max_lat), (-180, min_lat, max_lon, max_lat)]
+    polygons = []
+    for box in boxes:
+        polygon = Polygon.from_bbox(box)
+        polygon.srid = 4326
+        polygons.append(polygon)
+    return polygons
+
+
+def filter_bbox(queryset, bbox, field='point'):
+    """Rows whose point lies inside `bbox`."""
+    condition = Q()
+    for polygon in bbox_polygons(bbox):
+        condition |= Q(**{f'{field}__intersects': polygon})
+    return queryset.filter(condition)
+
+
+def _degrees_for_radius(point, meters):
+    """A distance in degrees that covers `meters` around `point` in every direction."""
+    lat_degrees = meters / METERS_PER_DEGREE
+    max_lat = min(abs(point.y) + lat_degrees, 89.999)
+    lon_degrees = lat_degrees / max(math.cos(math.radians(max_lat)), 1e-6)
+    return min(math.hypot(lat_degrees, lon_degrees), 360)
+
+
+def filter_radius(queryset, point, meters, field='point'):
+    """Rows whose point is within `meters` of `point`."""
+    return queryset.filter(**{
+        # Index-backed pre-filter on a degree box, then the exact spherical distance
+        f'{field}__dwithin': (point, _degrees_for_radius(point, meters)),
+        f'{field}__distance_lte': (point, D(m=meters)),
+    })
+
+
+def nearest(queryset, point, k, field='point'):
+    """The `k` rows closest to `point`, nearest first (kNN through the GiST index)."""
+    return queryset.filter(**{f'{field}__isnull': False}).order_by(GeometryDistance(field, point))[:k]
+
+
+def apply_spatial_query(queryset, params, field='point'):
+    """
+    Apply the spatial query params of a list request:
+
+        bbox=min_lon,min_lat,max_lon,max_lat    rows inside the box
+        near=lat,lon&radius=<km>                rows within the radius
+        near=lat,lon&nearest=<k>                the k nearest rows, nearest first
+
+    Raises InvalidSpatialQuery for malformed params. Nearest slices the
+    queryset, so it must be the last step.
+    """
+    bbox = params.get('bbox')
+    near = params.get('near')
+    radius = params.get('radius')
+    k = params.get('nearest')
+
+    if bbox is not None:
+        queryset = filter_bbox(queryset, parse_bbox(bbox), field)
+
+    if near is None:
+        if radius is not None or k is not None:
+            raise InvalidSpatialQuery('radius and nearest require near=lat,lon')
+        return queryset
+
+    point = parse_point(near)
+    if radius is None and k is None:
+        raise InvalidSpatialQuery('near requires radius or nearest')
+    if radius is not None:
+        queryset = filter_radius(queryset, point, _parse_number(radius, 'radius', 0, MAX_RADIUS_KM) * 1000, field)
+    if k is not None:
+        queryset = nearest(queryset, point, _parse_number(k, 'nearest', 1, MAX_NEAREST, int), field)
+    return queryset
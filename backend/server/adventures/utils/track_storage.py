@@ -0,0 +1,209 @@
+"""
+Compact columnar storage for GPX tracks, and downsampled profiles built from it.
+
+A track is stored as a small header followed by little-endian int32 columns:
+
+    header        '<4sHHIIq': magic b'ALTK', version, flags, point count,
+                  segment count, start time (epoch seconds)
+    segments      int32[segment count]   index of each segment's first point
+    lat, lon      int32[point count]     degrees * 1e7, delta encoded
+    ele           int32[point count]     decimeters, delta encoded
+    time          int32[point count]     seconds after the start time, delta encoded
+
+The first value of each column is absolute and the rest are differences to the
+previous point, so decoding is np.frombuffer (zero-copy) plus a cumulative sum.
+Longitude differences are wrapped to [-180, 180) degrees so steps across the
+antimeridian (or between distant segments) fit in int32, and decoded
+longitudes are wrapped back into the same range.
+Missing elevations and times are carried forward from the previous point; the
+flags tell whether the track has elevations or times at all.
+"""
+import struct
+
+import numpy as np
+
+from adventures.utils.gpx_analysis import haversine, smooth
+
+MAGIC = b'ALTK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIq')
+
+HAS_ELEVATION = 1
+HAS_TIME = 2
+
+COORDINATE_SCALE = 1e7
+# Half a turn of longitude in stored units
+HALF_TURN = 180 * 10 ** 7
+ELEVATION_SCALE = 10
+
+# Centered moving average window applied to point-to-point speeds (points)
+SPEED_SMOOTHING_WINDOW = 5
+
+
+def _fill_forward(values):
+    """Replace NaNs with the previous valid value (the first valid one at the start)."""
+    missing = np.isnan(values)
+    if not missing.any():
+        return values
+    valid = np.flatnonzero(~missing)
+    if not len(valid):
+        return np.zeros_like(values)
+    index = np.where(missing, 0, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    index[:valid[0]] = valid[0]
+    return values[index]
+
+
+def _wrap_longitude(values):
+    """Wrap stored longitudes (or their differences) to [-HALF_TURN, HALF_TURN)."""
+    return (values + HALF_TURN) % (2 * HALF_TURN) - HALF_TURN
+
+
+def _delta(values, wrap=False):
+    values = values.astype(np.int64)
+    deltas = np.diff(values, prepend=0)
+    if wrap:
+        deltas = _wrap_longitude(deltas)
+    return deltas.astype('<i4')
+
+
+def encode_track(analysis):
+    """
+    Encode the track segments of a GpxAnalysis (its routes if it has no
+    tracks) to bytes. Returns None when there are no points.
+    """
+    segments = [s for s in analysis.segments if s.kind == 'track' and len(s)]
+    if not segments:
+        segments = [s for s in analysis.segments if len(s)]
+    if not segments:
+        return None
+
+    lat = np.concatenate([s.lat for s in segments])
+    lon = np.concatenate([s.lon for s in segments])
+    ele = np.concatenate([s.ele for s in segments])
+    times = np.concatenate([s.time for s in segments])
+    starts = np.cumsum([0] + [len(s) for s in segments[:-1]]).astype('<i4')
+
+    flags = 0
+    if not np.isnan(ele).all():
+        flags |= HAS_ELEVATION
+    start_time = 0
+    if not np.isnan(times).all():
+        flags |= HAS_TIME
+        start_time = int(np.nanmin(times))
+
+    columns = [
+        _delta(np.round(lat * COORDINATE_SCALE)),
+        _delta(np.round(lon * COORDINATE_SCALE), wrap=True),
+        _delta(np.round(_fill_forward(ele) * ELEVATION_SCALE)),
+        _delta(np.round(_fill_forward(times) - start_time) if flags & HAS_TIME else np.zeros(len(lat))),
+    ]
+    header = HEADER.pack(MAGIC, VERSION, flags, len(lat), len(starts), start_time)
+    return b''.join([header, starts.tobytes()] + [column.tobytes() for column in columns])
+
+
+class Track:
+    """Decoded columns of a stored track. Missing columns are None."""
+
+    def __init__(self, data):
+        data = memoryview(data)
+        magic, version, flags, count, segment_count, start_time = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a stored track')
+
+        offset = HEADER.size
+        self.segment_starts = np.frombuffer(data, dtype='<i4', count=segment_count, offset=offset)
+        offset += 4 * segment_count
+
+        def column(index):
+            return np.cumsum(
+                np.frombuffer(data, dtype='<i4', count=count, offset=offset + 4 * count * index),
+                dtype=np.int64,
+            )
+
+        self.lat = column(0) / COORDINATE_SCALE
+        self.lon = _wrap_longitude(column(1)) / COORDINATE_SCALE
+        self.elevation = column(2) / ELEVATION_SCALE if flags & HAS_ELEVATION else None
+        self.time = column(3) + start_time if flags & HAS_TIME else None
+
+    def __len__(self):
+        return len(self.lat)
+
+    def distances(self):
+        """Cumulative distance in meters at each point; segment gaps add no distance."""
+        steps = np.zeros(len(self))
+        if len(self) > 1:
+            steps[1:] = haversine(self.lat, self.lon)
+            steps[self.segment_starts[1:]] = 0
+        return np.cumsum(steps)
+
+    def speeds(self, distances):
+        """Smoothed speed in m/s at each point, or None without times."""
+        if self.time is None or len(self) < 2:
+            return None
+        steps = np.diff(distances, prepend=distances[0])
+        durations = np.diff(self.time, prepend=self.time[0]).astype(np.float64)
+        speed = np.divide(steps, durations, out=np.zeros(len(self)), where=durations > 0)
+        speed[self.segment_starts] = 0
+        return smooth(speed, SPEED_SMOOTHING_WINDOW)
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the
+    `threshold` points of (x, y) that best keep the shape of the curve.
+    """
+    length = len(x)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold < 3:
+        return np.array([0, length - 1][:max(threshold, 0)], dtype=np.int64)
+
+    edges = np.linspace(1, length - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = length - 1
+    previous = 0
+
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = end, edges[bucket + 2] if bucket + 2 < len(edges) else length
+        # Average of the next bucket (the last point for the final bucket)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - avg_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+
+    return selected
+
+
+def track_profile(track, points, metric='elevation'):
+    """
+    Distance, elevation, speed and time of `track` downsampled to `points`
+    points, selected with LTTB on `metric` ('elevation' or 'speed') over distance.
+    """
+    distances = track.distances()
+    speeds = track.speeds(distances)
+    series = {'elevation': track.elevation, 'speed': speeds}
+    driver = series.get(metric)
+    if driver is None:
+        driver = next((values for values in series.values() if values is not None), distances)
+
+    index = lttb(distances, driver, points)
+
+    def pick(values, decimals):
+        return None if values is None else np.round(values[index], decimals).tolist()
+
+    return {
+        'points': len(index),
+        'total_points': len(track),
+        'distance': pick(distances, 1),
+        'elevation': pick(track.elevation, 1),
+        'speed': pick(speeds, 2),
+        'time': None if track.time is None else track.time[index].tolist(),
+    }
@@ -0,0 +1,338 @@
+"""
+Materialized per-user statistics (UserStats).
+
+Each row is split into sections that are recomputed independently with
+GROUP BY queries: saving or deleting a Location/Visit, Collection,
+VisitedRegion/VisitedCity or Activity only refreshes the matching section
+for the owning user, once per transaction. `rebuild_user_stats()` runs the
+same queries over every user to repair the table.
+"""
+import logging
+import threading
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+
+from adventures.utils.get_is_visited import location_visited_exists, visited_cutoff
+from adventures.utils.sports_types import SPORT_CATEGORIES
+from worldtravel.utils import get_world_data_version
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+SECTIONS = ('locations', 'trips', 'visited', 'activities')
+
+SECTION_FIELDS = {
+    'locations': ['location_count', 'visited_location_count', 'visited_recheck_at'],
+    'trips': ['trips_count'],
+    'visited': ['visited_city_count', 'visited_region_count', 'visited_country_count'],
+    'activities': ['activity_totals'],
+}
+
+# Number of rows written per upsert statement during a rebuild
+REBUILD_BATCH_SIZE = 1000
+
+
+def _by_user(queryset, user_ids):
+    return queryset if user_ids is None else queryset.filter(user_id__in=user_ids)
+
+
+def _location_section(user_ids):
+    from adventures.models import Location, Visit
+
+    cutoff = visited_cutoff()
+    values = defaultdict(lambda: {'location_count': 0, 'visited_location_count': 0, 'visited_recheck_at': None})
+
+    rows = _by_user(Location.objects.all(), user_ids).values('user_id').annotate(
+        location_count=Count('id'),
+        visited_location_count=Count('id', filter=location_visited_exists()),
+    ).order_by()
+    for row in rows:
+        values[row['user_id']].update(
+            location_count=row['location_count'],
+            visited_location_count=row['visited_location_count'],
+        )
+
+    upcoming = Visit.objects.filter(start_date__gte=cutoff)
+    if user_ids is not None:
+        upcoming = upcoming.filter(location__user_id__in=user_ids)
+    for row in upcoming.values('location__user_id').annotate(next_start=Min('start_date')).order_by():
+        values[row['location__user_id']]['visited_recheck_at'] = row['next_start']
+
+    return values
+
+
+def _trips_section(user_ids):
+    from adventures.models import Collection
+
+    rows = _by_user(Collection.objects.all(), user_ids).values('user_id').annotate(trips_count=Count('id')).order_by()
+    return {row['user_id']: {'trips_count': row['trips_count']} for row in rows}
+
+
+def _visited_section(user_ids):
+    from worldtravel.models import VisitedCity, VisitedRegion
+
+    values = defaultdict(lambda: {'visited_city_count': 0, 'visited_region_count': 0, 'visited_country_count': 0})
+
+    rows = _by_user(VisitedRegion.objects.all(), user_ids).values('user_id').annotate(
+        visited_region_count=Count('id'),
+        visited_country_count=Count('region__country', distinct=True),
+    ).order_by()
+    for row in rows:
+        values[row['user_id']].update(
+            visited_region_count=row['visited_region_count'],
+            visited_country_count=row['visited_country_count'],
+        )
+
+    rows = _by_user(VisitedCity.objects.all(), user_ids).values('user_id').annotate(
+        visited_city_count=Count('id'),
+    ).order_by()
+    for row in rows:
+        values[row['user_id']]['visited_city_count'] = row['visited_city_count']
+
+    return values
+
+
+def _activity_section(user_ids):
+    """
+    Sums, non-null counts and maxima per sport type, enough to derive every
+    total, average and maximum the stats endpoint reports.
+    """
+    from adventures.models import Activity
+
+    rows = _by_user(Activity.objects.all(), user_ids).values('user_id', 'sport_type').annotate(
+        count=Count('id'),
+        distance=Sum('distance'),
+        distance_n=Count('distance'),
+        max_distance=Max('distance'),
+        moving_time=Sum('moving_time'),
+        elevation_gain=Sum('elevation_gain'),
+        elevation_gain_n=Count('elevation_gain'),
+        max_elevation_gain=Max('elevation_gain'),
+        elevation_loss=Sum('elevation_loss'),
+        speed=Sum('average_speed'),
+        speed_n=Count('average_speed'),
+        max_speed=Max('max_speed'),
+        calories=Sum('calories'),
+    ).order_by()
+
+    values = defaultdict(lambda: {'activity_totals': {}})
+    for row in rows:
+        user_id = row.pop('user_id')
+        sport = row.pop('sport_type')
+        row['moving_time'] = row['moving_time'].total_seconds() if row['moving_time'] else 0
+        values[user_id]['activity_totals'][sport] = row
+    return values
+
+
+SECTION_BUILDERS = {
+    'locations': _location_section,
+    'trips': _trips_section,
+    'visited': _visited_section,
+    'activities': _activity_section,
+}
+
+
+def _compute(user_ids, sections, scan_all=False):
+    """
+    Return {user_id: UserStats} with the given sections filled in for each user.
+    With scan_all the section queries run without a user filter, in one pass per table.
+    """
+    from adventures.models import UserStats
+
+    stats = {user_id: UserStats(user_id=user_id) for user_id in user_ids}
+    for section in sections:
+        for user_id, fields in SECTION_BUILDERS[section](None if scan_all else user_ids).items():
+            if user_id in stats:
+                for name, value in fields.items():
+                    setattr(stats[user_id], name, value)
+    return stats
+
+
+def _upsert(stats, sections):
+    from adventures.models import UserStats
+
+    update_fields = [field for section in sections for field in SECTION_FIELDS[section]] + ['updated_at']
+    UserStats.objects.bulk_create(
+        stats,
+        batch_size=REBUILD_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=update_fields,
+    )
+
+
+def refresh_user_stats(user_ids, sections=SECTIONS):
+    """Recompute the given sections for a few users. Users without a stats row get every section."""
+    from adventures.models import UserStats
+
+    user_ids = set(User.objects.filter(id__in=set(user_ids)).values_list('id', flat=True))
+    if not user_ids:
+        return
+
+    existing = set(UserStats.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    missing = user_ids - existing
+
+    if existing:
+        _upsert(_compute(list(existing), sections).values(), sections)
+    if missing:
+        _upsert(_compute(list(missing), SECTIONS).values(), SECTIONS)
+
+
+def rebuild_user_stats(sections=SECTIONS):
+    """Recompute the given sections for every user with one GROUP BY query per table."""
+    from adventures.models import UserStats
+
+    if set(sections) == set(SECTIONS):
+        user_ids = list(User.objects.values_list('id', flat=True))
+    else:
+        # A partial rebuild must not create rows whose other sections are empty
+        user_ids = list(UserStats.objects.values_list('user_id', flat=True))
+
+    stats = _compute(user_ids, sections, scan_all=True)
+    with transaction.atomic():
+        _upsert(stats.values(), sections)
+    return len(stats)
+
+
+def get_user_stats(user):
+    """Return the UserStats row for a user, building it on first use."""
+    from adventures.models import UserStats
+
+    stats = UserStats.objects.filter(user=user).first()
+    if stats is None:
+        refresh_user_stats([user.id])
+        return UserStats.objects.get(user=user)
+
+    # A planned visit has started since the row was computed
+    if stats.visited_recheck_at and stats.visited_recheck_at < visited_cutoff():
+        refresh_user_stats([user.id], sections=('locations',))
+        stats.refresh_from_db()
+    return stats
+
+
+_pending = threading.local()
+
+
+def schedule_user_stats_refresh(user_id, section):
+    """
+    Queue a section refresh for after the current transaction commits.
+    Repeated changes to the same user and section in one transaction cost one refresh.
+    """
+    if user_id is None:
+        return
+    pending = getattr(_pending, 'items', None)
+    if pending is None:
+        pending = _pending.items = defaultdict(set)
+    pending[user_id].add(section)
+    # Every call registers the flush so that items left by a rolled back
+    # transaction are picked up by the next commit; extra flushes find nothing to do.
+    transaction.on_commit(_flush_pending)
+
+
+def _flush_pending():
+    pending = getattr(_pending, 'items', None)
+    if not pending:
+        return
+    _pending.items = None
+
+    by_sections = defaultdict(list)
+    for user_id, sections in pending.items():
+        by_sections[tuple(s for s in SECTIONS if s in sections)].append(user_id)
+    for sections, user_ids in by_sections.items():
+        try:
+            refresh_user_stats(user_ids, sections)
+        except Exception:
+            # The change itself is committed; a stale row is fixed by the next
+            # refresh or by `manage.py rebuild_user_stats`.
+            logger.exception(f"Failed to refresh user stats for users {user_ids}")
+
+
+def get_world_totals():
+    """Number of cities, regions and countries, cached until the world data is re-imported."""
+    from worldtravel.models import City, Country, Region
+
+    key = f'worldtravel:totals:{get_world_data_version()}'
+    totals = cache.get(key)
+    if totals is None:
+        totals = {
+            'total_cities': City.objects.count(),
+            'total_regions': Region.objects.count(),
+            'total_countries': Country.objects.count(),
+        }
+        cache.set(key, totals, None)
+    return totals
+
+
+def _merge_sport_totals(sport_totals):
+    """Combine per-sport aggregates into one set of totals."""
+    merged = {
+        'count': 0, 'distance': 0, 'distance_n': 0, 'max_distance': None, 'moving_time': 0,
+        'elevation_gain': 0, 'elevation_gain_n': 0, 'max_elevation_gain': None, 'elevation_loss': 0,
+        'speed': 0, 'speed_n': 0, 'max_speed': None, 'calories': 0,
+    }
+    for totals in sport_totals:
+        for key in ('count', 'distance_n', 'elevation_gain_n', 'speed_n', 'moving_time'):
+            merged[key] += totals[key]
+        for key in ('distance', 'elevation_gain', 'elevation_loss', 'speed', 'calories'):
+            merged[key] += totals[key] or 0
+        for key in ('max_distance', 'max_elevation_gain', 'max_speed'):
+            if totals[key] is not None and (merged[key] is None or totals[key] > merged[key]):
+                merged[key] = totals[key]
+    return merged
+
+
+def _average(total, n):
+    return total / n if n else 0
+
+
+def get_overall_activity_stats(activity_totals):
+    """Overall activity statistics in the shape returned by the stats endpoint."""
+    merged = _merge_sport_totals(activity_totals.values())
+    return {
+        'total_count': merged['count'],
+        'total_distance': round(merged['distance'], 2),
+        'total_moving_time': int(merged['moving_time']),
+        'total_elevation_gain': round(merged['elevation_gain'], 2),
+        'total_elevation_loss': round(merged['elevation_loss'], 2),
+        'total_calories': round(merged['calories'], 2),
+    }
+
+
+def get_activity_stats_by_category(activity_totals):
+    """Per sport category statistics in the shape returned by the stats endpoint."""
+    category_stats = {}
+
+    for category, sports in SPORT_CATEGORIES.items():
+        present = [sport for sport in sports if sport in activity_totals]
+        if not present:
+            continue
+
+        merged = _merge_sport_totals(activity_totals[sport] for sport in present)
+        category_stats[category] = {
+            'count': merged['count'],
+            'total_distance': round(merged['distance'], 2),
+            'total_moving_time': int(merged['moving_time']),
+            'total_elevation_gain': round(merged['elevation_gain'], 2),
+            'total_elevation_loss': round(merged['elevation_loss'], 2),
+            'avg_distance': round(_average(merged['distance'], merged['distance_n']), 2),
+            'max_distance': round(merged['max_distance'] or 0, 2),
+            'avg_elevation_gain': round(_average(merged['elevation_gain'], merged['elevation_gain_n']), 2),
+            'max_elevation_gain': round(merged['max_elevation_gain'] or 0, 2),
+            'avg_speed': round(_average(merged['speed'], merged['speed_n']), 2),
+            'max_speed': round(merged['max_speed'] or 0, 2),
+            'total_calories': round(merged['calories'], 2),
+            'sports': {
+                sport: {
+                    'count': activity_totals[sport]['count'],
+                    'total_distance': round(activity_totals[sport]['distance'] or 0, 2),
+                    'total_elevation_gain': round(activity_totals[sport]['elevation_gain'] or 0, 2),
+                }
+                for sport in present
+            },
+        }
+
+    return category_stats
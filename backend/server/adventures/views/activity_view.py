@@ -1,11 +1,22 @@
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from django.db.models import Q
 from adventures.models import Location, Activity
 from adventures.serializers import ActivitySerializer
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
 from rest_framework.exceptions import PermissionDenied
-import gpxpy
-from typing import Tuple
+from adventures.utils.gpx_analysis import analyze_gpx
+from adventures.utils.gpx_artifacts import get_gpx_track
+from adventures.utils.track_storage import track_profile
+from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Number of points returned by the profile endpoint, by default and at most
+DEFAULT_PROFILE_POINTS = 300
+MAX_PROFILE_POINTS = 5000
 
 class ActivityViewSet(viewsets.ModelViewSet):
     serializer_class = ActivitySerializer
@@ -34,7 +45,9 @@ class ActivityViewSet(viewsets.ModelViewSet):
         # Location is in collections (many-to-many) that user owns
         location_filter |= Q(visit__location__collections__user=user)
         
-        return Activity.objects.filter(location_filter).distinct()
+        return Activity.objects.filter(location_filter).distinct().select_related('gpx_artifact').defer(
+            'gpx_artifact__simplified', 'gpx_artifact__track'
+        )
 
     def perform_create(self, serializer):
         """
@@ -46,14 +59,10 @@ class ActivityViewSet(viewsets.ModelViewSet):
         if location and not IsOwnerOrSharedWithFullAccess().has_object_permission(self.request, self, location):
             raise PermissionDenied("You do not have permission to add an activity to this location.")
 
-        # if there is a GPX file, use it to get elevation data
+        # if there is a GPX file, use it to get elevation data and fill in what the client left out
         gpx_file = serializer.validated_data.get('gpx_file')
         if gpx_file:
-            elevation_gain, elevation_loss, elevation_high, elevation_low = self._get_elevation_data_from_gpx(gpx_file)
-            serializer.validated_data['elevation_gain'] = elevation_gain
-            serializer.validated_data['elevation_loss'] = elevation_loss
-            serializer.validated_data['elev_high'] = elevation_high
-            serializer.validated_data['elev_low'] = elevation_low
+            self._apply_gpx_analysis(gpx_file, serializer.validated_data)
 
         serializer.save(user=location.user)
 
@@ -79,72 +88,66 @@ class ActivityViewSet(viewsets.ModelViewSet):
 
         instance.delete()
 
-    def _get_elevation_data_from_gpx(self, gpx_file) -> Tuple[float, float, float, float]:
+    @action(detail=True, methods=['get'])
+    def profile(self, request, pk=None):
         """
-        Extract elevation data from a GPX file.
-        Returns: (elevation_gain, elevation_loss, elevation_high, elevation_low)
+        Elevation/speed profile of the activity's GPX track, downsampled server-side
+        with LTTB so charts don't need the GPX file.
+
+        Query params:
+            points: number of points to return (default 300, at most 5000)
+            metric: series that drives the downsampling, 'elevation' (default) or 'speed'
         """
+        activity = self.get_object()
+
         try:
-            # Parse the GPX file
-            gpx_file.seek(0)  # Reset file pointer if needed
-            gpx = gpxpy.parse(gpx_file)
-            
-            elevations = []
-            
-            # Extract all elevation points from tracks and track segments
-            for track in gpx.tracks:
-                for segment in track.segments:
-                    for point in segment.points:
-                        if point.elevation is not None:
-                            elevations.append(point.elevation)
-            
-            # Also check waypoints for elevation data
-            for waypoint in gpx.waypoints:
-                if waypoint.elevation is not None:
-                    elevations.append(waypoint.elevation)
-            
-            # If no elevation data found, return zeros
-            if not elevations:
-                return 0.0, 0.0, 0.0, 0.0
-            
-            # Calculate basic stats
-            elevation_high = max(elevations)
-            elevation_low = min(elevations)
-            
-            # Calculate gain and loss by comparing consecutive points
-            elevation_gain = 0.0
-            elevation_loss = 0.0
-            
-            # Apply simple smoothing to reduce GPS noise (optional)
-            smoothed_elevations = self._smooth_elevations(elevations)
-            
-            for i in range(1, len(smoothed_elevations)):
-                diff = smoothed_elevations[i] - smoothed_elevations[i-1]
-                if diff > 0:
-                    elevation_gain += diff
-                else:
-                    elevation_loss += abs(diff)
-            
-            return elevation_gain, elevation_loss, elevation_high, elevation_low
-            
-        except Exception as e:
-            # Log the error and return zeros
-            print(f"Error parsing GPX file: {e}")
-            return 0.0, 0.0, 0.0, 0.0
+            points = int(request.query_params.get('points', DEFAULT_PROFILE_POINTS))
+        except ValueError:
+            return Response({"error": "points must be an integer"}, status=400)
+        points = max(2, min(points, MAX_PROFILE_POINTS))
+
+        metric = request.query_params.get('metric', 'elevation')
+        if metric not in ('elevation', 'speed'):
+            return Response({"error": "metric must be 'elevation' or 'speed'"}, status=400)
+
+        track = get_gpx_track(activity, 'gpx_file')
+        if track is None:
+            return Response({"error": "This activity has no GPX track"}, status=404)
+
+        return Response(track_profile(track, points, metric))
 
-    def _smooth_elevations(self, elevations, window_size=3):
+    def _apply_gpx_analysis(self, gpx_file, data):
         """
-        Apply simple moving average smoothing to reduce GPS elevation noise.
+        Set the elevation data from an uploaded GPX file, and the distance, times,
+        speeds and start/end points unless they were provided.
         """
-        if len(elevations) < window_size:
-            return elevations
-        
-        smoothed = []
-        half_window = window_size // 2
-        
-        for i in range(len(elevations)):
-            start = max(0, i - half_window)
-            end = min(len(elevations), i + half_window + 1)
-            smoothed.append(sum(elevations[start:end]) / (end - start))
-        
-        return smoothed
\ No newline at end of file
+        try:
+            gpx_file.seek(0)  # Reset file pointer if needed
+            analysis = analyze_gpx(gpx_file)
+        except Exception as e:
+            logger.warning(f"Error parsing GPX file: {e}")
+            data.update(elevation_gain=0.0, elevation_loss=0.0, elev_high=0.0, elev_low=0.0)
+            return
+        finally:
+            gpx_file.seek(0)
+
+        data['elevation_gain'] = analysis.elevation_gain
+        data['elevation_loss'] = analysis.elevation_loss
+        data['elev_high'] = analysis.elevation_high or 0.0
+        data['elev_low'] = analysis.elevation_low or 0.0
+
+        derived = {
+            'distance': analysis.length_2d or None,
+            'moving_time': timedelta(seconds=analysis.moving_time) if analysis.moving_time else None,
+            'elapsed_time': timedelta(seconds=analysis.elapsed_time) if analysis.elapsed_time else None,
+            'average_speed': analysis.average_speed or None,
+            'max_speed': analysis.max_speed or None,
+            'start_date': analysis.start_time,
+        }
+        if analysis.start_point:
+            derived['start_lat'], derived['start_lng'] = analysis.start_point
+            derived['end_lat'], derived['end_lng'] = analysis.end_point
+
+        for name, value in derived.items():
+            if data.get(name) is None and value is not None:
+                data[name] = value
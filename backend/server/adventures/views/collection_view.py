@@ -19,13 +19,18 @@ from adventures.permissions import CollectionShared
 from adventures.serializers import CollectionSerializer, CollectionInviteSerializer, UltraSlimCollectionSerializer, CollectionItineraryItemSerializer, CollectionItineraryDaySerializer
 from users.models import CustomUser as User
 from adventures.utils import pagination
+from adventures.utils.conditional_get import ConditionalGetMixin
+from adventures.utils.deletion import delete_collection
+from adventures.utils.response_cache import cache_response
+from main.utils import SparseFieldsMixin
 from users.serializers import CustomUserDetailsSerializer as UserSerializer
 
 
-class CollectionViewSet(viewsets.ModelViewSet):
+class CollectionViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     serializer_class = CollectionSerializer
     permission_classes = [CollectionShared]
-    pagination_class = pagination.StandardResultsSetPagination
+    pagination_class = pagination.LibraryPagination
+    conditional_actions = ('list', 'retrieve', 'all', 'archived', 'shared')
 
     def get_serializer_class(self):
         """Return different serializers based on the action"""
@@ -165,6 +170,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
             return self.get_optimized_queryset_for_listing()
         return self.get_base_queryset()
     
+    @cache_response('collections:list')
     def list(self, request):
         # make sure the user is authenticated
         if not request.user.is_authenticated:
@@ -187,6 +193,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
         return self.paginate_and_respond(queryset, request)
     
     @action(detail=False, methods=['get'])
+    @cache_response('collections:all')
     def all(self, request):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
@@ -207,6 +214,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
+    @cache_response('collections:archived')
     def archived(self, request):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
@@ -246,6 +254,7 @@ class CollectionViewSet(viewsets.ModelViewSet):
     
     # make an action to retreive all locations that are shared with the user
     @action(detail=False, methods=['get'])
+    @cache_response('collections:shared')
     def shared(self, request):
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
@@ -1030,6 +1039,11 @@ class CollectionViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # This is ok because you cannot share a collection when creating it
         serializer.save(user=self.request.user)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        # Set-based, so large collections don't run a delete per row
+        delete_collection(instance)
     
     def _cleanup_out_of_range_itinerary_items(self, collection):
         """Delete itinerary items and day metadata outside the collection's date range."""
@@ -1,10 +1,11 @@
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
-from django.contrib.postgres.search import SearchVector, SearchQuery
-from adventures.models import Location, Collection
-from adventures.serializers import LocationSerializer, CollectionSerializer
+from adventures.models import Location, Collection, Note
+from adventures.serializers import LocationSerializer, CollectionSerializer, NoteSerializer
+from adventures.utils.search import (
+    DEFAULT_RESULTS_PER_SECTION, MAX_RESULTS_PER_SECTION, prefix_query, ranked_name_search, ranked_text_search,
+)
 from worldtravel.models import Country, Region, City, VisitedCity, VisitedRegion
 from worldtravel.serializers import CountrySerializer, RegionSerializer, CitySerializer, VisitedCitySerializer, VisitedRegionSerializer
 from users.models import CustomUser as User
@@ -18,10 +19,17 @@ class GlobalSearchView(viewsets.ViewSet):
         if not search_term:
             return Response({"error": "Search query is required"}, status=400)
 
+        try:
+            limit = int(request.query_params.get('limit', DEFAULT_RESULTS_PER_SECTION))
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=400)
+        limit = max(1, min(limit, MAX_RESULTS_PER_SECTION))
+
         # Initialize empty results
         results = {
             "locations": [],
             "collections": [],
+            "notes": [],
             "users": [],
             "countries": [],
             "regions": [],
@@ -29,45 +37,48 @@ class GlobalSearchView(viewsets.ViewSet):
             "visited_regions": [],
             "visited_cities": []
         }
+        context = {'request': request}
 
-        # Locations: Full-Text Search
-        locations = Location.objects.annotate(
-            search=SearchVector('name', 'description', 'location')
-        ).filter(search=SearchQuery(search_term), user=request.user)
-        results["locations"] = LocationSerializer(locations, many=True).data
+        # Locations, Collections and Notes: ranked prefix search on the stored vectors
+        query = prefix_query(search_term)
+        if query is not None:
+            locations = ranked_text_search(
+                Location.objects.filter(user=request.user).prefetch_for_serializer(request.user), query, limit
+            )
+            results["locations"] = LocationSerializer(locations, many=True, context=context).data
 
-        # Collections: Partial Match Search
-        collections = Collection.objects.filter(
-            Q(name__icontains=search_term) & Q(user=request.user)
-        )
-        results["collections"] = CollectionSerializer(collections, many=True).data
+            collections = ranked_text_search(Collection.objects.filter(user=request.user), query, limit)
+            results["collections"] = CollectionSerializer(collections, many=True, context=context).data
+
+            notes = ranked_text_search(Note.objects.filter(user=request.user), query, limit)
+            results["notes"] = NoteSerializer(notes, many=True, context=context).data
 
         # Users: Public Profiles Only
-        users = User.objects.filter(
-            (Q(username__icontains=search_term) |
-             Q(first_name__icontains=search_term) |
-             Q(last_name__icontains=search_term)) & Q(public_profile=True)
+        users = ranked_name_search(
+            User.objects.filter(public_profile=True), search_term, limit,
+            fields=('username', 'first_name', 'last_name'),
         )
-        results["users"] = UserSerializer(users, many=True).data
+        results["users"] = UserSerializer(users, many=True, context=context).data
 
-        # Countries: Full-Text Search
-        countries = Country.objects.annotate(
-            search=SearchVector('name', 'country_code')
-        ).filter(search=SearchQuery(search_term))
-        results["countries"] = CountrySerializer(countries, many=True).data
+        countries = ranked_name_search(Country.objects.all(), search_term, limit, fields=('name', 'country_code'))
+        results["countries"] = CountrySerializer(countries, many=True, context=context).data
 
-        # Regions and Cities: Partial Match Search
-        regions = Region.objects.filter(Q(name__icontains=search_term))
-        results["regions"] = RegionSerializer(regions, many=True).data
+        # Regions and Cities: trigram-indexed name match
+        regions = list(ranked_name_search(Region.objects.select_related('country'), search_term, limit))
+        results["regions"] = RegionSerializer(regions, many=True, context=context).data
 
-        cities = City.objects.filter(Q(name__icontains=search_term))
-        results["cities"] = CitySerializer(cities, many=True).data
+        cities = list(ranked_name_search(City.objects.select_related('region__country'), search_term, limit))
+        results["cities"] = CitySerializer(cities, many=True, context=context).data
 
-        # Visited Regions and Cities
-        visited_regions = VisitedRegion.objects.filter(user=request.user)
-        results["visited_regions"] = VisitedRegionSerializer(visited_regions, many=True).data
+        # Visits of the regions and cities found
+        visited_regions = VisitedRegion.objects.select_related('user', 'region').filter(
+            user=request.user, region__in=[region.id for region in regions]
+        )
+        results["visited_regions"] = VisitedRegionSerializer(visited_regions, many=True, context=context).data
 
-        visited_cities = VisitedCity.objects.filter(user=request.user)
-        results["visited_cities"] = VisitedCitySerializer(visited_cities, many=True).data
+        visited_cities = VisitedCity.objects.select_related('user', 'city').filter(
+            user=request.user, city__in=[city.id for city in cities]
+        )
+        results["visited_cities"] = VisitedCitySerializer(visited_cities, many=True, context=context).data
 
         return Response(results)
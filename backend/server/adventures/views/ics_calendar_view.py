@@ -6,11 +6,13 @@ from icalendar import Calendar, Event, vText, vCalAddress
 from datetime import datetime, timedelta
 from django.db.models import Prefetch
 from adventures.models import Location, Visit
+from adventures.utils.response_cache import cache_response
 
 class IcsCalendarGeneratorViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
 
     @action(detail=False, methods=['get'])
+    @cache_response('calendar:ics')
     def generate(self, request):
         locations = (
             Location.objects.filter(user=request.user)
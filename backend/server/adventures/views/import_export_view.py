@@ -22,6 +22,7 @@ from adventures.models import (
     ContentImage, ContentAttachment, Category, Lodging, Visit, Trail, Activity,
     CollectionItineraryItem
 )
+from adventures.utils.deletion import delete_user_data
 from worldtravel.models import VisitedCity, VisitedRegion, City, Region, Country
 
 User = get_user_model()
@@ -459,31 +460,7 @@ class BackupViewSet(viewsets.ViewSet):
     
     def _clear_user_data(self, user):
         """Clear all existing user data before import"""
-        # Delete itinerary items first (they reference collections and content)
-        CollectionItineraryItem.objects.filter(collection__user=user).delete()
-        
-        # Delete in reverse order of dependencies
-        user.activity_set.all().delete()  # Delete activities first
-        user.trail_set.all().delete()     # Delete trails
-        user.checklistitem_set.all().delete()
-        user.checklist_set.all().delete()
-        user.note_set.all().delete()
-        user.transportation_set.all().delete()
-        user.lodging_set.all().delete()
-        
-        # Delete location-related data
-        user.contentimage_set.all().delete()
-        user.contentattachment_set.all().delete()
-        # Visits are deleted via cascade when locations are deleted
-        user.location_set.all().delete()
-        
-        # Delete collections and categories last
-        user.collection_set.all().delete()
-        user.category_set.all().delete()
-
-        # Clear visited cities and regions
-        user.visitedcity_set.all().delete()
-        user.visitedregion_set.all().delete()
+        delete_user_data(user)
     
     def _import_data(self, backup_data, zip_file, user):
         """Import backup data and return summary"""
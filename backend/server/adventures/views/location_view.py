@@ -1,30 +1,36 @@
 import logging
-from django.utils import timezone
+from django.conf import settings
 from django.db import transaction
 from django.core.exceptions import PermissionDenied
 from django.core.files.base import ContentFile
-from django.db.models import Q, Max, Prefetch
+from django.db.models import Count, F, Q, Max, Prefetch
 from django.db.models.functions import Lower
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 import requests
 from adventures.models import Location, Category, Collection, CollectionItineraryItem, ContentImage, Visit
 from django.contrib.contenttypes.models import ContentType
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
-from adventures.serializers import LocationSerializer, MapPinSerializer, CalendarLocationSerializer
-from adventures.utils import pagination
+from adventures.serializers import BulkLocationSerializer, LocationSerializer, MapPinSerializer, CalendarLocationSerializer
+from adventures.utils import map_clusters, pagination, spatial
+from adventures.utils.bulk_locations import create_locations_in_bulk
+from adventures.utils.conditional_get import ConditionalGetMixin
+from adventures.utils.response_cache import cache_response
+from main.utils import SparseFieldsMixin
 
 logger = logging.getLogger(__name__)
 
-class LocationViewSet(viewsets.ModelViewSet):
+class LocationViewSet(ConditionalGetMixin, SparseFieldsMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing Adventure objects with support for filtering, sorting,
     and sharing functionality.
     """
     serializer_class = LocationSerializer
     permission_classes = [IsOwnerOrSharedWithFullAccess]
-    pagination_class = pagination.StandardResultsSetPagination
+    pagination_class = pagination.LibraryPagination
+    conditional_actions = ('list', 'retrieve', 'all', 'calendar')
 
     # ==================== QUERYSET & PERMISSIONS ====================
 
@@ -38,18 +44,31 @@ class LocationViewSet(viewsets.ModelViewSet):
 
         if not user.is_authenticated:
             if self.action in public_allowed_actions:
-                return Location.objects.retrieve_locations(
+                queryset = Location.objects.retrieve_locations(
                     user, include_public=True
-                ).order_by('-updated_at')
+                ).with_is_visited().order_by('-updated_at')
+                return self._prefetch_for_action(queryset)
             return Location.objects.none()
 
         include_public = self.action in public_allowed_actions
-        return Location.objects.retrieve_locations(
+        queryset = Location.objects.retrieve_locations(
             user,
             include_public=include_public,
             include_owned=True,
             include_shared=True
-        ).order_by('-updated_at')
+        ).with_is_visited().order_by('-updated_at')
+        if self.action == 'list':
+            queryset = self.apply_spatial_query(queryset)
+        return self._prefetch_for_action(queryset)
+
+    def _prefetch_for_action(self, queryset):
+        """
+        Prefetch what LocationSerializer reads for read-only actions. Writes
+        skip it so the response isn't built from caches loaded before the save.
+        """
+        if self.action in {'list', 'retrieve', 'additional_info'}:
+            return queryset.prefetch_for_serializer(self.request.user, fields=self.get_selected_fields())
+        return queryset
 
     # ==================== SORTING & FILTERING ====================
 
@@ -76,6 +95,13 @@ class LocationViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def apply_spatial_query(self, queryset):
+        """Apply the bbox / near+radius / near+nearest query params (see adventures.utils.spatial)."""
+        try:
+            return spatial.apply_spatial_query(queryset, self.request.query_params)
+        except spatial.InvalidSpatialQuery as e:
+            raise ValidationError({"error": str(e)})
+
     def _apply_ordering(self, queryset, order_by, order_direction):
         """Apply ordering to queryset based on field type."""
         if order_by == 'date':
@@ -158,6 +184,31 @@ class LocationViewSet(viewsets.ModelViewSet):
 
     # ==================== CUSTOM ACTIONS ====================
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create many locations at once from a list (or {"locations": [...]}),
+        validated together and inserted in bulk; the whole batch fails if
+        any location is invalid.
+        """
+        if not request.user.is_authenticated:
+            return Response({"error": "User is not authenticated"}, status=400)
+
+        data = request.data.get('locations') if isinstance(request.data, dict) else request.data
+        serializer = BulkLocationSerializer(
+            data=data, many=True, allow_empty=False, max_length=settings.BULK_LOCATIONS_MAX,
+            context=self.get_serializer_context(),
+        )
+        serializer.is_valid(raise_exception=True)
+        locations = create_locations_in_bulk(request.user, serializer.validated_data)
+
+        queryset = Location.objects.filter(id__in=[location.id for location in locations]).prefetch_for_serializer(
+            request.user, fields=self.get_selected_fields()
+        )
+        by_id = {location.id: location for location in queryset}
+        results = [by_id[location.id] for location in locations]
+        return Response(self.get_serializer(results, many=True).data, status=status.HTTP_201_CREATED)
+
     @action(detail=False, methods=['get'])
     def filtered(self, request):
         """Filter locations by category types and visit status."""
@@ -183,15 +234,16 @@ class LocationViewSet(viewsets.ModelViewSet):
         queryset = Location.objects.filter(
             category__in=Category.objects.filter(name__in=types, user=request.user),
             user=request.user.id
-        )
+        ).prefetch_for_serializer(request.user, fields=self.get_selected_fields())
 
         # Apply visit status filtering
         queryset = self._apply_visit_filtering(queryset, request)
-        queryset = self.apply_sorting(queryset)
+        queryset = self.apply_spatial_query(self.apply_sorting(queryset))
         
         return self.paginate_and_respond(queryset, request)
 
     @action(detail=False, methods=['get'])
+    @cache_response('locations:all')
     def all(self, request):
         """Get all locations (public and owned) with optional collection filtering."""
         if not request.user.is_authenticated:
@@ -208,12 +260,15 @@ class LocationViewSet(viewsets.ModelViewSet):
             queryset = Location.objects.filter(base_filter)
         else:
             queryset = Location.objects.filter(base_filter, collections__isnull=True)
+        context = {'nested': nested, 'allowed_nested_fields': allowedNestedFields}
+        queryset = queryset.prefetch_for_serializer(request.user, fields=self.get_selected_fields(context=context))
 
-        queryset = self.apply_sorting(queryset)
-        serializer = self.get_serializer(queryset, many=True, context={'nested': nested, 'allowed_nested_fields': allowedNestedFields})
+        queryset = self.apply_spatial_query(self.apply_sorting(queryset))
+        serializer = self.get_serializer(queryset, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
+    @cache_response('locations:calendar')
     def calendar(self, request):
         """Return a lightweight payload for calendar rendering."""
         if not request.user.is_authenticated:
@@ -385,14 +440,45 @@ class LocationViewSet(viewsets.ModelViewSet):
 
     # view to return location name and lat/lon for all locations a user owns for the golobal map
     @action(detail=False, methods=['get'], url_path='pins')
+    @cache_response('locations:pins')
     def map_locations(self, request):
-        """Get all locations with name and lat/lon for map display."""
+        """
+        Get locations with name and lat/lon for map display.
+
+        Without query params every location is returned as a pin. With
+        `bbox=min_lon,min_lat,max_lon,max_lat` and `zoom`, only the viewport is
+        queried and, at low zoom levels, locations are returned as clusters:
+        {"zoom": int, "clusters": [...], "pins": [...]}.
+        """
         if not request.user.is_authenticated:
             return Response({"error": "User is not authenticated"}, status=400)
 
         locations = Location.objects.filter(user=request.user)
-        serializer = MapPinSerializer(locations, many=True)
-        return Response(serializer.data)
+
+        bbox = request.query_params.get('bbox')
+        zoom = request.query_params.get('zoom')
+        if bbox is None and zoom is None:
+            return Response(self._serialize_pins(locations))
+
+        try:
+            bbox = spatial.parse_bbox(bbox)
+            zoom = map_clusters.parse_zoom(zoom)
+        except spatial.InvalidSpatialQuery as e:
+            return Response({"error": str(e)}, status=400)
+
+        locations = spatial.filter_bbox(locations, bbox)
+        if zoom > map_clusters.CLUSTER_MAX_ZOOM or locations.count() <= map_clusters.MAX_UNCLUSTERED_PINS:
+            return Response({"zoom": zoom, "clusters": [], "pins": self._serialize_pins(locations)})
+
+        return Response({"zoom": zoom, "clusters": map_clusters.cluster_locations(locations, zoom), "pins": []})
+
+    def _serialize_pins(self, locations):
+        # Visit status and category counts are computed in SQL instead of per pin
+        categories = Category.objects.annotate(
+            num_locations=Count('location', filter=Q(location__user=F('user')))
+        )
+        locations = locations.with_is_visited().prefetch_related(Prefetch('category', queryset=categories))
+        return MapPinSerializer(locations, many=True).data
 
     # ==================== HELPER METHODS ====================
 
@@ -474,14 +560,10 @@ class LocationViewSet(viewsets.ModelViewSet):
         else:
             return queryset
 
-        # Apply visit filtering
-        now = timezone.now().date()
-        if is_visited_bool:
-            queryset = queryset.filter(visits__start_date__lte=now).distinct()
-        else:
-            queryset = queryset.exclude(visits__start_date__lte=now).distinct()
-
-        return queryset
+        # Apply visit filtering with the same EXISTS expression the serializers read
+        if 'is_visited' not in queryset.query.annotations:
+            queryset = queryset.with_is_visited()
+        return queryset.filter(is_visited=is_visited_bool)
 
     def _has_adventure_access(self, adventure, user):
         """Check if user has access to adventure."""
@@ -4,11 +4,14 @@ from rest_framework.response import Response
 from django.db.models import Q
 from adventures.models import Lodging
 from adventures.serializers import LodgingSerializer
-from rest_framework.exceptions import PermissionDenied
+from adventures.utils import spatial
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
+from adventures.managers import prefetch_media
+from main.utils import SparseFieldsMixin
 from rest_framework.permissions import IsAuthenticated
 
-class LodgingViewSet(viewsets.ModelViewSet):
+class LodgingViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = Lodging.objects.all()
     serializer_class = LodgingSerializer
     permission_classes = [IsOwnerOrSharedWithFullAccess]
@@ -16,9 +19,13 @@ class LodgingViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        queryset = Lodging.objects.filter(
+        queryset = prefetch_media(Lodging.objects.filter(
             Q(user=request.user.id)
-        )
+        ), self.get_selected_fields())
+        try:
+            queryset = spatial.apply_spatial_query(queryset, request.query_params)
+        except spatial.InvalidSpatialQuery as e:
+            raise ValidationError({"error": str(e)})
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -26,9 +33,9 @@ class LodgingViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if self.action == 'retrieve':
             # For individual adventure retrieval, include public locations, user's own locations and shared locations
-            return Lodging.objects.filter(
+            return prefetch_media(Lodging.objects.filter(
                 Q(is_public=True) | Q(user=user.id) | Q(collection__shared_with=user.id)
-            ).distinct().order_by('-updated_at')
+            ).distinct().order_by('-updated_at'), self.get_selected_fields())
         # For other actions, include user's own locations and shared locations
         return Lodging.objects.filter(
             Q(user=user.id) | Q(collection__shared_with=user.id)
@@ -8,6 +8,8 @@ from adventures.serializers import LocationSerializer
 from adventures.geocoding import reverse_geocode
 from django.conf import settings
 from adventures.geocoding import search_google, search_osm
+from adventures.utils.response_cache import schedule_generation_bump
+from adventures.utils.user_stats import schedule_user_stats_refresh
 
 class ReverseGeocodeViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -57,7 +59,7 @@ class ReverseGeocodeViewSet(viewsets.ViewSet):
         # Get all visited locations with their region and city data
         visited_locations = Location.objects.filter(
             user=self.request.user
-        ).select_related('region', 'city')
+        ).with_is_visited().select_related('region', 'city')
         
         # Track unique regions and cities to create VisitedRegion/VisitedCity entries
         regions_to_mark = set()
@@ -126,6 +128,11 @@ class ReverseGeocodeViewSet(viewsets.ViewSet):
             )
             new_cities = {c.id: c.name for c in cities}
         
+        if new_visited_regions or new_visited_cities:
+            # bulk_create skips the post_save signals that update the stats and cached responses
+            schedule_user_stats_refresh(self.request.user.id, 'visited')
+            schedule_generation_bump({self.request.user.id})
+
         return Response({
             "new_regions": new_region_count,
             "regions": new_regions,
@@ -3,10 +3,13 @@ from rest_framework.response import Response
 from django.db.models import Q
 from adventures.models import Transportation
 from adventures.serializers import TransportationSerializer
-from rest_framework.exceptions import PermissionDenied
+from adventures.utils import spatial
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from adventures.permissions import IsOwnerOrSharedWithFullAccess
+from adventures.managers import prefetch_media
+from main.utils import SparseFieldsMixin
 
-class TransportationViewSet(viewsets.ModelViewSet):
+class TransportationViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     queryset = Transportation.objects.all()
     serializer_class = TransportationSerializer
     permission_classes = [IsOwnerOrSharedWithFullAccess]
@@ -14,9 +17,17 @@ class TransportationViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
             return Response(status=status.HTTP_403_FORBIDDEN)
-        queryset = Transportation.objects.filter(
+        queryset = prefetch_media(Transportation.objects.filter(
             Q(user=request.user.id)
-        )
+        ), self.get_selected_fields())
+        # Spatial params apply to the origin unless ?endpoint=destination
+        endpoint = request.query_params.get('endpoint', 'origin')
+        if endpoint not in ('origin', 'destination'):
+            raise ValidationError({"error": "endpoint must be 'origin' or 'destination'"})
+        try:
+            queryset = spatial.apply_spatial_query(queryset, request.query_params, field=f'{endpoint}_point')
+        except spatial.InvalidSpatialQuery as e:
+            raise ValidationError({"error": str(e)})
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
@@ -24,9 +35,9 @@ class TransportationViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if self.action == 'retrieve':
             # For individual adventure retrieval, include public locations, user's own locations and shared locations
-            return Transportation.objects.filter(
+            return prefetch_media(Transportation.objects.filter(
                 Q(is_public=True) | Q(user=user.id) | Q(collection__shared_with=user.id)
-            ).distinct().order_by('-updated_at')
+            ).distinct().order_by('-updated_at'), self.get_selected_fields())
         # For other actions, include user's own locations and shared locations
         return Transportation.objects.filter(
             Q(user=user.id) | Q(collection__shared_with=user.id)
@@ -373,8 +373,47 @@ ADVENTURELOG_RELEASE_VERSION = 'v0.12.0'
 
 # https://github.com/dr5hn/countries-states-cities-database/tags
 COUNTRY_REGION_JSON_VERSION = 'v3.0'
+# Optional SHA-256 the downloaded countries+states+cities JSON must match.
+COUNTRY_REGION_JSON_SHA256 = getenv('COUNTRY_REGION_JSON_SHA256', '')
 
 # External service keys (do not hardcode secrets)
 GOOGLE_MAPS_API_KEY = getenv('GOOGLE_MAPS_API_KEY', '')
 STRAVA_CLIENT_ID = getenv('STRAVA_CLIENT_ID', '')
-STRAVA_CLIENT_SECRET = getenv('STRAVA_CLIENT_SECRET', '')
\ No newline at end of file
+STRAVA_CLIENT_SECRET = getenv('STRAVA_CLIENT_SECRET', '')
+
+# ---------------------------------------------------------------------------
+# Geocoding
+# ---------------------------------------------------------------------------
+# Reverse geocoding: 'remote' (Google/OSM), 'offline' (local worldtravel index only)
+# or 'offline-first' (local index, remote providers as fallback).
+GEOCODING_MODE = getenv('GEOCODING_MODE', 'remote').lower()
+OFFLINE_GEOCODER_CITY_RADIUS_KM = float(getenv('OFFLINE_GEOCODER_CITY_RADIUS_KM', '25'))
+OFFLINE_GEOCODER_REGION_RADIUS_KM = float(getenv('OFFLINE_GEOCODER_REGION_RADIUS_KM', '150'))
+# Optional directory of GeoJSON region boundaries (features tagged with an ISO 3166-2 `region_id`).
+OFFLINE_GEOCODER_BOUNDARIES_DIR = getenv('OFFLINE_GEOCODER_BOUNDARIES_DIR', str(MEDIA_ROOT / 'boundaries'))
+
+# Cache of provider geocoding results (memcached in front of the GeocodeCacheEntry table).
+GEOCODE_CACHE_ENABLED = getenv('GEOCODE_CACHE_ENABLED', 'true').lower() == 'true'
+GEOCODE_CACHE_TTL = int(getenv('GEOCODE_CACHE_TTL', str(60 * 60 * 24 * 30)))  # 30 days
+GEOCODE_CACHE_NEGATIVE_TTL = int(getenv('GEOCODE_CACHE_NEGATIVE_TTL', str(60 * 60 * 24)))  # 1 day
+GEOCODE_CACHE_MAX_ENTRIES = int(getenv('GEOCODE_CACHE_MAX_ENTRIES', '100000'))
+# Decimal places reverse lookups are rounded to before keying (4 ≈ 11 m).
+GEOCODE_CACHE_PRECISION = int(getenv('GEOCODE_CACHE_PRECISION', '4'))
+
+# Per-user cache of read-heavy API responses, invalidated whenever the user's data changes.
+RESPONSE_CACHE_ENABLED = getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_TTL = int(getenv('RESPONSE_CACHE_TTL', str(60 * 60 * 24)))  # 1 day
+
+# Most locations one POST /api/locations/bulk/ request may create.
+BULK_LOCATIONS_MAX = int(getenv('BULK_LOCATIONS_MAX', '5000'))
+
+# Background geocoding worker pool used when locations are saved.
+GEOCODE_WORKERS = int(getenv('GEOCODE_WORKERS', '2'))
+GEOCODE_MAX_RETRIES = int(getenv('GEOCODE_MAX_RETRIES', '3'))
+GEOCODE_RETRY_BACKOFF = float(getenv('GEOCODE_RETRY_BACKOFF', '5'))  # seconds, doubled per retry
+# Requests per second allowed to each provider from this process (Nominatim's policy is 1/s).
+GEOCODE_PROVIDER_RATE_LIMITS = {
+    'osm': float(getenv('GEOCODE_OSM_RATE_LIMIT', '1')),
+    'google': float(getenv('GEOCODE_GOOGLE_RATE_LIMIT', '10')),
+}
+GEOCODE_RATE_LIMIT_WAIT = float(getenv('GEOCODE_RATE_LIMIT_WAIT', '10'))  # seconds
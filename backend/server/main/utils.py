@@ -1,11 +1,107 @@
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 
 def get_user_uuid(user):
     return str(user.uuid)
 
+def parse_field_paths(value):
+    """
+    Parse a field list like 'id,name,locations.name' (a string or an iterable
+    of paths) into {field: [sub-paths]}; bare fields map to an empty list.
+    """
+    if value is None:
+        return {}
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str):
+        value = value.split(',')
+    paths = {}
+    for path in value:
+        path = path.strip()
+        if not path:
+            continue
+        name, _, rest = path.partition('.')
+        children = paths.setdefault(name, [])
+        if rest:
+            children.append(rest)
+    return paths
+
 class CustomModelSerializer(serializers.ModelSerializer):
+    """
+    Model serializer with sparse fieldsets. `fields` keeps only the listed
+    fields, `omit` drops fields and `expand` brings back fields the
+    serializer leaves out by default (see get_default_omit). Each accepts
+    dotted paths ('locations.images') that are handed down to nested
+    serializers. Dropped fields are never computed, so their method fields
+    and nested serializers cost nothing.
+    """
+
+    dropped_fields = frozenset()
+
+    def __init__(self, *args, fields=None, omit=None, expand=None, **kwargs):
+        self.field_selection = {
+            'fields': None if fields is None else parse_field_paths(fields),
+            'omit': parse_field_paths(omit),
+            'expand': parse_field_paths(expand),
+        }
+        super().__init__(*args, **kwargs)
+
+    def get_default_omit(self):
+        """Fields left out unless expanded; serializers override this for slim modes."""
+        return set()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = self.field_selection['fields']
+        omitted = {name for name, children in self.field_selection['omit'].items() if not children}
+        omitted |= set(self.get_default_omit()) - set(self.field_selection['expand'])
+
+        self.dropped_fields = set()
+        for name in list(fields):
+            if (selected is not None and name not in selected) or name in omitted:
+                self.dropped_fields.add(name)
+                del fields[name]
+
+        for name, field in fields.items():
+            # Hand dotted paths down to declared nested serializers
+            child = getattr(field, 'child', field)
+            if isinstance(child, CustomModelSerializer):
+                child.field_selection = self.child_selection(name)
+        return fields
+
+    def child_selection(self, name):
+        """The fields/omit/expand kwargs for the nested serializer rendering field `name`."""
+        selected = self.field_selection['fields']
+        children = selected.get(name) if selected is not None else None
+        return {
+            'fields': parse_field_paths(children) if children else None,
+            'omit': parse_field_paths(self.field_selection['omit'].get(name)),
+            'expand': parse_field_paths(self.field_selection['expand'].get(name)),
+        }
+
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        if hasattr(instance, 'user') and instance.user:
+        if 'user' not in self.dropped_fields and hasattr(instance, 'user') and instance.user:
             representation['user'] = get_user_uuid(instance.user)
-        return representation
\ No newline at end of file
+        return representation
+
+class SparseFieldsMixin:
+    """
+    ViewSet mixin passing the ?fields=, ?omit= and ?expand= query params of
+    read requests to a CustomModelSerializer.
+    """
+    sparse_field_params = ('fields', 'omit', 'expand')
+
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method in SAFE_METHODS and issubclass(self.get_serializer_class(), CustomModelSerializer):
+            for param in self.sparse_field_params:
+                value = self.request.query_params.get(param)
+                if value:
+                    kwargs.setdefault(param, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_selected_fields(self, **kwargs):
+        """Names of the top-level fields the response will contain, to choose prefetches by."""
+        if not issubclass(self.get_serializer_class(), CustomModelSerializer):
+            return None
+        return set(self.get_serializer(**kwargs).fields)
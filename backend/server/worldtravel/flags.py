@@ -0,0 +1,160 @@
+"""
+Country flag downloads for the world travel data.
+
+Flags are fetched from flagcdn.com on a bounded thread pool sharing one
+pooled HTTP session. A manifest next to the images records each flag's
+ETag, Last-Modified and SHA-256 so refreshes can use conditional requests
+and unchanged files are never rewritten.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+FLAG_URL = 'https://flagcdn.com/h240/{code}.png'
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_WORKERS = 8
+
+
+class FlagSync:
+    """
+    Download country flags in the background.
+
+    Usage:
+        with FlagSync(flags_dir) as flags:
+            flags.submit('us')
+            ...
+        # leaving the block waits for all downloads and saves the manifest
+
+    With refresh=False (the default) flags already on disk are left alone;
+    with refresh=True they are revalidated with If-None-Match/If-Modified-Since.
+    """
+
+    def __init__(self, flags_dir, workers=DEFAULT_WORKERS, refresh=False, log=print):
+        self.flags_dir = flags_dir
+        self.refresh = refresh
+        self.log = log
+        self.manifest_path = os.path.join(flags_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self.counts = {'downloaded': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0}
+        # Country code -> exception of flags whose sync raised
+        self.errors = {}
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(flags_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=2)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='flag-sync')
+        self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.wait()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def submit(self, country_code):
+        code = country_code.lower()
+        with self._lock:
+            if code in self._submitted:
+                return
+            self._submitted.add(code)
+        self._futures.append((code, self.executor.submit(self._sync_flag, code)))
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _sync_flag(self, code):
+        flag_path = os.path.join(self.flags_dir, f'{code}.png')
+        exists = os.path.exists(flag_path)
+        with self._lock:
+            entry = dict(self.manifest.get(code, {}))
+
+        if exists and not self.refresh:
+            self._count('skipped')
+            return
+
+        headers = {}
+        if exists:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            res = self.session.get(FLAG_URL.format(code=code), headers=headers, timeout=(5, 30))
+        except requests.exceptions.RequestException as e:
+            self.log(f'Error downloading flag for {code}: {e}')
+            self._count('failed')
+            return
+
+        if res.status_code == 304:
+            self._count('unchanged')
+            return
+        if res.status_code != 200:
+            self.log(f'Error downloading flag for {code}: HTTP {res.status_code}')
+            self._count('failed')
+            return
+
+        digest = hashlib.sha256(res.content).hexdigest()
+        if not (exists and entry.get('sha256') == digest):
+            tmp_path = f'{flag_path}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(res.content)
+            os.replace(tmp_path, flag_path)
+            self._count('downloaded')
+        else:
+            self._count('unchanged')
+
+        with self._lock:
+            self.manifest[code] = {
+                'etag': res.headers.get('ETag'),
+                'last_modified': res.headers.get('Last-Modified'),
+                'sha256': digest,
+            }
+
+    def wait(self):
+        """
+        Wait for every submitted flag, persist the manifest and return the
+        counts. A flag whose sync raised is counted as failed and its error
+        kept in `errors`; the other flags and the manifest are unaffected.
+        """
+        try:
+            for code, future in self._futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    self.log(f'Error syncing flag for {code}: {e}')
+                    self.errors[code] = e
+                    self._count('failed')
+        finally:
+            self.executor.shutdown(wait=True)
+            self.session.close()
+            self._save_manifest()
+        self.log(
+            f"Flags: {self.counts['downloaded']} downloaded, {self.counts['unchanged']} unchanged, "
+            f"{self.counts['skipped']} already present, {self.counts['failed']} failed"
+        )
+        return self.counts
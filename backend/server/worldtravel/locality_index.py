@@ -0,0 +1,136 @@
+"""
+Per-region name lookup tables for matching geocoder locality names
+(suburb, town, county, ...) to City rows without querying and normalizing
+every city in the region on each reverse geocode.
+"""
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, namedtuple
+
+from worldtravel.models import City
+from worldtravel.utils import get_world_data_version
+
+LocalityMatch = namedtuple('LocalityMatch', ['id', 'name'])
+
+# Regions kept in memory at once; the least recently used index is dropped first.
+MAX_CACHED_REGIONS = 512
+
+# How often (seconds) cached indexes check whether the world data was re-imported.
+VERSION_CHECK_INTERVAL = 60
+
+
+def normalize_locality_name(value):
+    """Strip accents and everything but ASCII letters/digits, e.g. 'Tromsø' -> 'tromso'."""
+    normalized = unicodedata.normalize("NFKD", value)
+    ascii_only = normalized.encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]", "", ascii_only.lower())
+
+
+def _trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class RegionLocalityIndex:
+    """
+    Lookup tables for the cities of one region:
+    case-insensitive name -> city, normalized name -> city, and a trigram
+    index used to find substring matches without scanning every name.
+    Where several cities share a key the one with the lowest id wins.
+    """
+
+    def __init__(self, cities):
+        self.cities = []
+        self._lower_names = []
+        self._by_name = {}
+        self._by_normalized = {}
+        self._by_trigram = {}
+
+        for city_id, name in cities:
+            position = len(self.cities)
+            lower = name.lower()
+            self.cities.append(LocalityMatch(city_id, name))
+            self._lower_names.append(lower)
+            self._by_name.setdefault(lower, position)
+            normalized = normalize_locality_name(name)
+            if normalized:
+                self._by_normalized.setdefault(normalized, position)
+            for gram in _trigrams(lower):
+                # Positions are appended in increasing order, so each list stays sorted.
+                self._by_trigram.setdefault(gram, []).append(position)
+
+    def __len__(self):
+        return len(self.cities)
+
+    def exact(self, value):
+        position = self._by_name.get(value.lower())
+        return self.cities[position] if position is not None else None
+
+    def normalized(self, value):
+        normalized = normalize_locality_name(value)
+        position = self._by_normalized.get(normalized) if normalized else None
+        return self.cities[position] if position is not None else None
+
+    def containing(self, value):
+        """First city whose name contains `value`, ignoring case."""
+        lower = value.lower()
+        if not lower:
+            return None
+
+        grams = _trigrams(lower)
+        if grams:
+            # Only names sharing the query's rarest trigram can contain it.
+            candidates = min((self._by_trigram.get(gram, ()) for gram in grams), key=len)
+        else:
+            candidates = range(len(self.cities))
+
+        for position in candidates:
+            if lower in self._lower_names[position]:
+                return self.cities[position]
+        return None
+
+
+_indexes = OrderedDict()
+_indexes_version = None
+_indexes_checked_at = 0.0
+_indexes_lock = threading.Lock()
+
+
+def get_region_locality_index(region_id):
+    """
+    Return the locality index for a region, building it on first use.
+    All cached indexes are dropped when `download-countries` imports new data.
+    """
+    global _indexes_version, _indexes_checked_at
+
+    with _indexes_lock:
+        now = time.monotonic()
+        if now - _indexes_checked_at >= VERSION_CHECK_INTERVAL:
+            version = get_world_data_version()
+            _indexes_checked_at = now
+            if version != _indexes_version:
+                _indexes.clear()
+                _indexes_version = version
+
+        index = _indexes.get(region_id)
+        if index is not None:
+            _indexes.move_to_end(region_id)
+            return index
+
+    # Build outside the lock so other regions can be served meanwhile.
+    index = RegionLocalityIndex(
+        City.objects.filter(region_id=region_id).order_by('id').values_list('id', 'name').iterator(chunk_size=2000)
+    )
+
+    with _indexes_lock:
+        _indexes[region_id] = index
+        _indexes.move_to_end(region_id)
+        while len(_indexes) > MAX_CACHED_REGIONS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def invalidate_locality_indexes():
+    with _indexes_lock:
+        _indexes.clear()
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from adventures.models import Location
-import time
+from adventures.utils.geocode_queue import get_geocode_dispatcher
 
 class Command(BaseCommand):
 	help = 'Bulk geocode all adventures by triggering save on each one'
@@ -14,13 +14,15 @@ class Command(BaseCommand):
 		for i, adventure in enumerate(adventures):
 			try:
 				self.stdout.write(f'Processing adventure {i+1}/{total}: {adventure}')
-				adventure.save()  # This should trigger any geocoding in the save method
-				self.stdout.write(self.style.SUCCESS(f'Successfully processed adventure {i+1}/{total}'))
+				adventure.save()  # Enqueues the adventure on the rate-limited geocode worker pool
+				self.stdout.write(self.style.SUCCESS(f'Successfully queued adventure {i+1}/{total}'))
 			except Exception as e:
 				self.stdout.write(self.style.ERROR(f'Error processing adventure {i+1}/{total}: {adventure} - {e}'))
-			
-			# Sleep for 2 seconds between each save
-			if i < total - 1:  # Don't sleep after the last one
-				time.sleep(2)
+		
+		dispatcher = get_geocode_dispatcher()
+		self.stdout.write(f'Waiting for {dispatcher.queue_depth()} queued geocode jobs to finish...')
+		dispatcher.wait_until_idle()
+		stats = dispatcher.stats()
+		self.stdout.write(f"Geocoded {stats['processed']} jobs ({stats['retried']} retries, {stats['failed']} failed)")
 		
 		self.stdout.write(self.style.SUCCESS('Finished processing all adventures'))
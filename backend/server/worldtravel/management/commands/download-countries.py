@@ -1,517 +1,499 @@
 import os
+import hashlib
 from django.core.management.base import BaseCommand
 import requests
-from worldtravel.models import Country, Region, City
-from django.db import transaction
+from worldtravel.models import Country, Region, City, VisitedRegion, VisitedCity, WorldDataImport
+from worldtravel.utils import bump_world_data_version
+from worldtravel.flags import FlagSync
+from adventures.utils.response_cache import bump_generations
+from adventures.utils.user_stats import rebuild_user_stats
+from adventures.models import Location
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
 import ijson
-import gc
 import tempfile
-import sqlite3
 from contextlib import contextmanager
 
 from django.conf import settings
 
 COUNTRY_REGION_JSON_VERSION = settings.COUNTRY_REGION_JSON_VERSION
-        
+
+User = get_user_model()
+
 media_root = settings.MEDIA_ROOT
+flags_dir = os.path.join(media_root, 'flags')
+
+# Unlogged staging tables the parsed JSON is COPY'd into before being merged.
+STAGE_COUNTRY_TABLE = 'worldtravel_stage_country'
+STAGE_REGION_TABLE = 'worldtravel_stage_region'
+STAGE_CITY_TABLE = 'worldtravel_stage_city'
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_ATTEMPTS = 5
+
+STAGE_TABLES = {
+    STAGE_COUNTRY_TABLE: '''
+        seq bigserial,
+        country_code text NOT NULL,
+        name text,
+        subregion text,
+        capital text,
+        longitude numeric(9, 6),
+        latitude numeric(9, 6)
+    ''',
+    STAGE_REGION_TABLE: '''
+        seq bigserial,
+        id text NOT NULL,
+        name text,
+        country_code text,
+        longitude numeric(9, 6),
+        latitude numeric(9, 6)
+    ''',
+    STAGE_CITY_TABLE: '''
+        seq bigserial,
+        id text NOT NULL,
+        name text,
+        region_id text,
+        longitude numeric(9, 6),
+        latitude numeric(9, 6)
+    ''',
+}
+
+def _copy_value(value):
+    """Format a value for PostgreSQL's COPY text format."""
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+def _copy_row(*values):
+    return '\t'.join(_copy_value(value) for value in values) + '\n'
+
+def _coordinate(value):
+    return round(float(value), 6) if value else None
+
+def file_sha256(path, sha256=None):
+    sha256 = sha256 or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class DownloadError(Exception):
+    pass
+
+def _range_total(content_range):
+    """Full size from a 'bytes */<size>' Content-Range header, or None."""
+    try:
+        return int(content_range.rsplit('/', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def download_file(url, path, expected_sha256=None, attempts=DOWNLOAD_ATTEMPTS, log=print):
+    """
+    Stream `url` to `path` in chunks so memory use does not depend on file size.
+
+    Data is written to `<path>.part`; an interrupted download is resumed with
+    an HTTP Range request (guarded by If-Range on the saved ETag so a changed
+    file restarts from scratch). The SHA-256 is computed while streaming and,
+    when `expected_sha256` is given, verified before the file is moved into
+    place. A saved part the server reports as already complete (HTTP 416
+    with its full size) is used as is; any other 416 discards it. Returns the
+    hex digest.
+    """
+    part_path = f'{path}.part'
+    etag_path = f'{part_path}.etag'
+
+    for attempt in range(1, attempts + 1):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        etag = None
+        if offset and os.path.exists(etag_path):
+            with open(etag_path) as f:
+                etag = f.read().strip() or None
+
+        # Ask for the raw bytes so Range offsets and Content-Length refer to the file itself.
+        headers = {'Accept-Encoding': 'identity'}
+        if offset and etag:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = etag
+
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as res:
+                if res.status_code == 206:
+                    log(f'Resuming download at {offset} bytes')
+                    sha256 = hashlib.sha256()
+                    file_sha256(part_path, sha256)
+                    mode = 'ab'
+                elif res.status_code == 200:
+                    sha256 = hashlib.sha256()
+                    mode = 'wb'
+                elif res.status_code == 416 and offset:
+                    if _range_total(res.headers.get('Content-Range')) != offset:
+                        # Not a prefix of the current file; start over without a Range
+                        for stale_path in (part_path, etag_path):
+                            if os.path.exists(stale_path):
+                                os.remove(stale_path)
+                        raise DownloadError('Saved partial download does not match; restarting')
+                    log('Partial download is already complete')
+                    sha256 = hashlib.sha256()
+                    file_sha256(part_path, sha256)
+                    mode = None
+                else:
+                    raise DownloadError(f'Unexpected HTTP status {res.status_code}')
+
+                if mode is not None:
+                    if res.headers.get('ETag'):
+                        with open(etag_path, 'w') as f:
+                            f.write(res.headers['ETag'])
+
+                    expected_length = res.headers.get('Content-Length')
+                    written = 0
+                    with open(part_path, mode) as f:
+                        for chunk in res.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            f.write(chunk)
+                            sha256.update(chunk)
+                            written += len(chunk)
 
-def saveCountryFlag(country_code):
-    # For standards, use the lowercase country_code
-    country_code = country_code.lower()
-    flags_dir = os.path.join(media_root, 'flags')
-
-    # Check if the flags directory exists, if not, create it
-    if not os.path.exists(flags_dir):
-        os.makedirs(flags_dir)
-
-    # Check if the flag already exists in the media folder
-    flag_path = os.path.join(flags_dir, f'{country_code}.png')
-    if os.path.exists(flag_path):
-        print(f'Flag for {country_code} already exists')
-        return
-
-    res = requests.get(f'https://flagcdn.com/h240/{country_code}.png'.lower())
-    if res.status_code == 200:
-        with open(flag_path, 'wb') as f:
-            f.write(res.content)
-        print(f'Flag for {country_code} downloaded')
-    else:
-        print(f'Error downloading flag for {country_code}')
+                    if expected_length is not None and written != int(expected_length):
+                        raise DownloadError(f'Incomplete download: got {written} of {expected_length} bytes')
+        except (requests.exceptions.RequestException, DownloadError) as e:
+            if attempt == attempts:
+                raise DownloadError(str(e)) from e
+            log(f'Download attempt {attempt} failed ({e}); retrying...')
+            continue
+
+        digest = sha256.hexdigest()
+        if expected_sha256 and digest != expected_sha256.lower():
+            os.remove(part_path)
+            raise DownloadError(f'Checksum mismatch: expected {expected_sha256}, got {digest}')
+
+        os.replace(part_path, path)
+        if os.path.exists(etag_path):
+            os.remove(etag_path)
+        return digest
 
 class Command(BaseCommand):
     help = 'Imports the world travel data with minimal memory usage'
 
     def add_arguments(self, parser):
         parser.add_argument('--force', action='store_true', help='Force download the countries+regions+states.json file')
-        parser.add_argument('--batch-size', type=int, default=500, help='Batch size for database operations')
+        parser.add_argument('--refresh-flags', action='store_true', help='Revalidate flags that are already downloaded')
+        parser.add_argument('--flag-workers', type=int, default=8, help='Number of concurrent flag downloads')
 
     @contextmanager
-    def _temp_db(self):
-        """Create a temporary SQLite database for intermediate storage"""
-        with tempfile.NamedTemporaryFile(suffix='.db', delete=False) as f:
-            temp_db_path = f.name
-        
+    def _spool_files(self):
+        """Temporary files holding COPY-formatted rows for each staging table"""
+        files = {}
         try:
-            conn = sqlite3.connect(temp_db_path)
-            conn.execute('''CREATE TABLE temp_countries (
-                country_code TEXT PRIMARY KEY,
-                name TEXT,
-                subregion TEXT,
-                capital TEXT,
-                longitude REAL,
-                latitude REAL
-            )''')
-            
-            conn.execute('''CREATE TABLE temp_regions (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                country_code TEXT,
-                longitude REAL,
-                latitude REAL
-            )''')
-            
-            conn.execute('''CREATE TABLE temp_cities (
-                id TEXT PRIMARY KEY,
-                name TEXT,
-                region_id TEXT,
-                longitude REAL,
-                latitude REAL
-            )''')
-            
-            conn.commit()
-            yield conn
+            for table in STAGE_TABLES:
+                files[table] = tempfile.TemporaryFile(mode='w+', encoding='utf-8', suffix='.copy')
+            yield files
         finally:
-            conn.close()
-            try:
-                os.unlink(temp_db_path)
-            except OSError:
-                pass
+            for f in files.values():
+                f.close()
+
+    @contextmanager
+    def _stage_tables(self):
+        """Create empty unlogged staging tables and drop them afterwards"""
+        with connection.cursor() as cursor:
+            for table, columns in STAGE_TABLES.items():
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                cursor.execute(f'CREATE UNLOGGED TABLE {table} ({columns})')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                for table in STAGE_TABLES:
+                    cursor.execute(f'DROP TABLE IF EXISTS {table}')
 
     def handle(self, **options):
         force = options['force']
-        batch_size = options['batch_size']
         countries_json_path = os.path.join(settings.MEDIA_ROOT, f'countries+regions+states-{COUNTRY_REGION_JSON_VERSION}.json')
-        
+
+        source_hash = None
+
         # Download or validate JSON file
         if not os.path.exists(countries_json_path) or force:
             self.stdout.write('Downloading JSON file...')
-            res = requests.get(f'https://raw.githubusercontent.com/dr5hn/countries-states-cities-database/{COUNTRY_REGION_JSON_VERSION}/json/countries%2Bstates%2Bcities.json')
-            if res.status_code == 200:
-                with open(countries_json_path, 'w') as f:
-                    f.write(res.text)
-                self.stdout.write(self.style.SUCCESS('JSON file downloaded successfully'))
-            else:
-                self.stdout.write(self.style.ERROR('Error downloading JSON file'))
+            try:
+                source_hash = download_file(
+                    f'https://raw.githubusercontent.com/dr5hn/countries-states-cities-database/{COUNTRY_REGION_JSON_VERSION}/json/countries%2Bstates%2Bcities.json',
+                    countries_json_path,
+                    expected_sha256=settings.COUNTRY_REGION_JSON_SHA256,
+                    log=self.stdout.write,
+                )
+            except DownloadError as e:
+                self.stdout.write(self.style.ERROR(f'Error downloading JSON file: {e}'))
                 return
+            self.stdout.write(self.style.SUCCESS('JSON file downloaded successfully'))
         elif not os.path.isfile(countries_json_path):
             self.stdout.write(self.style.ERROR('JSON file is not a file'))
             return
         elif os.path.getsize(countries_json_path) == 0:
             self.stdout.write(self.style.ERROR('JSON file is empty'))
             return
-        elif Country.objects.count() == 0 or Region.objects.count() == 0 or City.objects.count() == 0:
-            self.stdout.write(self.style.WARNING('Some data is missing. Re-importing all data.'))
-        else:
+
+        if source_hash is None:
+            source_hash = file_sha256(countries_json_path)
+            expected_sha256 = settings.COUNTRY_REGION_JSON_SHA256
+            if expected_sha256 and source_hash != expected_sha256.lower():
+                self.stdout.write(self.style.ERROR('JSON file checksum does not match COUNTRY_REGION_JSON_SHA256. Re-run with --force to download it again.'))
+                return
+        last_import = WorldDataImport.objects.order_by('-imported_at').first()
+        data_present = Country.objects.exists() and Region.objects.exists() and City.objects.exists()
+
+        flag_sync = FlagSync(flags_dir, workers=options['flag_workers'], refresh=options['refresh_flags'], log=self.stdout.write)
+
+        if not force and data_present and last_import and last_import.source_hash == source_hash:
+            # Still fetch any flags that went missing from the media folder
+            with flag_sync:
+                for country_code in Country.objects.values_list('country_code', flat=True):
+                    flag_sync.submit(country_code)
             self.stdout.write(self.style.SUCCESS('Latest data already imported.'))
             return
+        if not data_present:
+            self.stdout.write(self.style.WARNING('Some data is missing. Re-importing all data.'))
+
+        self.stdout.write(self.style.SUCCESS('Starting import process...'))
 
-        self.stdout.write(self.style.SUCCESS('Starting ultra-memory-efficient import process...'))
-
-        # Use temporary SQLite database for intermediate storage
-        with self._temp_db() as temp_conn:
-            self.stdout.write('Step 1: Parsing JSON and storing in temporary database...')
-            self._parse_and_store_temp(countries_json_path, temp_conn)
-            
-            self.stdout.write('Step 2: Processing countries...')
-            self._process_countries_from_temp(temp_conn, batch_size)
-            
-            self.stdout.write('Step 3: Processing regions...')  
-            self._process_regions_from_temp(temp_conn, batch_size)
-            
-            self.stdout.write('Step 4: Processing cities...')
-            self._process_cities_from_temp(temp_conn, batch_size)
-            
-            self.stdout.write('Step 5: Cleaning up obsolete records...')
-            self._cleanup_obsolete_records(temp_conn)
-
-        self.stdout.write(self.style.SUCCESS('All data imported successfully with minimal memory usage'))
-
-    def _parse_and_store_temp(self, json_path, temp_conn):
-        """Parse JSON once and store in temporary SQLite database"""
+        # Flags download on their own thread pool while the database import runs
+        with flag_sync, self._spool_files() as spool_files, self._stage_tables():
+            self.stdout.write('Step 1: Parsing JSON into staging files...')
+            self._parse_to_spool_files(countries_json_path, spool_files, flag_sync)
+
+            self.stdout.write('Step 2: Loading staging tables...')
+            self._copy_into_stage_tables(spool_files)
+
+            self.stdout.write('Step 3: Merging countries, regions and cities...')
+            self._apply_stage_tables(source_hash)
+
+            self.stdout.write('Step 4: Waiting for flag downloads...')
+
+        self.stdout.write(self.style.SUCCESS('All data imported successfully'))
+
+    def _apply_stage_tables(self, source_hash):
+        """Merge the staged rows into the live tables and refresh what depends on them"""
+        with transaction.atomic():
+            counts, changed = self._merge_stage_tables()
+            changed += self._delete_obsolete_records()
+            WorldDataImport.objects.create(
+                source_version=COUNTRY_REGION_JSON_VERSION,
+                source_hash=source_hash,
+                **counts,
+            )
+
+        # Let in-process indexes (offline geocoder, etc.) rebuild from the new data
+        bump_world_data_version()
+
+        # Visited regions/cities of removed records were deleted in SQL
+        rebuild_user_stats(sections=('visited',))
+
+        if changed:
+            # Renames and removals reach every user's locations, visited places
+            # and stats without any signal; drop all cached responses once
+            bump_generations(User.objects.values_list('id', flat=True))
+
+    def _parse_to_spool_files(self, json_path, spool_files, flag_sync):
+        """Stream the JSON once and write COPY rows for countries, regions and cities"""
+        country_file = spool_files[STAGE_COUNTRY_TABLE]
+        region_file = spool_files[STAGE_REGION_TABLE]
+        city_file = spool_files[STAGE_CITY_TABLE]
         country_count = 0
         region_count = 0
         city_count = 0
-        
+
         with open(json_path, 'rb') as f:
             parser = ijson.items(f, 'item')
-            
+
             for country in parser:
                 country_code = country['iso2']
                 country_name = country['name']
-                country_subregion = country['subregion']
-                country_capital = country['capital']
-                longitude = round(float(country['longitude']), 6) if country['longitude'] else None
-                latitude = round(float(country['latitude']), 6) if country['latitude'] else None
-
-                # Store country
-                temp_conn.execute('''INSERT OR REPLACE INTO temp_countries 
-                    (country_code, name, subregion, capital, longitude, latitude) 
-                    VALUES (?, ?, ?, ?, ?, ?)''',
-                    (country_code, country_name, country_subregion, country_capital, longitude, latitude))
-                
+
+                country_file.write(_copy_row(
+                    country_code, country_name, country['subregion'], country['capital'],
+                    _coordinate(country['longitude']), _coordinate(country['latitude']),
+                ))
                 country_count += 1
-                
-                # Download flag (do this during parsing to avoid extra pass)
-                saveCountryFlag(country_code)
+
+                # Queue the flag download; it runs in the background
+                flag_sync.submit(country_code)
 
                 # Process regions/states
                 if country['states']:
                     for state in country['states']:
                         state_id = f"{country_code}-{state['iso2']}"
-                        state_name = state['name']
-                        state_lat = round(float(state['latitude']), 6) if state['latitude'] else None
-                        state_lng = round(float(state['longitude']), 6) if state['longitude'] else None
-                        
-                        temp_conn.execute('''INSERT OR REPLACE INTO temp_regions 
-                            (id, name, country_code, longitude, latitude) 
-                            VALUES (?, ?, ?, ?, ?)''',
-                            (state_id, state_name, country_code, state_lng, state_lat))
-                        
+                        region_file.write(_copy_row(
+                            state_id, state['name'], country_code,
+                            _coordinate(state['longitude']), _coordinate(state['latitude']),
+                        ))
                         region_count += 1
-                        
+
                         # Process cities
                         if 'cities' in state and state['cities']:
                             for city in state['cities']:
-                                city_id = f"{state_id}-{city['id']}"
-                                city_name = city['name']
-                                city_lat = round(float(city['latitude']), 6) if city['latitude'] else None
-                                city_lng = round(float(city['longitude']), 6) if city['longitude'] else None
-                                
-                                temp_conn.execute('''INSERT OR REPLACE INTO temp_cities 
-                                    (id, name, region_id, longitude, latitude) 
-                                    VALUES (?, ?, ?, ?, ?)''',
-                                    (city_id, city_name, state_id, city_lng, city_lat))
-                                
+                                city_file.write(_copy_row(
+                                    f"{state_id}-{city['id']}", city['name'], state_id,
+                                    _coordinate(city['longitude']), _coordinate(city['latitude']),
+                                ))
                                 city_count += 1
                 else:
                     # Country without states - create default region
-                    state_id = f"{country_code}-00"
-                    temp_conn.execute('''INSERT OR REPLACE INTO temp_regions 
-                        (id, name, country_code, longitude, latitude) 
-                        VALUES (?, ?, ?, ?, ?)''',
-                        (state_id, country_name, country_code, None, None))
+                    region_file.write(_copy_row(f"{country_code}-00", country_name, country_code, None, None))
                     region_count += 1
 
-                # Commit periodically to avoid memory buildup
                 if country_count % 100 == 0:
-                    temp_conn.commit()
                     self.stdout.write(f'  Parsed {country_count} countries, {region_count} regions, {city_count} cities...')
 
-        temp_conn.commit()
         self.stdout.write(f'✓ Parsing complete: {country_count} countries, {region_count} regions, {city_count} cities')
 
-    def _process_countries_from_temp(self, temp_conn, batch_size):
-        """Process countries from temporary database"""
-        cursor = temp_conn.execute('SELECT country_code, name, subregion, capital, longitude, latitude FROM temp_countries')
-        
-        countries_to_create = []
-        countries_to_update = []
-        processed = 0
-        
-        while True:
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
-                break
-                
-            # Batch check for existing countries
-            country_codes_in_batch = [row[0] for row in rows]
-            existing_countries = {
-                c.country_code: c for c in 
-                Country.objects.filter(country_code__in=country_codes_in_batch)
-                .only('country_code', 'name', 'subregion', 'capital', 'longitude', 'latitude')
-            }
-            
-            for row in rows:
-                country_code, name, subregion, capital, longitude, latitude = row
-                
-                if country_code in existing_countries:
-                    # Update existing
-                    country_obj = existing_countries[country_code]
-                    country_obj.name = name
-                    country_obj.subregion = subregion
-                    country_obj.capital = capital
-                    country_obj.longitude = longitude
-                    country_obj.latitude = latitude
-                    countries_to_update.append(country_obj)
-                else:
-                    countries_to_create.append(Country(
-                        country_code=country_code,
-                        name=name,
-                        subregion=subregion,
-                        capital=capital,
-                        longitude=longitude,
-                        latitude=latitude
-                    ))
-                
-                processed += 1
-                
-            # Flush batches
-            if countries_to_create:
-                with transaction.atomic():
-                    Country.objects.bulk_create(countries_to_create, batch_size=batch_size, ignore_conflicts=True)
-                countries_to_create.clear()
-                
-            if countries_to_update:
-                with transaction.atomic():
-                    Country.objects.bulk_update(
-                        countries_to_update, 
-                        ['name', 'subregion', 'capital', 'longitude', 'latitude'],
-                        batch_size=batch_size
-                    )
-                countries_to_update.clear()
-                
-            if processed % 1000 == 0:
-                self.stdout.write(f'  Processed {processed} countries...')
-                gc.collect()
-        
-        # Final flush
-        if countries_to_create:
-            with transaction.atomic():
-                Country.objects.bulk_create(countries_to_create, batch_size=batch_size, ignore_conflicts=True)
-        if countries_to_update:
-            with transaction.atomic():
-                Country.objects.bulk_update(
-                    countries_to_update, 
-                    ['name', 'subregion', 'capital', 'longitude', 'latitude'],
-                    batch_size=batch_size
-                )
-        
-        self.stdout.write(f'✓ Countries complete: {processed} processed')
-
-    def _process_regions_from_temp(self, temp_conn, batch_size):
-        """Process regions from temporary database"""
-        # Get country mapping once
-        country_map = {c.country_code: c for c in Country.objects.only('id', 'country_code')}
-        
-        cursor = temp_conn.execute('SELECT id, name, country_code, longitude, latitude FROM temp_regions')
-        
-        regions_to_create = []
-        regions_to_update = []
-        processed = 0
-        
-        while True:
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
-                break
-                
-            # Batch check for existing regions
-            region_ids_in_batch = [row[0] for row in rows]
-            existing_regions = {
-                r.id: r for r in 
-                Region.objects.filter(id__in=region_ids_in_batch)
-                .select_related('country')
-                .only('id', 'name', 'country', 'longitude', 'latitude')
-            }
-            
-            for row in rows:
-                region_id, name, country_code, longitude, latitude = row
-                country_obj = country_map.get(country_code)
-                
-                if not country_obj:
-                    continue
-                    
-                if region_id in existing_regions:
-                    # Update existing
-                    region_obj = existing_regions[region_id]
-                    region_obj.name = name
-                    region_obj.country = country_obj
-                    region_obj.longitude = longitude
-                    region_obj.latitude = latitude
-                    regions_to_update.append(region_obj)
-                else:
-                    regions_to_create.append(Region(
-                        id=region_id,
-                        name=name,
-                        country=country_obj,
-                        longitude=longitude,
-                        latitude=latitude
-                    ))
-                
-                processed += 1
-                
-            # Flush batches
-            if regions_to_create:
-                with transaction.atomic():
-                    Region.objects.bulk_create(regions_to_create, batch_size=batch_size, ignore_conflicts=True)
-                regions_to_create.clear()
-                
-            if regions_to_update:
-                with transaction.atomic():
-                    Region.objects.bulk_update(
-                        regions_to_update, 
-                        ['name', 'country', 'longitude', 'latitude'],
-                        batch_size=batch_size
-                    )
-                regions_to_update.clear()
-                
-            if processed % 2000 == 0:
-                self.stdout.write(f'  Processed {processed} regions...')
-                gc.collect()
-        
-        # Final flush
-        if regions_to_create:
-            with transaction.atomic():
-                Region.objects.bulk_create(regions_to_create, batch_size=batch_size, ignore_conflicts=True)
-        if regions_to_update:
-            with transaction.atomic():
-                Region.objects.bulk_update(
-                    regions_to_update, 
-                    ['name', 'country', 'longitude', 'latitude'],
-                    batch_size=batch_size
-                )
-        
-        self.stdout.write(f'✓ Regions complete: {processed} processed')
-
-    def _process_cities_from_temp(self, temp_conn, batch_size):
-        """Process cities from temporary database with optimized existence checking"""
-        # Get region mapping once
-        region_map = {r.id: r for r in Region.objects.only('id')}
-        
-        cursor = temp_conn.execute('SELECT id, name, region_id, longitude, latitude FROM temp_cities')
-        
-        cities_to_create = []
-        cities_to_update = []
-        processed = 0
-        
-        while True:
-            rows = cursor.fetchmany(batch_size)
-            if not rows:
-                break
-                
-            # Fast existence check - only get IDs, no objects
-            city_ids_in_batch = [row[0] for row in rows]
-            existing_city_ids = set(
-                City.objects.filter(id__in=city_ids_in_batch)
-                .values_list('id', flat=True)
-            )
-            
-            for row in rows:
-                city_id, name, region_id, longitude, latitude = row
-                region_obj = region_map.get(region_id)
-                
-                if not region_obj:
-                    continue
-                    
-                if city_id in existing_city_ids:
-                    # For updates, just store the data - we'll do bulk update by raw SQL
-                    cities_to_update.append({
-                        'id': city_id,
-                        'name': name,
-                        'region_id': region_obj.id,
-                        'longitude': longitude,
-                        'latitude': latitude
-                    })
-                else:
-                    cities_to_create.append(City(
-                        id=city_id,
-                        name=name,
-                        region=region_obj,
-                        longitude=longitude,
-                        latitude=latitude
-                    ))
-                
-                processed += 1
-                
-            # Flush create batch (this is already fast)
-            if cities_to_create:
-                with transaction.atomic():
-                    City.objects.bulk_create(cities_to_create, batch_size=batch_size, ignore_conflicts=True)
-                cities_to_create.clear()
-                
-            # Flush update batch with raw SQL for speed
-            if cities_to_update:
-                self._bulk_update_cities_raw(cities_to_update)
-                cities_to_update.clear()
-                
-            if processed % 5000 == 0:
-                self.stdout.write(f'  Processed {processed} cities...')
-                gc.collect()
-        
-        # Final flush
-        if cities_to_create:
-            with transaction.atomic():
-                City.objects.bulk_create(cities_to_create, batch_size=batch_size, ignore_conflicts=True)
-        if cities_to_update:
-            self._bulk_update_cities_raw(cities_to_update)
-        
-        self.stdout.write(f'✓ Cities complete: {processed} processed')
-
-    def _bulk_update_cities_raw(self, cities_data):
-        """Fast bulk update using raw SQL"""
-        if not cities_data:
-            return
-            
-        from django.db import connection
-        
+    def _copy_into_stage_tables(self, spool_files):
+        columns = {
+            STAGE_COUNTRY_TABLE: 'country_code, name, subregion, capital, longitude, latitude',
+            STAGE_REGION_TABLE: 'id, name, country_code, longitude, latitude',
+            STAGE_CITY_TABLE: 'id, name, region_id, longitude, latitude',
+        }
         with connection.cursor() as cursor:
-            # Build the SQL for bulk update
-            # Using CASE statements for efficient bulk updates
-            when_clauses_name = []
-            when_clauses_region = []
-            when_clauses_lng = []
-            when_clauses_lat = []
-            city_ids = []
-            
-            for city in cities_data:
-                city_id = city['id']
-                city_ids.append(city_id)
-                when_clauses_name.append(f"WHEN id = %s THEN %s")
-                when_clauses_region.append(f"WHEN id = %s THEN %s")
-                when_clauses_lng.append(f"WHEN id = %s THEN %s")
-                when_clauses_lat.append(f"WHEN id = %s THEN %s")
-            
-            # Build parameters list
-            params = []
-            for city in cities_data:
-                params.extend([city['id'], city['name']])  # for name
-            for city in cities_data:
-                params.extend([city['id'], city['region_id']])  # for region_id
-            for city in cities_data:
-                params.extend([city['id'], city['longitude']])  # for longitude
-            for city in cities_data:
-                params.extend([city['id'], city['latitude']])  # for latitude
-            params.extend(city_ids)  # for WHERE clause
-            
-            # Execute the bulk update
-            sql = f"""
-                UPDATE worldtravel_city 
-                SET 
-                    name = CASE {' '.join(when_clauses_name)} END,
-                    region_id = CASE {' '.join(when_clauses_region)} END,
-                    longitude = CASE {' '.join(when_clauses_lng)} END,
-                    latitude = CASE {' '.join(when_clauses_lat)} END
-                WHERE id IN ({','.join(['%s'] * len(city_ids))})
-            """
-            
-            cursor.execute(sql, params)
-
-    def _cleanup_obsolete_records(self, temp_conn):
-        """Clean up obsolete records using temporary database"""
-        # Get IDs from temp database to avoid loading large lists into memory
-        temp_country_codes = {row[0] for row in temp_conn.execute('SELECT country_code FROM temp_countries')}
-        temp_region_ids = {row[0] for row in temp_conn.execute('SELECT id FROM temp_regions')}
-        temp_city_ids = {row[0] for row in temp_conn.execute('SELECT id FROM temp_cities')}
-        
-        with transaction.atomic():
-            countries_deleted = Country.objects.exclude(country_code__in=temp_country_codes).count()
-            regions_deleted = Region.objects.exclude(id__in=temp_region_ids).count()
-            cities_deleted = City.objects.exclude(id__in=temp_city_ids).count()
-            
-            Country.objects.exclude(country_code__in=temp_country_codes).delete()
-            Region.objects.exclude(id__in=temp_region_ids).delete()
-            City.objects.exclude(id__in=temp_city_ids).delete()
-            
-            if countries_deleted > 0 or regions_deleted > 0 or cities_deleted > 0:
-                self.stdout.write(f'✓ Deleted {countries_deleted} obsolete countries, {regions_deleted} regions, {cities_deleted} cities')
-            else:
-                self.stdout.write('✓ No obsolete records found to delete')
\ No newline at end of file
+            for table, f in spool_files.items():
+                f.seek(0)
+                cursor.copy_expert(f'COPY {table} ({columns[table]}) FROM STDIN', f, size=1024 * 1024)
+                cursor.execute(f'ANALYZE {table}')
+
+            # Drop staged rows whose parent is not part of the dataset so the
+            # merge and the obsolete-record anti-joins agree on what exists.
+            cursor.execute(f'''
+                DELETE FROM {STAGE_REGION_TABLE} s
+                WHERE NOT EXISTS (SELECT 1 FROM {STAGE_COUNTRY_TABLE} c WHERE c.country_code = s.country_code)
+            ''')
+            cursor.execute(f'''
+                DELETE FROM {STAGE_CITY_TABLE} s
+                WHERE NOT EXISTS (SELECT 1 FROM {STAGE_REGION_TABLE} r WHERE r.id = s.region_id)
+            ''')
+
+    def _merge_stage_tables(self):
+        """
+        Upsert staged rows into the live tables, touching only rows that changed.
+        Returns the staged counts and the number of rows inserted or updated.
+        """
+        country_table = Country._meta.db_table
+        region_table = Region._meta.db_table
+        city_table = City._meta.db_table
+
+        changed = 0
+        with connection.cursor() as cursor:
+            # DISTINCT ON keeps the last occurrence of a duplicated key, like the source order implies.
+            cursor.execute(f'''
+                INSERT INTO {country_table} (country_code, name, subregion, capital, longitude, latitude)
+                SELECT DISTINCT ON (country_code) country_code, name, subregion, capital, longitude, latitude
+                FROM {STAGE_COUNTRY_TABLE}
+                ORDER BY country_code, seq DESC
+                ON CONFLICT (country_code) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    subregion = EXCLUDED.subregion,
+                    capital = EXCLUDED.capital,
+                    longitude = EXCLUDED.longitude,
+                    latitude = EXCLUDED.latitude
+                WHERE ({country_table}.name, {country_table}.subregion, {country_table}.capital,
+                       {country_table}.longitude, {country_table}.latitude)
+                    IS DISTINCT FROM
+                      (EXCLUDED.name, EXCLUDED.subregion, EXCLUDED.capital, EXCLUDED.longitude, EXCLUDED.latitude)
+            ''')
+            changed += cursor.rowcount
+            self.stdout.write(f'✓ Countries complete: {cursor.rowcount} inserted or updated')
+
+            cursor.execute(f'''
+                INSERT INTO {region_table} (id, name, country_id, longitude, latitude)
+                SELECT DISTINCT ON (s.id) s.id, s.name, c.id, s.longitude, s.latitude
+                FROM {STAGE_REGION_TABLE} s
+                JOIN {country_table} c ON c.country_code = s.country_code
+                ORDER BY s.id, s.seq DESC
+                ON CONFLICT (id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    country_id = EXCLUDED.country_id,
+                    longitude = EXCLUDED.longitude,
+                    latitude = EXCLUDED.latitude
+                WHERE ({region_table}.name, {region_table}.country_id, {region_table}.longitude, {region_table}.latitude)
+                    IS DISTINCT FROM
+                      (EXCLUDED.name, EXCLUDED.country_id, EXCLUDED.longitude, EXCLUDED.latitude)
+            ''')
+            changed += cursor.rowcount
+            self.stdout.write(f'✓ Regions complete: {cursor.rowcount} inserted or updated')
+
+            cursor.execute(f'''
+                INSERT INTO {city_table} (id, name, region_id, longitude, latitude)
+                SELECT DISTINCT ON (id) id, name, region_id, longitude, latitude
+                FROM {STAGE_CITY_TABLE}
+                ORDER BY id, seq DESC
+                ON CONFLICT (id) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    region_id = EXCLUDED.region_id,
+                    longitude = EXCLUDED.longitude,
+                    latitude = EXCLUDED.latitude
+                WHERE ({city_table}.name, {city_table}.region_id, {city_table}.longitude, {city_table}.latitude)
+                    IS DISTINCT FROM
+                      (EXCLUDED.name, EXCLUDED.region_id, EXCLUDED.longitude, EXCLUDED.latitude)
+            ''')
+            changed += cursor.rowcount
+            self.stdout.write(f'✓ Cities complete: {cursor.rowcount} inserted or updated')
+
+            cursor.execute(f'''
+                SELECT
+                    (SELECT COUNT(DISTINCT country_code) FROM {STAGE_COUNTRY_TABLE}),
+                    (SELECT COUNT(DISTINCT id) FROM {STAGE_REGION_TABLE}),
+                    (SELECT COUNT(DISTINCT id) FROM {STAGE_CITY_TABLE})
+            ''')
+            countries, regions, cities = cursor.fetchone()
+
+        return {'countries': countries, 'regions': regions, 'cities': cities}, changed
+
+    def _delete_obsolete_records(self):
+        """
+        Delete countries, regions and cities that are no longer in the dataset.
+        Django's on_delete behaviour is applied in SQL: locations pointing at a
+        removed row are set to NULL and visited entries for it are deleted.
+        Returns the number of countries, regions and cities deleted.
+        """
+        country_table = Country._meta.db_table
+        region_table = Region._meta.db_table
+        city_table = City._meta.db_table
+        location_table = Location._meta.db_table
+        visited_region_table = VisitedRegion._meta.db_table
+        visited_city_table = VisitedCity._meta.db_table
+
+        obsolete_cities = f'''
+            SELECT c.id FROM {city_table} c
+            WHERE NOT EXISTS (SELECT 1 FROM {STAGE_CITY_TABLE} s WHERE s.id = c.id)
+        '''
+        obsolete_regions = f'''
+            SELECT r.id FROM {region_table} r
+            WHERE NOT EXISTS (SELECT 1 FROM {STAGE_REGION_TABLE} s WHERE s.id = r.id)
+        '''
+        obsolete_countries = f'''
+            SELECT c.id FROM {country_table} c
+            WHERE NOT EXISTS (SELECT 1 FROM {STAGE_COUNTRY_TABLE} s WHERE s.country_code = c.country_code)
+        '''
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {location_table} SET city_id = NULL WHERE city_id IN ({obsolete_cities})')
+            cursor.execute(f'DELETE FROM {visited_city_table} WHERE city_id IN ({obsolete_cities})')
+            cursor.execute(f'DELETE FROM {city_table} WHERE id IN ({obsolete_cities})')
+            cities_deleted = cursor.rowcount
+
+            cursor.execute(f'UPDATE {location_table} SET region_id = NULL WHERE region_id IN ({obsolete_regions})')
+            cursor.execute(f'DELETE FROM {visited_region_table} WHERE region_id IN ({obsolete_regions})')
+            cursor.execute(f'DELETE FROM {region_table} WHERE id IN ({obsolete_regions})')
+            regions_deleted = cursor.rowcount
+
+            cursor.execute(f'UPDATE {location_table} SET country_id = NULL WHERE country_id IN ({obsolete_countries})')
+            cursor.execute(f'DELETE FROM {country_table} WHERE id IN ({obsolete_countries})')
+            countries_deleted = cursor.rowcount
+
+        if countries_deleted > 0 or regions_deleted > 0 or cities_deleted > 0:
+            self.stdout.write(f'✓ Deleted {countries_deleted} obsolete countries, {regions_deleted} regions, {cities_deleted} cities')
+        else:
+            self.stdout.write('✓ No obsolete records found to delete')
+        return countries_deleted + regions_deleted + cities_deleted
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worldtravel', '0018_rename_user_id_visitedcity_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorldDataImport',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('source_version', models.CharField(max_length=50)),
+                ('source_hash', models.CharField(max_length=64)),
+                ('countries', models.PositiveIntegerField(default=0)),
+                ('regions', models.PositiveIntegerField(default=0)),
+                ('cities', models.PositiveIntegerField(default=0)),
+                ('imported_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'World Data Import',
+                'verbose_name_plural': 'World Data Imports',
+                'get_latest_by': 'imported_at',
+            },
+        ),
+    ]
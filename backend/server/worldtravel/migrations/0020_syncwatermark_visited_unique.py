@@ -0,0 +1,48 @@
+# Generated by Django 5.2.11 on 2026-10-17 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('worldtravel', '0019_worlddataimport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncWatermark',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('value', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sync Watermark',
+                'verbose_name_plural': 'Sync Watermarks',
+            },
+        ),
+        # Drop duplicate visits left by earlier racing inserts, keeping the oldest row
+        migrations.RunSQL(
+            """
+            DELETE FROM worldtravel_visitedregion a
+            USING worldtravel_visitedregion b
+            WHERE a.user_id = b.user_id AND a.region_id = b.region_id AND a.id > b.id;
+            DELETE FROM worldtravel_visitedcity a
+            USING worldtravel_visitedcity b
+            WHERE a.user_id = b.user_id AND a.city_id = b.city_id AND a.id > b.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='visitedcity',
+            constraint=models.UniqueConstraint(fields=('user', 'city'), name='unique_visited_city_per_user'),
+        ),
+        migrations.AddConstraint(
+            model_name='visitedregion',
+            constraint=models.UniqueConstraint(fields=('user', 'region'), name='unique_visited_region_per_user'),
+        ),
+    ]
@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.contrib.gis.db import models as gis_models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db.models.functions import Upper
 
 
 User = get_user_model()
@@ -32,6 +34,12 @@ class Region(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Trigram index serving name__icontains (UPPER(name) LIKE ...)
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='region_name_trgm'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -44,6 +52,10 @@ class City(models.Model):
 
     class Meta:
         verbose_name_plural = "Cities"
+        indexes = [
+            # Trigram index serving name__icontains (UPPER(name) LIKE ...)
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='city_name_trgm'),
+        ]
 
     def __str__(self):
         return self.name
@@ -62,6 +74,11 @@ class VisitedRegion(models.Model):
             raise ValidationError("Region already visited by user.")
         super().save(*args, **kwargs)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'region'], name='unique_visited_region_per_user'),
+        ]
+
 class VisitedCity(models.Model):
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(
@@ -77,4 +94,39 @@ class VisitedCity(models.Model):
         super().save(*args, **kwargs)
 
     class Meta:
-        verbose_name_plural = "Visited Cities"
\ No newline at end of file
+        verbose_name_plural = "Visited Cities"
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'city'], name='unique_visited_city_per_user'),
+        ]
+
+class WorldDataImport(models.Model):
+    """Record of a successful countries/regions/cities import, used to skip unchanged re-imports"""
+    id = models.AutoField(primary_key=True)
+    source_version = models.CharField(max_length=50)
+    source_hash = models.CharField(max_length=64)
+    countries = models.PositiveIntegerField(default=0)
+    regions = models.PositiveIntegerField(default=0)
+    cities = models.PositiveIntegerField(default=0)
+    imported_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "World Data Import"
+        verbose_name_plural = "World Data Imports"
+        get_latest_by = 'imported_at'
+
+    def __str__(self):
+        return f'{self.source_version} ({self.source_hash[:12]}) imported {self.imported_at}'
+
+class SyncWatermark(models.Model):
+    """Point in time up to which a periodic job has processed changes"""
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Sync Watermark"
+        verbose_name_plural = "Sync Watermarks"
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
@@ -17,10 +17,16 @@ class CountrySerializer(serializers.ModelSerializer):
         return public_url + '/media/' + 'flags/' + obj.country_code.lower() + '.png'
     
     def get_num_regions(self, obj):
+        # Prefer the count annotated by the queryset
+        if hasattr(obj, 'num_regions'):
+            return obj.num_regions
         # get the number of regions in the country
         return Region.objects.filter(country=obj).count()
     
     def get_num_visits(self, obj):
+        if hasattr(obj, 'num_visits'):
+            return obj.num_visits
+
         request = self.context.get('request')
         user = getattr(request, 'user', None)
         
@@ -44,6 +50,8 @@ class RegionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'country', 'longitude', 'latitude', 'num_cities', 'country_name']
 
     def get_num_cities(self, obj):
+        if hasattr(obj, 'num_cities'):
+            return obj.num_cities
         return City.objects.filter(region=obj).count()
 
 class CitySerializer(serializers.ModelSerializer):
@@ -0,0 +1,334 @@
+"""
+Offline reverse geocoding for AdventureLog.
+
+Builds an in-process nearest-neighbour index over the worldtravel City and
+Region tables (plus optional region boundary files on disk) so a coordinate
+can be resolved to a country, region and city without calling Nominatim or
+Google.
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from worldtravel.models import City, Region
+from worldtravel.utils import get_world_data_version
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# How often (seconds) a built index checks whether the world data was re-imported.
+VERSION_CHECK_INTERVAL = 60
+
+# Size (degrees) of the grid cells used to bucket boundary polygons.
+BOUNDARY_CELL_SIZE = 5
+
+
+def _to_unit_vector(lat, lon):
+    lat_r = math.radians(lat)
+    lon_r = math.radians(lon)
+    cos_lat = math.cos(lat_r)
+    return (cos_lat * math.cos(lon_r), cos_lat * math.sin(lon_r), math.sin(lat_r))
+
+
+def _km_to_chord_squared(km):
+    """Convert a great-circle distance to the squared chord length on the unit sphere."""
+    chord = 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+    return chord * chord
+
+
+def _chord_squared_to_km(chord_squared):
+    return 2 * math.asin(min(1.0, math.sqrt(chord_squared) / 2)) * EARTH_RADIUS_KM
+
+
+class PointIndex:
+    """
+    Static k-d tree over points on the unit sphere.
+
+    Points are stored as 3D unit vectors so that the euclidean (chord) distance
+    is monotonic with the great-circle distance and there is no antimeridian or
+    pole special-casing. The tree is implicit: every slice of `self.points` is
+    a node whose median element splits the slice on the node's axis.
+    """
+
+    def __init__(self, entries):
+        # entries: iterable of (lat, lon, payload)
+        points = [(*_to_unit_vector(float(lat), float(lon)), payload) for lat, lon, payload in entries]
+        self._build(points, 0, len(points), 0)
+        self.points = points
+
+    def __len__(self):
+        return len(self.points)
+
+    def _build(self, points, lo, hi, axis):
+        if hi - lo <= 1:
+            return
+        points[lo:hi] = sorted(points[lo:hi], key=lambda p: p[axis])
+        mid = (lo + hi) // 2
+        next_axis = (axis + 1) % 3
+        self._build(points, lo, mid, next_axis)
+        self._build(points, mid + 1, hi, next_axis)
+
+    def nearest(self, lat, lon, max_km=None):
+        """
+        Return (payload, distance_km) of the closest point, or None when the
+        index is empty or nothing lies within `max_km`.
+        """
+        if not self.points:
+            return None
+        target = _to_unit_vector(lat, lon)
+        limit = _km_to_chord_squared(max_km) if max_km is not None else float('inf')
+        best = [limit, -1]
+        self._search(0, len(self.points), 0, target, best)
+        if best[1] < 0:
+            return None
+        return self.points[best[1]][3], _chord_squared_to_km(best[0])
+
+    def _search(self, lo, hi, axis, target, best):
+        if lo >= hi:
+            return
+        mid = (lo + hi) // 2
+        point = self.points[mid]
+        dx = target[0] - point[0]
+        dy = target[1] - point[1]
+        dz = target[2] - point[2]
+        distance = dx * dx + dy * dy + dz * dz
+        if distance < best[0]:
+            best[0] = distance
+            best[1] = mid
+
+        diff = target[axis] - point[axis]
+        next_axis = (axis + 1) % 3
+        if diff < 0:
+            self._search(lo, mid, next_axis, target, best)
+            if diff * diff < best[0]:
+                self._search(mid + 1, hi, next_axis, target, best)
+        else:
+            self._search(mid + 1, hi, next_axis, target, best)
+            if diff * diff < best[0]:
+                self._search(lo, mid, next_axis, target, best)
+
+
+def _point_in_ring(lon, lat, ring):
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _point_in_polygon(lon, lat, polygon):
+    # polygon: [outer_ring, hole_ring, ...] as in GeoJSON
+    if not polygon or not _point_in_ring(lon, lat, polygon[0]):
+        return False
+    return not any(_point_in_ring(lon, lat, hole) for hole in polygon[1:])
+
+
+class BoundaryIndex:
+    """
+    Region boundary polygons loaded from GeoJSON files, bucketed into a coarse
+    lat/lon grid by bounding box so a lookup only tests nearby polygons.
+
+    Each feature must carry the region's ISO 3166-2 code (matching `Region.id`)
+    in a `region_id`, `iso_3166_2` or `ISO3166-2` property.
+    """
+
+    REGION_PROPERTIES = ('region_id', 'iso_3166_2', 'ISO3166-2')
+
+    def __init__(self):
+        self.polygons = []  # (region_id, (min_lon, min_lat, max_lon, max_lat), polygon)
+        self.grid = {}
+
+    def __len__(self):
+        return len(self.polygons)
+
+    @classmethod
+    def from_directory(cls, directory, known_region_ids):
+        index = cls()
+        if not directory or not os.path.isdir(directory):
+            return index
+
+        for filename in sorted(os.listdir(directory)):
+            if not filename.lower().endswith(('.geojson', '.json')):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping boundary file {path}: {e}")
+                continue
+
+            features = data.get('features', []) if data.get('type') == 'FeatureCollection' else [data]
+            for feature in features:
+                properties = feature.get('properties') or {}
+                region_id = next((properties[key] for key in cls.REGION_PROPERTIES if properties.get(key)), None)
+                if region_id not in known_region_ids:
+                    continue
+                geometry = feature.get('geometry') or {}
+                if geometry.get('type') == 'Polygon':
+                    index.add(region_id, geometry['coordinates'])
+                elif geometry.get('type') == 'MultiPolygon':
+                    for polygon in geometry['coordinates']:
+                        index.add(region_id, polygon)
+        return index
+
+    def add(self, region_id, polygon):
+        if not polygon or not polygon[0]:
+            return
+        lons = [point[0] for point in polygon[0]]
+        lats = [point[1] for point in polygon[0]]
+        bbox = (min(lons), min(lats), max(lons), max(lats))
+        position = len(self.polygons)
+        self.polygons.append((region_id, bbox, polygon))
+
+        for cell_lon in range(math.floor(bbox[0] / BOUNDARY_CELL_SIZE), math.floor(bbox[2] / BOUNDARY_CELL_SIZE) + 1):
+            for cell_lat in range(math.floor(bbox[1] / BOUNDARY_CELL_SIZE), math.floor(bbox[3] / BOUNDARY_CELL_SIZE) + 1):
+                self.grid.setdefault((cell_lon, cell_lat), []).append(position)
+
+    def region_at(self, lat, lon):
+        cell = (math.floor(lon / BOUNDARY_CELL_SIZE), math.floor(lat / BOUNDARY_CELL_SIZE))
+        for position in self.grid.get(cell, ()):
+            region_id, bbox, polygon = self.polygons[position]
+            if not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                continue
+            if _point_in_polygon(lon, lat, polygon):
+                return region_id
+        return None
+
+
+class OfflineReverseGeocoder:
+    """Resolves coordinates to (country, region, city) from local data only."""
+
+    def __init__(self, regions, cities, city_radius_km, region_radius_km, boundaries=None):
+        """
+        regions: (id, name, country name, country code, lat, lon) rows; lat/lon may be None
+        cities: (id, name, region id, lat, lon) rows with coordinates
+        boundaries: BoundaryIndex of region polygons, optional
+        """
+        self.city_radius_km = city_radius_km
+        self.region_radius_km = region_radius_km
+
+        regions = list(regions)
+        # region_id -> (name, country name, country code)
+        self.regions = {
+            region_id: (name, country_name, country_code)
+            for region_id, name, country_name, country_code, _, _ in regions
+        }
+        self.region_points = PointIndex(
+            (lat, lon, region_id)
+            for region_id, _, _, _, lat, lon in regions
+            if lat is not None and lon is not None
+        )
+        self.city_points = PointIndex(
+            (lat, lon, (city_id, name, region_id)) for city_id, name, region_id, lat, lon in cities
+        )
+        self.boundaries = boundaries if boundaries is not None else BoundaryIndex()
+
+    def lookup(self, lat, lon):
+        """
+        Return a dict with `region_id`, `region`, `country`, `country_id`,
+        `city_id` and `city` (the latter two may be None), or None when the
+        point cannot be resolved locally.
+        """
+        lat = float(lat)
+        lon = float(lon)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return None
+
+        region_id = self.boundaries.region_at(lat, lon)
+
+        city = None
+        nearest_city = self.city_points.nearest(lat, lon, self.region_radius_km)
+        if nearest_city:
+            (city_id, city_name, city_region_id), distance_km = nearest_city
+            # A boundary match is authoritative; only keep a city that lies inside it.
+            if region_id is None or city_region_id == region_id:
+                if region_id is None:
+                    region_id = city_region_id
+                if distance_km <= self.city_radius_km:
+                    city = (city_id, city_name)
+
+        if region_id is None:
+            nearest_region = self.region_points.nearest(lat, lon, self.region_radius_km)
+            if nearest_region:
+                region_id = nearest_region[0]
+
+        region = self.regions.get(region_id)
+        if not region:
+            return None
+
+        region_name, country_name, country_code = region
+        return {
+            'region_id': region_id,
+            'region': region_name,
+            'country': country_name,
+            'country_id': country_code,
+            'city_id': city[0] if city else None,
+            'city': city[1] if city else None,
+        }
+
+
+def build_offline_geocoder(city_radius_km, region_radius_km, boundaries_dir=None):
+    """Build the geocoder from the Region and City tables and the boundary files in `boundaries_dir`."""
+    started = time.monotonic()
+    regions = Region.objects.values_list(
+        'id', 'name', 'country__name', 'country__country_code', 'latitude', 'longitude'
+    ).iterator(chunk_size=2000)
+    cities = City.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).values_list('id', 'name', 'region_id', 'latitude', 'longitude').iterator(chunk_size=5000)
+    geocoder = OfflineReverseGeocoder(regions, cities, city_radius_km, region_radius_km)
+    geocoder.boundaries = BoundaryIndex.from_directory(boundaries_dir, geocoder.regions)
+    logger.info(
+        f"Offline geocoder index built in {time.monotonic() - started:.2f}s: "
+        f"{len(geocoder.city_points)} cities, {len(geocoder.region_points)} regions, "
+        f"{len(geocoder.boundaries)} boundary polygons"
+    )
+    return geocoder
+
+
+_geocoder = None
+_geocoder_version = None
+_geocoder_checked_at = 0.0
+_geocoder_lock = threading.Lock()
+
+
+def get_offline_geocoder():
+    """
+    Return the process-wide offline geocoder, building it on first use and
+    rebuilding it when `download-countries` has imported new world data.
+    """
+    global _geocoder, _geocoder_version, _geocoder_checked_at
+
+    now = time.monotonic()
+    if _geocoder is not None and now - _geocoder_checked_at < VERSION_CHECK_INTERVAL:
+        return _geocoder
+
+    with _geocoder_lock:
+        version = get_world_data_version()
+        _geocoder_checked_at = time.monotonic()
+        if _geocoder is None or version != _geocoder_version:
+            _geocoder = build_offline_geocoder(
+                city_radius_km=settings.OFFLINE_GEOCODER_CITY_RADIUS_KM,
+                region_radius_km=settings.OFFLINE_GEOCODER_REGION_RADIUS_KM,
+                boundaries_dir=settings.OFFLINE_GEOCODER_BOUNDARIES_DIR,
+            )
+            _geocoder_version = version
+        return _geocoder
+
+
+def invalidate_offline_geocoder():
+    """Drop the in-process index so the next lookup rebuilds it."""
+    global _geocoder
+    with _geocoder_lock:
+        _geocoder = None
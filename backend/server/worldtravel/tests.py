@@ -1,3 +1,182 @@
-from django.test import TestCase
+import importlib
+import io
+import math
+import random
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from users.models import CustomUser
+from .models import Country, Region, VisitedRegion
+from .spatial_index import BoundaryIndex, OfflineReverseGeocoder, PointIndex
+from .typeahead_index import CITY, TypeaheadIndex
+
+download_countries = importlib.import_module('worldtravel.management.commands.download-countries')
+
+
+class TypeaheadIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.index = TypeaheadIndex(
+            [(1, 'France', 'FR', 0), (2, 'United States', 'US', 0)],
+            [('FR-ARA', 'Auvergne-Rhône-Alpes', 1, 0), ('US-NY', 'New York', 2, 5)],
+            [
+                ('FR-1', 'Saint-Étienne', 'FR-ARA', 0),
+                ('FR-2', 'Saint-Priest', 'FR-ARA', 3),
+                ('US-1', 'New York City', 'US-NY', 9),
+                ('US-2', 'Newark', 'US-NY', 0),
+            ],
+        )
+
+    def _names(self, text, **kwargs):
+        return [self.index.describe(position)['name'] for position, _ in self.index.search(text, **kwargs)]
+
+    def test_001_prefix_matches_ignore_case_accents_and_word_position(self):
+        self.assertEqual(self._names('saint e'), ['Saint-Étienne'])
+        self.assertEqual(self._names('ETIEN'), ['Saint-Étienne'])
+        self.assertEqual(self._names('york'), ['New York City', 'New York'])
+
+    def test_002_visited_exact_and_popular_places_rank_first(self):
+        self.assertEqual(self._names('new'), ['New York City', 'New York', 'Newark'])
+        self.assertEqual(self._names('new york'), ['New York', 'New York City'])
+
+        visited = self.index.visited_positions([], ['US-2'])
+        self.assertEqual(self._names('new', visited=visited), ['Newark', 'New York City', 'New York'])
+        self.assertEqual(self._names('united', visited=visited), ['United States'])
+        self.assertTrue(self.index.search('united', visited=visited)[0][1])
+
+    def test_003_filters_and_description(self):
+        self.assertEqual(self._names('saint', kinds={CITY}, country_code='us'), [])
+        self.assertEqual(self._names('saint', kinds={CITY}, country_code='fr'), ['Saint-Priest', 'Saint-Étienne'])
+        self.assertEqual(self._names('s', region_id='FR-ARA', limit=1), ['Saint-Priest'])
+        position, _ = self.index.search('newark')[0]
+        self.assertEqual(self.index.describe(position), {
+            'type': 'city', 'id': 'US-2', 'name': 'Newark', 'region_id': 'US-NY', 'region': 'New York',
+            'country_code': 'US', 'country': 'United States', 'visited': False,
+        })
+
+
+def _great_circle_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(a))
+
+
+def _box(min_lon, min_lat, max_lon, max_lat):
+    return [[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]]
+
+
+class SpatialIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        rng = random.Random(7)
+        self.points = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(300)]
+        # Clusters on both sides of the antimeridian and around the poles
+        self.points += [(rng.uniform(-5, 5), rng.choice((179.5, -179.5)) + rng.uniform(-0.5, 0.5)) for _ in range(20)]
+        self.points += [(rng.choice((89.5, -89.5)) + rng.uniform(-0.5, 0.5), rng.uniform(-180, 180)) for _ in range(20)]
+        self.index = PointIndex((lat, lon, i) for i, (lat, lon) in enumerate(self.points))
+
+        boundaries = BoundaryIndex()
+        # Auvergne-Rhône-Alpes with Geneva cut out as a hole
+        boundaries.add('FR-ARA', [_box(2.0, 44.1, 7.2, 46.5), _box(5.95, 46.13, 6.2, 46.37)])
+        boundaries.add('CH-GE', [_box(5.95, 46.13, 6.2, 46.37)])
+        self.geocoder = OfflineReverseGeocoder(
+            [
+                ('FR-ARA', 'Auvergne-Rhône-Alpes', 'France', 'FR', 45.5, 4.5),
+                ('FR-IDF', 'Île-de-France', 'France', 'FR', 48.7, 2.5),
+                ('CH-GE', 'Geneva', 'Switzerland', 'CH', 46.2, 6.1),
+                ('IT-25', 'Lombardy', 'Italy', 'IT', 45.6, 9.8),
+            ],
+            [
+                ('FR-1', 'Lyon', 'FR-ARA', 45.76, 4.84),
+                ('FR-2', 'Annemasse', 'FR-ARA', 46.19, 6.24),
+                ('FR-3', 'Paris', 'FR-IDF', 48.86, 2.35),
+                ('CH-1', 'Geneva', 'CH-GE', 46.16, 6.18),
+            ],
+            city_radius_km=10,
+            region_radius_km=100,
+            boundaries=boundaries,
+        )
+
+    def _brute_force(self, lat, lon):
+        return min(
+            (_great_circle_km(lat, lon, point_lat, point_lon), i)
+            for i, (point_lat, point_lon) in enumerate(self.points)
+        )
+
+    def _lookup(self, lat, lon):
+        result = self.geocoder.lookup(lat, lon)
+        return result and (result['region_id'], result['city'])
+
+    def test_001_nearest_matches_brute_force(self):
+        rng = random.Random(11)
+        queries = [(0.2, 179.99), (-3.0, -179.99), (0.0, 180.0), (89.99, 10.0), (-89.9, -170.0), (90.0, 0.0)]
+        queries += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(200)]
+        for lat, lon in queries:
+            payload, distance = self.index.nearest(lat, lon)
+            expected_distance, expected = self._brute_force(lat, lon)
+            self.assertEqual(payload, expected, (lat, lon))
+            self.assertAlmostEqual(distance, expected_distance, delta=1e-3)
+
+    def test_002_nearest_respects_max_distance(self):
+        lat, lon = 0.0, -179.9
+        expected_distance, expected = self._brute_force(lat, lon)
+        self.assertEqual(self.index.nearest(lat, lon, max_km=expected_distance + 1)[0], expected)
+        self.assertIsNone(self.index.nearest(lat, lon, max_km=expected_distance / 2))
+        self.assertIsNone(PointIndex([]).nearest(lat, lon))
+
+    def test_003_geocoder_uses_containing_boundary(self):
+        self.assertEqual(self._lookup(45.75, 4.85), ('FR-ARA', 'Lyon'))
+        # Inside the hole of FR-ARA, so in Geneva
+        self.assertEqual(self._lookup(46.17, 6.15), ('CH-GE', 'Geneva'))
+        # Geneva's city center is the nearest city, but the point lies in France
+        self.assertEqual(self._lookup(46.15, 6.21), ('FR-ARA', None))
+        self.assertEqual(self.geocoder.lookup(45.75, 4.85), {
+            'region_id': 'FR-ARA', 'region': 'Auvergne-Rhône-Alpes', 'country': 'France', 'country_id': 'FR',
+            'city_id': 'FR-1', 'city': 'Lyon',
+        })
+
+    def test_004_geocoder_falls_back_outside_boundaries(self):
+        # No polygon: the nearest city decides the region
+        self.assertEqual(self._lookup(48.85, 2.36), ('FR-IDF', 'Paris'))
+        self.assertEqual(self._lookup(48.4, 2.7), ('FR-IDF', None))
+        # No city within range: the nearest region center
+        self.assertEqual(self._lookup(45.6, 9.9), ('IT-25', None))
+        # Nothing within range, or not a coordinate
+        self.assertIsNone(self._lookup(0.0, -30.0))
+        self.assertIsNone(self._lookup(91.0, 0.0))
+
+
+@override_settings(
+    RESPONSE_CACHE_ENABLED=True,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class WorldDataImportTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='testuser', email='testuser@example.com', password='testpassword')
+        self.client.force_authenticate(self.user)
+        country = Country.objects.create(name='France', country_code='FR')
+        Region.objects.create(id='FR-ARA', name='Auvergne-Rhône-Alpes', country=country)
+        region = Region.objects.create(id='FR-IDF', name='Île-de-France', country=country)
+        VisitedRegion.objects.create(user=self.user, region=region)
+
+    def test_001_import_invalidates_cached_stats(self):
+        url = '/api/stats/counts/testuser/'
+        self.assertEqual(self.client.get(url).json()['visited_region_count'], 1)
+
+        command = download_countries.Command(stdout=io.StringIO())
+        with command._stage_tables():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {download_countries.STAGE_COUNTRY_TABLE} (country_code, name) VALUES ('FR', 'France')"
+                )
+                cursor.execute(
+                    f"INSERT INTO {download_countries.STAGE_REGION_TABLE} (id, name, country_code) "
+                    "VALUES ('FR-ARA', 'Auvergne-Rhône-Alpes', 'FR')"
+                )
+            command._apply_stage_tables('test')
+
+        self.assertFalse(VisitedRegion.objects.exists())
+        self.assertEqual(self.client.get(url).json()['visited_region_count'], 0)
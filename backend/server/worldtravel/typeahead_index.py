@@ -0,0 +1,327 @@
+"""
+In-process typeahead over the Country, Region and City tables.
+
+Every name is indexed under its normalized form (case and accents folded,
+punctuation collapsed to spaces) and under each suffix starting at a word,
+so 'york' finds 'New York'. The keys are kept in one sorted list and a prefix
+is answered with two bisects; nothing touches the database per keystroke.
+"""
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db.models import Count
+
+from worldtravel.models import City, Country, Region, VisitedCity, VisitedRegion
+from worldtravel.utils import get_world_data_version
+
+COUNTRY, REGION, CITY = 0, 1, 2
+KIND_NAMES = ('country', 'region', 'city')
+
+# How often (seconds) the index checks whether the world data was re-imported.
+VERSION_CHECK_INTERVAL = 60
+
+# Word suffixes indexed per name besides the full name
+MAX_WORD_KEYS = 4
+
+# Prefix ranges up to this many keys are ranked exhaustively; broader ones
+# (one or two letters) walk the entries from most popular down instead.
+MAX_RANGE_SCAN = 5000
+
+# Entries the popularity walk looks at before giving up on a filtered query
+MAX_POPULAR_SCAN = 50000
+
+VISITED_CACHE_PREFIX = 'worldtravel:typeahead:visited:'
+
+_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize_typeahead_text(value):
+    """Fold case and accents and collapse punctuation, e.g. 'Saint-Étienne' -> 'saint etienne'."""
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return _SEPARATORS.sub(' ', stripped).strip()
+
+
+class TypeaheadIndex:
+    """
+    Prefix index over places. `countries` yields (id, name, country_code,
+    popularity), `regions` (id, name, country_id, popularity) and `cities`
+    (id, name, region_id, popularity); popularity is any non-negative score.
+    """
+
+    def __init__(self, countries, regions, cities):
+        self.kinds = array('B')
+        self.ids = []
+        self.names = []
+        self.normalized = []
+        self.parent = array('i')
+        self.children = {}
+        self._areas = {}
+        self.popularity = array('I')
+        self.country_codes = {}
+        self._positions = {}
+        # Regions refer to their country by pk, the API by code
+        country_positions = {}
+
+        for country_id, name, code, popularity in countries:
+            self._add(COUNTRY, country_id, name, -1, popularity)
+            position = len(self.ids) - 1
+            self.country_codes[position] = code
+            self._positions[(COUNTRY, code.upper())] = position
+            country_positions[country_id] = position
+        for region_id, name, country_id, popularity in regions:
+            self._add(REGION, region_id, name, country_positions.get(country_id, -1), popularity)
+        for city_id, name, region_id, popularity in cities:
+            self._add(CITY, city_id, name, self._positions.get((REGION, region_id), -1), popularity)
+
+        pairs = []
+        for position, normalized in enumerate(self.normalized):
+            if not normalized:
+                continue
+            pairs.append((normalized, position))
+            start = 0
+            for _ in range(MAX_WORD_KEYS):
+                start = normalized.find(' ', start) + 1
+                if not start:
+                    break
+                pairs.append((normalized[start:], position))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.key_positions = array('I', (position for _, position in pairs))
+
+        # Most popular first; among equals shorter names first
+        self.by_popularity = array('I', sorted(
+            range(len(self.ids)), key=lambda position: (-self.popularity[position], len(self.names[position]))
+        ))
+
+    def _add(self, kind, place_id, name, parent, popularity):
+        self.kinds.append(kind)
+        self.ids.append(place_id)
+        self.names.append(name)
+        self.normalized.append(normalize_typeahead_text(name))
+        self.parent.append(parent)
+        if parent != -1:
+            self.children.setdefault(parent, []).append(len(self.ids) - 1)
+        self.popularity.append(max(0, int(popularity or 0)))
+        if kind != COUNTRY:
+            self._positions[(kind, place_id)] = len(self.ids) - 1
+
+    def _area(self, position):
+        """`position` and every place below it, remembered for the next query."""
+        area = self._areas.get(position)
+        if area is None:
+            area = array('I', [position])
+            for child in self.children.get(position, ()):
+                area.extend(self._area(child))
+            self._areas[position] = area
+        return area
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, kind, place_id):
+        return self._positions.get((kind, place_id))
+
+    def country_of(self, position):
+        while position != -1 and self.kinds[position] != COUNTRY:
+            position = self.parent[position]
+        return position
+
+    def region_of(self, position):
+        if self.kinds[position] == CITY:
+            return self.parent[position]
+        return position if self.kinds[position] == REGION else -1
+
+    def visited_positions(self, region_ids, city_ids):
+        """Positions of the given regions and cities plus the countries they lie in."""
+        positions = set()
+        for kind, ids in ((REGION, region_ids), (CITY, city_ids)):
+            for place_id in ids:
+                position = self._positions.get((kind, place_id))
+                if position is not None:
+                    positions.add(position)
+                    country = self.country_of(position)
+                    if country != -1:
+                        positions.add(country)
+        return positions
+
+    def search(self, text, limit=10, kinds=None, country_code=None, region_id=None, visited=frozenset()):
+        """
+        Up to `limit` (position, visited) pairs of places whose name, or a
+        word of it, starts with `text`. Visited places come first, then exact
+        names, then the most popular, then names starting with `text`, then
+        shorter names.
+        """
+        prefix = normalize_typeahead_text(text)
+        if not prefix or limit <= 0:
+            return []
+
+        country = -2 if country_code is None else self._positions.get((COUNTRY, country_code.upper()), -3)
+        region = -2 if region_id is None else self._positions.get((REGION, region_id), -3)
+        if country == -3 or region == -3:
+            return []
+
+        def allowed(position):
+            if kinds is not None and self.kinds[position] not in kinds:
+                return False
+            if country != -2 and self.country_of(position) != country:
+                return False
+            if region != -2 and self.region_of(position) != region:
+                return False
+            return True
+
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\U0010ffff', lo)
+        candidates = set()
+
+        padded = ' ' + prefix
+        area = self._area(region if region != -2 else country) if region != -2 or country != -2 else None
+        if area is not None and len(area) < hi - lo:
+            # A small area is cheaper to walk than a broad prefix range
+            candidates.update(
+                position for position in area
+                if padded in ' ' + self.normalized[position] and allowed(position)
+            )
+        elif hi - lo <= MAX_RANGE_SCAN:
+            candidates.update(position for position in self.key_positions[lo:hi] if allowed(position))
+        else:
+            # Exact names sort first in the range
+            for i in range(lo, hi):
+                if self.keys[i] != prefix:
+                    break
+                if allowed(self.key_positions[i]):
+                    candidates.add(self.key_positions[i])
+            candidates.update(
+                position for position in visited
+                if padded in ' ' + self.normalized[position] and allowed(position)
+            )
+            found = 0
+            for scanned, position in enumerate(self.by_popularity):
+                if found >= limit or scanned >= MAX_POPULAR_SCAN:
+                    break
+                if position not in candidates and padded in ' ' + self.normalized[position] and allowed(position):
+                    candidates.add(position)
+                    found += 1
+
+        def rank(position):
+            normalized = self.normalized[position]
+            return (
+                position not in visited, normalized != prefix, -self.popularity[position],
+                not normalized.startswith(prefix), len(normalized), self.kinds[position], normalized,
+            )
+
+        return [(position, position in visited) for position in sorted(candidates, key=rank)[:limit]]
+
+    def describe(self, position, visited=False):
+        """API representation of the place at `position`."""
+        region = self.region_of(position)
+        country = self.country_of(position)
+        return {
+            'type': KIND_NAMES[self.kinds[position]],
+            'id': self.ids[position],
+            'name': self.names[position],
+            'region_id': self.ids[region] if region != -1 else None,
+            'region': self.names[region] if region != -1 else None,
+            'country_code': self.country_codes[country] if country != -1 else None,
+            'country': self.names[country] if country != -1 else None,
+            'visited': visited,
+        }
+
+
+def build_typeahead_index():
+    """
+    Build the index from the database. Popularity is how often a place is
+    marked visited or used by a location, across all users.
+    """
+    from adventures.models import Location
+
+    def counts(queryset, field):
+        return dict(queryset.exclude(**{field: None}).values_list(field).annotate(n=Count('pk')).order_by())
+
+    region_popularity = counts(VisitedRegion.objects, 'region_id')
+    for region_id, n in counts(Location.objects, 'region_id').items():
+        region_popularity[region_id] = region_popularity.get(region_id, 0) + n
+    city_popularity = counts(VisitedCity.objects, 'city_id')
+    for city_id, n in counts(Location.objects, 'city_id').items():
+        city_popularity[city_id] = city_popularity.get(city_id, 0) + n
+    country_popularity = counts(Location.objects, 'country_id')
+
+    return TypeaheadIndex(
+        (
+            (country_id, name, code, country_popularity.get(country_id, 0))
+            for country_id, name, code in Country.objects.order_by('id').values_list('id', 'name', 'country_code')
+        ),
+        (
+            (region_id, name, country_id, region_popularity.get(region_id, 0))
+            for region_id, name, country_id in Region.objects.order_by('id').values_list('id', 'name', 'country_id')
+        ),
+        (
+            (city_id, name, region_id, city_popularity.get(city_id, 0))
+            for city_id, name, region_id in City.objects.order_by('id').values_list(
+                'id', 'name', 'region_id'
+            ).iterator(chunk_size=5000)
+        ),
+    )
+
+
+_index = None
+_index_version = None
+_index_checked_at = 0.0
+_index_lock = threading.Lock()
+
+
+def get_typeahead_index():
+    """
+    Return the process-wide typeahead index, building it on first use and
+    rebuilding it when `download-countries` has imported new world data.
+    """
+    global _index, _index_version, _index_checked_at
+
+    now = time.monotonic()
+    if _index is not None and now - _index_checked_at < VERSION_CHECK_INTERVAL:
+        return _index
+
+    with _index_lock:
+        version = get_world_data_version()
+        _index_checked_at = time.monotonic()
+        if _index is None or version != _index_version:
+            _index = build_typeahead_index()
+            _index_version = version
+        return _index
+
+
+def invalidate_typeahead_index():
+    """Drop the in-process index so the next lookup rebuilds it."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+def get_visited_place_ids(user_id):
+    """
+    (region ids, city ids) `user_id` has visited, cached until their data
+    generation moves (see adventures.utils.response_cache).
+    """
+    from adventures.utils.response_cache import get_generation
+
+    try:
+        key = f'{VISITED_CACHE_PREFIX}{user_id}:{get_generation(user_id)}'
+        visited = cache.get(key)
+    except Exception:
+        key = visited = None
+    if visited is None:
+        visited = (
+            list(VisitedRegion.objects.filter(user_id=user_id).values_list('region_id', flat=True)),
+            list(VisitedCity.objects.filter(user_id=user_id).values_list('city_id', flat=True)),
+        )
+        if key is not None:
+            try:
+                cache.set(key, visited, 60 * 60 * 24)
+            except Exception:
+                pass
+    return visited
@@ -2,7 +2,7 @@
 
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
-from .views import CountryViewSet, RegionViewSet, VisitedRegionViewSet, regions_by_country, visits_by_country, cities_by_region, VisitedCityViewSet, visits_by_region, globespin
+from .views import CountryViewSet, RegionViewSet, VisitedRegionViewSet, regions_by_country, visits_by_country, cities_by_region, VisitedCityViewSet, visits_by_region, globespin, typeahead
 router = DefaultRouter()
 router.register(r'countries', CountryViewSet, basename='countries')
 router.register(r'regions', RegionViewSet, basename='regions')
@@ -16,4 +16,5 @@ urlpatterns = [
     path('regions/<str:region_id>/cities/', cities_by_region, name='cities-by-region'),
     path('regions/<str:region_id>/cities/visits/', visits_by_region, name='visits-by-region'),
     path('globespin/', globespin, name='globespin'),
+    path('typeahead/', typeahead, name='typeahead'),
 ]
@@ -0,0 +1,25 @@
+import time
+from django.core.cache import cache
+
+WORLD_DATA_VERSION_KEY = 'worldtravel:data_version'
+
+
+def get_world_data_version():
+    """
+    Return the token identifying the currently imported world travel data.
+    Bumped by `download-countries` so in-process indexes built from the
+    Country/Region/City tables know when to rebuild.
+    """
+    try:
+        return cache.get(WORLD_DATA_VERSION_KEY, 0)
+    except Exception:
+        # Cache backend unavailable; treat the data as never changing.
+        return 0
+
+
+def bump_world_data_version():
+    """Mark the world travel data as changed after an import."""
+    try:
+        cache.set(WORLD_DATA_VERSION_KEY, time.time_ns(), None)
+    except Exception:
+        pass
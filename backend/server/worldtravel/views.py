@@ -7,6 +7,12 @@ from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes, action
 from django.contrib.gis.geos import Point
 from adventures.models import Location
+from adventures.utils.conditional_get import ConditionalGetMixin
+from worldtravel.utils import get_world_data_version
+from worldtravel.typeahead_index import KIND_NAMES, get_typeahead_index, get_visited_place_ids
+
+# Most places /api/typeahead/ returns
+MAX_TYPEAHEAD_RESULTS = 50
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -40,6 +46,42 @@ def visits_by_region(request, region_id):
     serializer = VisitedCitySerializer(visits, many=True)
     return Response(serializer.data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def typeahead(request):
+    """
+    Countries, regions and cities whose name (or a word of it) starts with
+    ?query=, visited and popular places first. Optional ?types=country,city
+    restricts the kinds, ?country=<code> and ?region=<id> the area.
+    """
+    query = request.query_params.get('query', '').strip()
+    if not query:
+        return Response({"error": "Search query is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    kinds = None
+    types = request.query_params.get('types')
+    if types:
+        requested = {name.strip() for name in types.split(',') if name.strip()}
+        unknown = requested - set(KIND_NAMES)
+        if unknown:
+            return Response({"error": f"Unknown types: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+        kinds = {KIND_NAMES.index(name) for name in requested}
+
+    try:
+        limit = int(request.query_params.get('limit', 10))
+    except ValueError:
+        return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+    limit = max(1, min(limit, MAX_TYPEAHEAD_RESULTS))
+
+    index = get_typeahead_index()
+    visited = index.visited_positions(*get_visited_place_ids(request.user.id))
+    matches = index.search(
+        query, limit=limit, kinds=kinds, visited=visited,
+        country_code=request.query_params.get('country') or None,
+        region_id=request.query_params.get('region') or None,
+    )
+    return Response([index.describe(position, is_visited) for position, is_visited in matches])
+
 # view called spin the globe that return a random country, a random region in that country and a random city in that region
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -61,7 +103,14 @@ def globespin(request):
     
     return Response(data)
 
-class CountryViewSet(viewsets.ReadOnlyModelViewSet):
+class WorldDataConditionalGetMixin(ConditionalGetMixin):
+    # World data has no updated_at; it only changes when re-imported
+    etag_timestamp_field = None
+
+    def get_etag_parts(self):
+        return [get_world_data_version()]
+
+class CountryViewSet(WorldDataConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Country.objects.all().order_by('name')
     serializer_class = CountrySerializer
     permission_classes = [IsAuthenticated]
@@ -95,7 +144,7 @@ class CountryViewSet(viewsets.ReadOnlyModelViewSet):
                     continue
         return Response({'regions_visited': count})
 
-class RegionViewSet(viewsets.ReadOnlyModelViewSet):
+class RegionViewSet(WorldDataConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Region.objects.all()
     serializer_class = RegionSerializer
     permission_classes = [IsAuthenticated]
@@ -1,4 +1,7 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
 
@@ -8,6 +11,9 @@ ADVENTURELOG_CDN_VERSION = 'v0.0.1'
 # https://github.com/dr5hn/countries-states-cities-database/tags
 COUNTRY_REGION_JSON_VERSION = 'v2.5' # Test on past and latest versions to ensure that the data schema is consistent before updating
 
+# Number of flags downloaded at the same time
+FLAG_DOWNLOAD_WORKERS = int(os.getenv('FLAG_DOWNLOAD_WORKERS', 8))
+
 def makeDataDir():
     """
     Creates the data directory if it doesn't exist
@@ -37,46 +43,90 @@ def downloadCountriesStateCities():
         f.write(res.text)
         print('Countries, states and cities data downloaded successfully')
 
-def saveCountryFlag(country_code, name):
+def saveCountryFlag(session, flags_dir, manifest, country_code, name):
     """
-    Downloads the flag of a country and saves it in the data/flags directory
+    Downloads the flag of a country into the data/flags directory.
+    Flags that are already present are revalidated with the ETag/Last-Modified
+    recorded in the manifest and only rewritten when the image changed.
     """
     # For standards, use the lowercase country_code
     country_code = country_code.lower()
-    # Save the flag in the data/flags directory
-    flags_dir = os.path.join(os.path.dirname(__file__), 'data', 'flags')
-
-    # Check if the flags directory exists, if not, create it
-    if not os.path.exists(flags_dir):
-        os.makedirs(flags_dir)
-
-    # Check if the flag already exists in the media folder
     flag_path = os.path.join(flags_dir, f'{country_code}.png')
+    entry = manifest.get(country_code, {})
+
+    headers = {}
     if os.path.exists(flag_path):
-        # remove the flag if it already exists
-        os.remove(flag_path)
-        print(f'Flag for {country_code} ({name}) removed')
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
 
-    res = requests.get(f'https://flagcdn.com/h240/{country_code}.png'.lower())
-    if res.status_code == 200:
-        with open(flag_path, 'wb') as f:
+    try:
+        res = session.get(f'https://flagcdn.com/h240/{country_code}.png', headers=headers, timeout=(5, 30))
+    except requests.exceptions.RequestException as e:
+        print(f'Error downloading flag for {country_code} ({name}): {e}')
+        return country_code, None
+
+    if res.status_code == 304:
+        return country_code, entry
+    if res.status_code != 200:
+        print(f'Error downloading flag for {country_code} ({name})')
+        return country_code, None
+
+    digest = hashlib.sha256(res.content).hexdigest()
+    if digest != entry.get('sha256') or not os.path.exists(flag_path):
+        tmp_path = f'{flag_path}.tmp'
+        with open(tmp_path, 'wb') as f:
             f.write(res.content)
+        os.replace(tmp_path, flag_path)
         print(f'Flag for {country_code} downloaded')
-    else:
-        print(f'Error downloading flag for {country_code} ({name})')
+
+    return country_code, {
+        'etag': res.headers.get('ETag'),
+        'last_modified': res.headers.get('Last-Modified'),
+        'sha256': digest,
+    }
 
 def saveCountryFlags():
     """
-    Downloads the flags of all countries and saves them in the data/flags directory
+    Downloads the flags of all countries in parallel and saves them in the data/flags directory
     """
     # Load the countries data
     with open(os.path.join(os.path.dirname(__file__), 'data', f'countries_states_cities.json')) as f:
         data = json.load(f)
 
-    for country in data:
-        country_code = country['iso2']
-        name = country['name']
-        saveCountryFlag(country_code, name)
+    flags_dir = os.path.join(os.path.dirname(__file__), 'data', 'flags')
+    os.makedirs(flags_dir, exist_ok=True)
+
+    # ETag, Last-Modified and hash of every flag from the previous run
+    manifest_path = os.path.join(flags_dir, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    # One pooled session shared by all workers so connections are reused
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=FLAG_DOWNLOAD_WORKERS, max_retries=2)
+    session.mount('https://', adapter)
+
+    with session, ThreadPoolExecutor(max_workers=FLAG_DOWNLOAD_WORKERS) as executor:
+        futures = [
+            executor.submit(saveCountryFlag, session, flags_dir, manifest, country['iso2'], country['name'])
+            for country in data
+        ]
+        results = [future.result() for future in futures]
+
+    for country_code, entry in results:
+        if entry is not None:
+            manifest[country_code] = entry
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    failed = sum(1 for _, entry in results if entry is None)
+    print(f'Flags checked: {len(results)}, failed: {failed}')
 
 # Run the functions
 print('Starting CDN update')